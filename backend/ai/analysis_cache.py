@@ -0,0 +1,146 @@
+import copy
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from utils.db import get_db
+
+# Module-level cache instance (configured from the Flask app on first use)
+_cache = None
+_cache_lock = threading.Lock()
+
+class AnalysisCache:
+    """Two-tier cache for Gemini analysis results.
+
+    Results are keyed by a content hash of the uploaded image bytes plus the
+    prompt and model version, so the same photo never reaches Gemini twice.
+    Lookups go to an in-process LRU first and fall back to the
+    `analysis_cache` Mongo collection, which expires documents through a TTL
+    index on `expires_at`.
+    """
+
+    def __init__(self, ttl_seconds=7 * 24 * 3600, max_entries=512, use_mongo=True):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.use_mongo = use_mongo
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'mongo_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def make_key(image_paths, model, prompt_version):
+        """Build a cache key from image content, model and prompt version"""
+        digest = hashlib.sha256()
+        digest.update(f"{model}:{prompt_version}".encode('utf-8'))
+        for image_path in image_paths:
+            file_digest = hashlib.sha256()
+            with open(image_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    file_digest.update(chunk)
+            digest.update(file_digest.digest())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return cached results for key, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, results = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return copy.deepcopy(results)
+                del self._entries[key]
+
+        results = self._mongo_get(key)
+        with self._lock:
+            if results is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['mongo_hits'] += 1
+        # Promote to the memory tier so the next hit skips Mongo
+        self._memory_set(key, results)
+        return copy.deepcopy(results)
+
+    def set(self, key, results):
+        """Store results under key in both tiers"""
+        self._memory_set(key, results)
+        self._mongo_set(key, results)
+        with self._lock:
+            self._stats['stores'] += 1
+
+    def stats(self):
+        """Return hit/miss counters and current memory tier size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['mongo_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['mongo_hits']) / lookups, 3) if lookups else 0
+        return stats
+
+    def clear(self):
+        """Drop all entries from the memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def _memory_set(self, key, results):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(results))
+            self._entries.move_to_end(key)
+            # Evict least recently used entries beyond the size limit
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _mongo_get(self, key):
+        if not self.use_mongo:
+            return None
+        try:
+            doc = get_db().analysis_cache.find_one({
+                '_id': key,
+                # The TTL monitor only runs periodically, so filter explicitly
+                'expires_at': {'$gt': datetime.datetime.utcnow()}
+            })
+        except Exception as e:
+            print(f"Analysis cache lookup failed: {e}")
+            return None
+        return doc['results'] if doc else None
+
+    def _mongo_set(self, key, results):
+        if not self.use_mongo:
+            return
+        now = datetime.datetime.utcnow()
+        try:
+            get_db().analysis_cache.replace_one(
+                {'_id': key},
+                {
+                    'results': results,
+                    'created_at': now,
+                    'expires_at': now + datetime.timedelta(seconds=self.ttl_seconds)
+                },
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Analysis cache store failed: {e}")
+
+def get_analysis_cache(config):
+    """Get the process-wide analysis cache, creating it from app config"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnalysisCache(
+                    ttl_seconds=config.get('ANALYSIS_CACHE_TTL', 7 * 24 * 3600),
+                    max_entries=config.get('ANALYSIS_CACHE_MAX_ENTRIES', 512),
+                    use_mongo=config.get('ANALYSIS_CACHE_MONGO', True)
+                )
+    return _cache
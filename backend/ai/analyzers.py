@@ -0,0 +1,17 @@
+from ai.gemini_analyzer import GeminiAnalyzer
+from ai.local_analyzer import LocalAnalyzer
+
+# Analyzer backends by name. Each provides analyze_outfit(image_paths) and
+# stream_outfit_analysis(image_paths) returning the same result schema.
+ANALYZERS = {
+    'gemini': GeminiAnalyzer,
+    'local': LocalAnalyzer
+}
+
+def get_analyzer(config):
+    """Get the analyzer backend selected by ANALYZER_BACKEND"""
+    name = config.get('ANALYZER_BACKEND', 'gemini')
+    if name not in ANALYZERS:
+        print(f"Unknown analyzer backend '{name}'. Using gemini.")
+        return GeminiAnalyzer
+    return ANALYZERS[name]
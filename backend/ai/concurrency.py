@@ -0,0 +1,125 @@
+import threading
+import time
+
+# Seconds between checks of a waiter's cancel event
+CANCEL_POLL = 0.05
+
+class LimiterTimeout(Exception):
+    """Raised when a caller waited too long for a concurrency slot"""
+
+class AdaptiveLimiter:
+    """Concurrency limiter that adapts its limit with AIMD.
+
+    The limit grows additively (about one slot per limit's worth of
+    successful calls) and is cut multiplicatively when the provider pushes
+    back with 429/5xx or when latency spikes well above its moving average.
+    Callers beyond the limit queue until a slot frees up or their deadline
+    passes.
+    """
+
+    SUCCESS = 'success'
+    OVERLOAD = 'overload'
+    IGNORE = 'ignore'
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, decrease_factor=0.5,
+                 latency_spike_factor=2.0, queue_timeout=10, cooldown=1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.queue_timeout = queue_timeout
+        self.cooldown = cooldown
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._waiting = 0
+        self._latency_ewma = None
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+        self._stats = {
+            'acquired': 0,
+            'timeouts': 0,
+            'increases': 0,
+            'decreases': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+    @property
+    def limit(self):
+        return max(self.min_limit, int(self._limit))
+
+    def acquire(self, timeout=None, cancel=None):
+        """Wait for a slot, returning the time spent waiting in seconds.
+
+        Waiting stops early with LimiterTimeout once the optional cancel
+        event is set (a hedged call that has already been answered).
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        raise LimiterTimeout('Gave up waiting for a Gemini slot')
+                    if self._in_flight < self.limit:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise LimiterTimeout(f"No Gemini slot free after {timeout}s")
+                    # Nothing notifies on cancel, so look again every so often
+                    self._condition.wait(remaining if cancel is None else min(remaining, CANCEL_POLL))
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+            waited = time.monotonic() - started
+            self._stats['acquired'] += 1
+            self._stats['total_wait_ms'] += waited * 1000
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], waited * 1000)
+        return waited
+
+    def release(self, outcome, latency=None):
+        """Free a slot and adjust the limit based on how the call went"""
+        with self._condition:
+            self._in_flight -= 1
+
+            if outcome == self.SUCCESS and latency is not None and self._is_latency_spike(latency):
+                outcome = self.OVERLOAD
+
+            if outcome == self.SUCCESS:
+                if self._limit < self.max_limit:
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                    self._stats['increases'] += 1
+            elif outcome == self.OVERLOAD:
+                # One burst of rejections should only cut the limit once
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self._stats['decreases'] += 1
+
+            self._condition.notify_all()
+
+    def stats(self):
+        """Return the current limit, queue depth and wait-time counters"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['limit'] = self.limit
+            stats['in_flight'] = self._in_flight
+            stats['queue_depth'] = self._waiting
+            stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['acquired'], 2) if stats['acquired'] else 0
+            stats['latency_ewma_ms'] = round(self._latency_ewma * 1000, 1) if self._latency_ewma else None
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 2)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 2)
+        return stats
+
+    def _is_latency_spike(self, latency):
+        """Update the latency moving average and report whether this call spiked"""
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+            return False
+        spike = latency > self._latency_ewma * self.latency_spike_factor
+        self._latency_ewma = 0.9 * self._latency_ewma + 0.1 * latency
+        return spike
@@ -0,0 +1,191 @@
+"""Local stand-in for the Gemini REST API with injectable latency.
+
+Serves generateContent and streamGenerateContent for any model with a
+canned outfit analysis, after sleeping for a delay drawn from a
+configurable distribution. Point the app at it to exercise timeouts,
+hedging and fallbacks offline:
+
+    python -m ai.fake_gemini_server --port 8089 --latency lognormal:0.8,0.5 \
+        --tail 0.05:10 --model-latency gemini-1.5-flash-8b=fixed:0.3
+    GEMINI_API_BASE=http://127.0.0.1:8089/v1beta GEMINI_API_KEY=fake python run.py
+
+Latency specs are 'fixed:S', 'uniform:LOW,HIGH' or 'lognormal:MEDIAN,SIGMA'
+(all in seconds). --tail P:S adds S extra seconds to a fraction P of calls.
+--error-rate P answers a fraction P of calls with 503. --latency-per-kb S
+adds S seconds per KB of request body, to model upload and image tokens.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_RESULT = {
+    'overallScore': 7.8,
+    'style': 'Smart Casual',
+    'colorHarmony': 84,
+    'fit': 88,
+    'occasion': ['Office', 'Casual Dinner'],
+    'bodyShape': 'Rectangle',
+    'fabrics': ['Cotton', 'Denim'],
+    'brands': ['Unidentified'],
+    'sustainability': {'score': 70, 'feedback': 'Mostly durable natural fibers.'},
+    'recommendations': [
+        'Add a belt to define the waist.',
+        'Swap the sneakers for loafers to dress the look up.',
+        'A structured jacket would sharpen the silhouette.'
+    ]
+}
+
+MODEL_PATH = re.compile(r'/models/([^/:]+):(generateContent|streamGenerateContent)')
+
+def parse_latency(spec):
+    """Turn a latency spec string into a zero-argument sampler"""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v]
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class FakeGeminiServer:
+    """Threaded HTTP server that mimics the Gemini generateContent API"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency='fixed:0', model_latency=None,
+                 tail=None, error_rate=0.0, latency_per_kb=0.0, result=None):
+        self.default_latency = parse_latency(latency)
+        self.model_latency = {
+            model: parse_latency(spec) for model, spec in (model_latency or {}).items()
+        }
+        self.tail = tail
+        self.error_rate = error_rate
+        self.latency_per_kb = latency_per_kb
+        self.result = result or FAKE_RESULT
+        self.calls = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def api_base(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def start(self):
+        """Serve from a background thread (for tests and benchmarks)"""
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def sample_delay(self, model, body_bytes=0):
+        delay = self.model_latency.get(model, self.default_latency)()
+        delay += self.latency_per_kb * body_bytes / 1024
+        if self.tail and random.random() < self.tail[0]:
+            delay += self.tail[1]
+        return max(0.0, delay)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                match = MODEL_PATH.search(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not match:
+                    self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+                    return
+
+                model, method = match.groups()
+                delay = server.sample_delay(model, len(body))
+                with server._lock:
+                    server.calls.append({'model': model, 'method': method, 'delay': delay, 'bytes': len(body)})
+                time.sleep(delay)
+
+                if random.random() < server.error_rate:
+                    self._send_json(503, {'error': {'code': 503, 'message': 'Service unavailable'}})
+                    return
+
+                text = json.dumps(server.result)
+                usage = {
+                    'promptTokenCount': 258 + len(body) // 1000,
+                    'candidatesTokenCount': len(text) // 4,
+                    'totalTokenCount': 258 + len(body) // 1000 + len(text) // 4
+                }
+                if method == 'generateContent':
+                    self._send_json(200, {
+                        'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}}],
+                        'usageMetadata': usage
+                    })
+                else:
+                    self._send_stream(text, usage)
+
+            def _send_json(self, status, data):
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self, text, usage):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                chunk_size = 40
+                for start in range(0, len(text), chunk_size):
+                    chunk = {'candidates': [{'content': {'parts': [{'text': text[start:start + chunk_size]}]}}]}
+                    if start + chunk_size >= len(text):
+                        chunk['usageMetadata'] = usage
+                    event = f"data: {json.dumps(chunk)}\r\n\r\n".encode('utf-8')
+                    self.wfile.write(f"{len(event):x}\r\n".encode('ascii') + event + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Gemini API server with injectable latency')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='lognormal:0.8,0.4')
+    parser.add_argument('--model-latency', action='append', default=[], metavar='MODEL=SPEC')
+    parser.add_argument('--tail', default=None, metavar='P:SECONDS')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--latency-per-kb', type=float, default=0.0)
+    args = parser.parse_args()
+
+    tail = None
+    if args.tail:
+        probability, _, seconds = args.tail.partition(':')
+        tail = (float(probability), float(seconds))
+
+    server = FakeGeminiServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        model_latency=dict(item.split('=', 1) for item in args.model_latency),
+        tail=tail,
+        error_rate=args.error_rate,
+        latency_per_kb=args.latency_per_kb
+    )
+    print(f"Fake Gemini API listening on {server.api_base}")
+    server.httpd.serve_forever()
+
+if __name__ == '__main__':
+    main()
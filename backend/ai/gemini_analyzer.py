@@ -1,49 +1,21 @@
-import os
-import base64
 import json
-import requests
+import time
 from flask import current_app
-from PIL import Image
-import io
+from ai.analysis_cache import AnalysisCache, get_analysis_cache
+from ai.local_analyzer import LocalAnalyzer
+from ai.image_prep import build_collage, prepare_images, to_inline_part
+from ai.stream_parser import IncrementalFieldParser
+from ai.single_flight import MongoLease, get_single_flight
+from ai.hedging import get_latency_tracker, run_hedged
+from ai.gemini_client import CircuitBreaker, GeminiUnavailable, get_gemini_client
+from ai.telemetry import get_telemetry_store
+from utils.uploads import get_upload_store
 
-class GeminiAnalyzer:
-    """Class for analyzing outfit images using Google's Gemini API"""
-    
-    @staticmethod
-    def analyze_outfit(image_paths):
-        """Analyze outfit images using Gemini API"""
-        try:
-            api_key = current_app.config.get('GEMINI_API_KEY')
-            if not api_key:
-                print("Gemini API key not found. Using mock data.")
-                return GeminiAnalyzer._mock_analysis_results()
-            
-            # Process images
-            image_parts = []
-            for image_path in image_paths:
-                try:
-                    # Resize image to reduce payload size
-                    with Image.open(image_path) as img:
-                        img = img.resize((512, 512), Image.LANCZOS)
-                        buffered = io.BytesIO()
-                        img.save(buffered, format="JPEG", quality=85)
-                        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                        
-                    image_parts.append({
-                        "inlineData": {
-                            "mimeType": "image/jpeg",
-                            "data": img_str
-                        }
-                    })
-                except Exception as e:
-                    print(f"Error processing image {image_path}: {e}")
-                    continue
-            
-            if not image_parts:
-                return GeminiAnalyzer._mock_analysis_results()
+# Bump whenever the prompt or image preprocessing changes so cached
+# results are not reused
+PROMPT_VERSION = '2'
 
-            # Prepare prompt
-            prompt = """
+ANALYSIS_PROMPT = """
             You are a fashion analysis AI. Analyze this outfit image and provide detailed feedback in JSON format.
             Include the following information:
             - overallScore: A score from 1-10 rating the outfit's overall appeal
@@ -59,83 +31,437 @@ class GeminiAnalyzer:
             
             Return ONLY the JSON object with no additional text.
             """
+
+# Appended to the prompt when several photos are tiled into one image
+COLLAGE_PROMPT = """
+            The image is a collage of {count} photos of the same outfit, arranged in a grid of
+            {rows} row(s) by {columns} column(s) and read left to right, top to bottom.
+            Treat the tiles as different views of one outfit and return a single analysis.
+            """
+
+REQUIRED_FIELDS = [
+    'overallScore', 'style', 'colorHarmony', 'fit', 'occasion',
+    'bodyShape', 'fabrics', 'brands', 'sustainability', 'recommendations'
+]
+
+LIST_FIELDS = ['occasion', 'fabrics', 'brands', 'recommendations']
+
+class GeminiAnalyzer:
+    """Class for analyzing outfit images using Google's Gemini API"""
+    
+    @staticmethod
+    def analyze_outfit(image_paths, telemetry=None):
+        """Analyze outfit images using Gemini API
+        
+        If a telemetry dict is passed, telemetry['path'] is set to how the
+        result was produced: cache, primary, hedge, fallback_model,
+        coalesced or fallback. The same dict (with outcome, timings, payload
+        size, token counts and retries) is recorded in the telemetry store.
+        """
+        telemetry = telemetry if telemetry is not None else {}
+        started = time.perf_counter()
+        try:
+            return GeminiAnalyzer._analyze(image_paths, telemetry)
+        finally:
+            telemetry['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            telemetry['image_count'] = len(image_paths)
+            get_telemetry_store(current_app.config).record(telemetry)
+    
+    @staticmethod
+    def _analyze(image_paths, telemetry):
+        telemetry['path'] = 'fallback'
+        try:
+            api_key = current_app.config.get('GEMINI_API_KEY')
+            if not api_key:
+                print("Gemini API key not found. Using fallback analysis.")
+                telemetry['outcome'] = 'no_api_key'
+                return GeminiAnalyzer._fallback_results(image_paths)
             
-            # Prepare request to Gemini API
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
+            model = current_app.config.get('GEMINI_MODEL', 'gemini-1.5-flash')
+            telemetry['model'] = model
             
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": prompt},
-                            *image_parts
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.4,
-                    "topK": 32,
-                    "topP": 1,
-                    "maxOutputTokens": 4096
-                }
-            }
+            # Fingerprint the image bytes so repeats can share one Gemini call
+            fingerprint = None
+            try:
+                fingerprint = AnalysisCache.make_key(image_paths, model, GeminiAnalyzer._prompt_version())
+            except OSError as e:
+                print(f"Error hashing images for analysis: {e}")
             
-            headers = {
-                "Content-Type": "application/json"
-            }
+            # Repeat uploads of the same bytes are answered from the cache
+            cache = None
+            if fingerprint and current_app.config.get('ANALYSIS_CACHE_ENABLED', True):
+                cache = get_analysis_cache(current_app.config)
+                cached_results = cache.get(fingerprint)
+                if cached_results is not None:
+                    telemetry['path'] = 'cache'
+                    telemetry['outcome'] = 'cache_hit'
+                    return cached_results
             
-            # Make request to Gemini API
-            response = requests.post(url, headers=headers, json=payload)
+            if fingerprint:
+                # Concurrent requests for the same images wait on one call;
+                # only the leader's telemetry dict gets filled in
+                leader_telemetry = {}
+                analysis_results = get_single_flight().do(
+                    fingerprint,
+                    lambda: GeminiAnalyzer._analyze_uncached(image_paths, api_key, model, fingerprint, cache, leader_telemetry)
+                )
+                telemetry.update(leader_telemetry or {'path': 'coalesced', 'outcome': 'coalesced'})
+            else:
+                analysis_results = GeminiAnalyzer._request_analysis(image_paths, api_key, model, telemetry)
             
-            if response.status_code != 200:
-                print(f"Error from Gemini API: {response.status_code} - {response.text}")
-                return GeminiAnalyzer._mock_analysis_results()
+            if analysis_results is None:
+                telemetry['path'] = 'fallback'
+                return GeminiAnalyzer._fallback_results(image_paths)
             
-            # Parse response
-            response_data = response.json()
+            return analysis_results
+                
+        except Exception as e:
+            print(f"Error analyzing outfit with Gemini API: {e}")
+            telemetry['path'] = 'fallback'
+            telemetry['outcome'] = 'error'
+            return GeminiAnalyzer._fallback_results(image_paths)
+    
+    @staticmethod
+    def stream_outfit_analysis(image_paths):
+        """Analyze outfit images, yielding fields as Gemini streams them.
+        
+        Yields ('field', name, value) for each top-level field as soon as it
+        is complete, then ('result', results) with the full analysis.
+        """
+        api_key = current_app.config.get('GEMINI_API_KEY')
+        model = current_app.config.get('GEMINI_MODEL', 'gemini-1.5-flash')
+        telemetry = {'path': 'stream', 'model': model, 'image_count': len(image_paths)}
+        started = time.perf_counter()
+        
+        analysis_results = None
+        if not api_key:
+            print("Gemini API key not found. Using fallback analysis.")
+            telemetry['outcome'] = 'no_api_key'
+        else:
+            try:
+                analysis_results = yield from GeminiAnalyzer._stream_analysis(image_paths, api_key, model, telemetry)
+            except Exception as e:
+                print(f"Error streaming outfit analysis from Gemini API: {e}")
+                telemetry['outcome'] = 'error'
+        
+        if analysis_results is None:
+            telemetry['path'] = 'fallback'
+            analysis_results = GeminiAnalyzer._fallback_results(image_paths)
+            for field, value in analysis_results.items():
+                yield ('field', field, value)
+        
+        telemetry['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        get_telemetry_store(current_app.config).record(telemetry)
+        yield ('result', analysis_results)
+    
+    @staticmethod
+    def _stream_analysis(image_paths, api_key, model, telemetry):
+        """Stream one Gemini analysis, returning the parsed results or None"""
+        fingerprint = None
+        cache = None
+        try:
+            fingerprint = AnalysisCache.make_key(image_paths, model, GeminiAnalyzer._prompt_version())
+        except OSError as e:
+            print(f"Error hashing images for analysis: {e}")
+        
+        if fingerprint and current_app.config.get('ANALYSIS_CACHE_ENABLED', True):
+            cache = get_analysis_cache(current_app.config)
+            cached_results = cache.get(fingerprint)
+            if cached_results is not None:
+                telemetry['path'] = 'cache'
+                telemetry['outcome'] = 'cache_hit'
+                for field, value in cached_results.items():
+                    yield ('field', field, value)
+                return cached_results
+        
+        client = get_gemini_client(current_app.config)
+        if client.breaker.state == CircuitBreaker.OPEN:
+            print("Gemini circuit breaker is open. Using fallback.")
+            telemetry['outcome'] = 'breaker_open'
+            return None
+        
+        started = time.perf_counter()
+        image_parts, timings, layout = GeminiAnalyzer._encode_images(image_paths)
+        telemetry['preprocess_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        telemetry['preprocess_ms_per_image'] = [timing['total_ms'] for timing in timings]
+        if not image_parts:
+            telemetry['outcome'] = 'no_images'
+            return None
+        
+        parser = IncrementalFieldParser()
+        text_fragments = []
+        started = time.perf_counter()
+        try:
+            for chunk in client.stream_generate_content(model, api_key, GeminiAnalyzer._build_payload(image_parts, layout), telemetry):
+                if 'usageMetadata' in chunk:
+                    telemetry.update(GeminiAnalyzer._usage(chunk))
+                for candidate in chunk.get('candidates', [])[:1]:
+                    for part in candidate.get('content', {}).get('parts', []):
+                        text = part.get('text', '')
+                        text_fragments.append(text)
+                        for field, value in parser.feed(text):
+                            yield ('field', field, value)
+        except GeminiUnavailable as e:
+            print(f"Gemini unavailable, falling back: {e}")
+            telemetry['outcome'] = 'unavailable'
+            return None
+        # Includes the time the client took to consume each field
+        telemetry['network_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        
+        # The assembled text goes through the same parser as non-streamed calls
+        started = time.perf_counter()
+        analysis_results = GeminiAnalyzer._parse_results(''.join(text_fragments))
+        telemetry['parse_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        telemetry['outcome'] = 'success' if analysis_results is not None else 'parse_failure'
+        if analysis_results is not None and cache:
+            cache.set(fingerprint, analysis_results)
+        return analysis_results
+    
+    @staticmethod
+    def _analyze_uncached(image_paths, api_key, model, fingerprint, cache, telemetry):
+        """Run one Gemini analysis for a fingerprint and cache the result"""
+        lease = None
+        # Optionally coordinate with other worker processes through Mongo:
+        # if another worker holds the lease, wait for its cached result
+        if cache and current_app.config.get('ANALYSIS_LEASES_ENABLED', False):
+            lease = MongoLease(fingerprint, current_app.config.get('ANALYSIS_LEASE_TTL', 90))
+            try:
+                if not lease.acquire():
+                    get_single_flight().record('lease_waits')
+                    shared_results = lease.wait(
+                        lambda: cache.get(fingerprint),
+                        timeout=current_app.config.get('ANALYSIS_LEASE_TTL', 90)
+                    )
+                    if shared_results is not None:
+                        get_single_flight().record('lease_hits')
+                        telemetry['path'] = 'coalesced'
+                        telemetry['outcome'] = 'coalesced'
+                        return shared_results
+            except Exception as e:
+                print(f"Analysis lease unavailable, continuing without it: {e}")
+        
+        try:
+            analysis_results = GeminiAnalyzer._request_analysis(image_paths, api_key, model, telemetry)
             
-            if 'candidates' not in response_data or not response_data['candidates']:
-                print("No candidates in Gemini API response")
-                return GeminiAnalyzer._mock_analysis_results()
+            # Only real results from the primary model are cached
+            if analysis_results is not None and cache and telemetry.get('path') != 'fallback_model':
+                cache.set(fingerprint, analysis_results)
             
-            text_content = response_data['candidates'][0]['content']['parts'][0]['text']
+            return analysis_results
+        finally:
+            if lease:
+                lease.release()
+    
+    @staticmethod
+    def _encode_images(image_paths):
+        """Downscale and base64-encode images as Gemini inline data parts.
+        
+        In collage mode several images are tiled into a single part. Returns
+        the parts, per-image preprocessing timings, and the collage layout
+        (None when each image is sent separately).
+        """
+        config = current_app.config
+        if config.get('ANALYSIS_COLLAGE_MODE', False) and len(image_paths) > 1:
+            collage = build_collage(
+                image_paths,
+                total_size=config.get('ANALYSIS_COLLAGE_SIZE', 1024),
+                quality=config.get('ANALYSIS_IMAGE_QUALITY', 85),
+                max_workers=config.get('IMAGE_PREP_WORKERS')
+            )
+            if collage is None:
+                return [], [], None
+            layout = {'rows': collage['rows'], 'columns': collage['columns'], 'count': len(collage['tiles'])}
+            return [to_inline_part(collage)], [{'path': 'collage', **collage['timings']}], layout
+        
+        max_size = config.get('ANALYSIS_IMAGE_SIZE', 512)
+        prepared = prepare_images(
+            image_paths,
+            max_size=max_size,
+            quality=config.get('ANALYSIS_IMAGE_QUALITY', 85),
+            max_workers=config.get('IMAGE_PREP_WORKERS'),
+            # Reuse the upload's JPEG derivative when one was made at this size
+            source_for=lambda path: get_upload_store().derivative_path(path, max_size)
+        )
+        
+        image_parts = [to_inline_part(image) for image in prepared if 'error' not in image]
+        timings = [
+            {'path': image['path'], **image['timings']}
+            for image in prepared if 'error' not in image
+        ]
+        return image_parts, timings, None
+    
+    @staticmethod
+    def _request_analysis(image_paths, api_key, model, telemetry):
+        """Call Gemini for the given images, returning None on any failure
+        
+        Fills telemetry with the outcome (success, breaker_open, no_images,
+        unavailable, no_candidates or parse_failure) and whatever was
+        measured before that point.
+        """
+        client = get_gemini_client(current_app.config)
+        
+        # Skip image processing entirely while the circuit is open
+        if client.breaker.state == CircuitBreaker.OPEN:
+            print("Gemini circuit breaker is open. Using fallback.")
+            telemetry['outcome'] = 'breaker_open'
+            return None
+        
+        # Process images
+        started = time.perf_counter()
+        image_parts, timings, layout = GeminiAnalyzer._encode_images(image_paths)
+        telemetry['preprocess_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        telemetry['preprocess_ms_per_image'] = [timing['total_ms'] for timing in timings]
+        if not image_parts:
+            telemetry['outcome'] = 'no_images'
+            return None
+        
+        payload = GeminiAnalyzer._build_payload(image_parts, layout)
+        
+        # Make request to Gemini API through the shared pooled client
+        try:
+            response_data, call_stats, telemetry['path'] = GeminiAnalyzer._generate(client, api_key, model, payload)
+        except GeminiUnavailable as e:
+            print(f"Gemini unavailable, falling back: {e}")
+            telemetry['outcome'] = 'unavailable'
+            return None
+        telemetry.update(call_stats)
+        telemetry.update(GeminiAnalyzer._usage(response_data))
+        
+        if 'candidates' not in response_data or not response_data['candidates']:
+            print("No candidates in Gemini API response")
+            telemetry['outcome'] = 'no_candidates'
+            return None
+        
+        started = time.perf_counter()
+        text_content = response_data['candidates'][0]['content']['parts'][0]['text']
+        analysis_results = GeminiAnalyzer._parse_results(text_content)
+        telemetry['parse_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        telemetry['outcome'] = 'success' if analysis_results is not None else 'parse_failure'
+        return analysis_results
+    
+    @staticmethod
+    def _generate(client, api_key, model, payload):
+        """Call generateContent, hedging slow calls when configured.
+        
+        A hedge request for the same model fires once the primary call has
+        run past GEMINI_HEDGE_PERCENTILE of recent latencies (at most
+        GEMINI_HEDGE_DELAY seconds). If neither has
+        answered by GEMINI_FALLBACK_AFTER, GEMINI_FALLBACK_MODEL is tried as
+        well. Returns the response, the winning attempt's client stats and
+        the name of the attempt that won.
+        """
+        config = current_app.config
+        hedging = config.get('GEMINI_HEDGING_ENABLED', False)
+        fallback_model = config.get('GEMINI_FALLBACK_MODEL')
+        tracker = get_latency_tracker()
+        
+        def attempt(attempt_model):
+            def run(cancel=None):
+                started = time.monotonic()
+                call_stats = {'model': attempt_model}
+                response_data = client.generate_content(attempt_model, api_key, payload, call_stats, cancel)
+                if attempt_model == model:
+                    tracker.record(time.monotonic() - started)
+                return response_data, call_stats
+            return run
+        
+        if not hedging and not fallback_model:
+            return (*attempt(model)(), 'primary')
+        
+        # GEMINI_HEDGE_DELAY caps the percentile, which drifts upwards when
+        # slow calls make up more than its share of the window
+        hedge_delay = config.get('GEMINI_HEDGE_DELAY', 8)
+        observed = tracker.percentile(config.get('GEMINI_HEDGE_PERCENTILE', 95))
+        if observed is not None:
+            hedge_delay = min(observed, hedge_delay)
+        
+        attempts = [('primary', 0, attempt(model))]
+        if hedging:
+            attempts.append(('hedge', hedge_delay, attempt(model)))
+        if fallback_model:
+            fallback_after = config.get('GEMINI_FALLBACK_AFTER') or hedge_delay * 2
+            attempts.append(('fallback_model', fallback_after, attempt(fallback_model)))
+        
+        (response_data, call_stats), name = run_hedged(attempts, max_workers=config.get('GEMINI_POOL_SIZE', 10) * 2)
+        return response_data, call_stats, name
+    
+    @staticmethod
+    def _usage(response_data):
+        """Token counts from a response's usageMetadata, if present"""
+        usage = response_data.get('usageMetadata') or {}
+        return {
+            'prompt_tokens': usage.get('promptTokenCount'),
+            'candidate_tokens': usage.get('candidatesTokenCount'),
+            'total_tokens': usage.get('totalTokenCount')
+        }
+    
+    @staticmethod
+    def _prompt_version():
+        """Prompt version plus preprocessing mode, for cache keys"""
+        if current_app.config.get('ANALYSIS_COLLAGE_MODE', False):
+            return f"{PROMPT_VERSION}-collage"
+        return PROMPT_VERSION
+    
+    @staticmethod
+    def _build_payload(image_parts, layout=None):
+        """Build the generateContent request body for the given image parts"""
+        prompt = ANALYSIS_PROMPT
+        if layout:
+            prompt += COLLAGE_PROMPT.format(**layout)
+        return {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt},
+                        *image_parts
+                    ]
+                }
+            ],
+            "generationConfig": {
+                "temperature": 0.4,
+                "topK": 32,
+                "topP": 1,
+                "maxOutputTokens": 4096
+            }
+        }
+    
+    @staticmethod
+    def _parse_results(text_content):
+        """Extract the analysis JSON object from Gemini's text output"""
+        try:
+            # Find JSON object in text (in case there's any extra text)
+            json_start = text_content.find('{')
+            json_end = text_content.rfind('}') + 1
             
-            # Extract JSON from text (in case there's any extra text)
-            try:
-                # Find JSON object in text
-                json_start = text_content.find('{')
-                json_end = text_content.rfind('}') + 1
-                
-                if json_start >= 0 and json_end > json_start:
-                    json_str = text_content[json_start:json_end]
-                    analysis_results = json.loads(json_str)
+            if json_start >= 0 and json_end > json_start:
+                json_str = text_content[json_start:json_end]
+                analysis_results = json.loads(json_str)
+            else:
+                # Try to parse the whole text as JSON
+                analysis_results = json.loads(text_content)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing Gemini API response as JSON: {e}")
+            print(f"Response text: {text_content}")
+            return None
+        
+        # Ensure all required fields are present
+        for field in REQUIRED_FIELDS:
+            if field not in analysis_results:
+                if field in LIST_FIELDS:
+                    analysis_results[field] = []
                 else:
-                    # Try to parse the whole text as JSON
-                    analysis_results = json.loads(text_content)
-                
-                # Ensure all required fields are present
-                required_fields = [
-                    'overallScore', 'style', 'colorHarmony', 'fit', 'occasion',
-                    'bodyShape', 'fabrics', 'brands', 'sustainability', 'recommendations'
-                ]
-                
-                for field in required_fields:
-                    if field not in analysis_results:
-                        if field in ['occasion', 'fabrics', 'brands', 'recommendations']:
-                            analysis_results[field] = []
-                        else:
-                            analysis_results[field] = "Unknown"
-                
+                    analysis_results[field] = "Unknown"
+        
+        return analysis_results
+    
+    @staticmethod
+    def _fallback_results(image_paths):
+        """Results to use when Gemini is unavailable (ANALYSIS_FALLBACK)"""
+        if current_app.config.get('ANALYSIS_FALLBACK', 'local') == 'local':
+            analysis_results = LocalAnalyzer.analyze_outfit(image_paths)
+            if analysis_results is not None:
                 return analysis_results
-                
-            except json.JSONDecodeError as e:
-                print(f"Error parsing Gemini API response as JSON: {e}")
-                print(f"Response text: {text_content}")
-                return GeminiAnalyzer._mock_analysis_results()
-                
-        except Exception as e:
-            print(f"Error analyzing outfit with Gemini API: {e}")
-            return GeminiAnalyzer._mock_analysis_results()
+        return GeminiAnalyzer._mock_analysis_results()
     
     @staticmethod
     def _mock_analysis_results():
@@ -218,5 +544,6 @@ class GeminiAnalyzer:
                 'score': random.randint(60, 90),
                 'feedback': random.choice(sustainability_feedbacks)
             },
-            'recommendations': random.choice(recommendation_sets)
+            'recommendations': random.choice(recommendation_sets),
+            'source': 'mock'
         }
@@ -0,0 +1,276 @@
+import json
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from ai.concurrency import AdaptiveLimiter, LimiterTimeout
+
+GEMINI_API_BASE = 'https://generativelanguage.googleapis.com/v1beta'
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Module-level client shared by every request thread in this process
+_client = None
+_client_lock = threading.Lock()
+
+class GeminiUnavailable(Exception):
+    """Raised when Gemini cannot produce a response and callers should fall back"""
+
+class CircuitBreaker:
+    """Fail fast once Gemini has failed repeatedly.
+
+    After `failure_threshold` consecutive failures the circuit opens and all
+    calls are rejected for `reset_timeout` seconds. The first call after that
+    is let through as a trial; its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self):
+        """Return True if a call may be attempted right now"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def cancel(self):
+        """Give up an allowed call without an outcome (e.g. it never ran)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+class GeminiClient:
+    """Pooled, keep-alive HTTP client for the Gemini REST API"""
+
+    def __init__(self, connect_timeout=5, read_timeout=60, max_retries=2,
+                 backoff_base=0.5, backoff_max=8, pool_size=10, breaker=None, limiter=None,
+                 api_base=GEMINI_API_BASE):
+        self.api_base = api_base.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveLimiter(max_limit=pool_size)
+
+        # One session per process keeps TLS connections alive between calls.
+        # Retries are handled below so backoff and the breaker see every attempt.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def generate_content(self, model, api_key, payload, stats=None, cancel=None):
+        """POST a generateContent request and return the decoded JSON body
+
+        If a stats dict is passed it is filled with payload_bytes, retries
+        and network_ms (time spent in HTTP calls, excluding backoff). Once
+        the optional cancel event is set (another hedged attempt won) the
+        call stops retrying and stops waiting for a limiter slot; a request
+        already on the wire finishes and frees its slot.
+        """
+        if not self.breaker.allow_request():
+            raise GeminiUnavailable('Gemini circuit breaker is open')
+
+        url = f"{self.api_base}/models/{model}:generateContent"
+        # Serialize once so retries and hedges don't re-encode the images
+        body = json.dumps(payload).encode('utf-8')
+        stats = stats if stats is not None else {}
+        stats.update({'payload_bytes': len(body), 'retries': 0, 'network_ms': 0.0})
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                stats['retries'] = attempt
+                delay = self._backoff_delay(attempt, last_error)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    # Another attempt won: abandoned, not failed, so the breaker doesn't count it
+                    self.breaker.cancel()
+                    raise GeminiUnavailable('Gemini request cancelled')
+
+            # Every attempt takes a slot so retries respect the adaptive limit
+            try:
+                self.limiter.acquire(cancel=cancel)
+            except LimiterTimeout as e:
+                self.breaker.cancel()
+                raise GeminiUnavailable(str(e))
+
+            started = time.monotonic()
+            outcome = AdaptiveLimiter.IGNORE
+            try:
+                response = self.session.post(
+                    url,
+                    params={'key': api_key},
+                    data=body,
+                    timeout=self.timeout
+                )
+                if response.status_code == 200:
+                    outcome = AdaptiveLimiter.SUCCESS
+                elif response.status_code in RETRYABLE_STATUSES:
+                    outcome = AdaptiveLimiter.OVERLOAD
+            except requests.RequestException as e:
+                print(f"Gemini request failed (attempt {attempt + 1}): {e}")
+                last_error = e
+                outcome = AdaptiveLimiter.OVERLOAD if isinstance(e, requests.Timeout) else AdaptiveLimiter.IGNORE
+                continue
+            finally:
+                elapsed = time.monotonic() - started
+                stats['network_ms'] = round(stats['network_ms'] + elapsed * 1000, 2)
+                self.limiter.release(outcome, elapsed)
+
+            if response.status_code == 200:
+                self.breaker.record_success()
+                return response.json()
+
+            if response.status_code in RETRYABLE_STATUSES:
+                print(f"Gemini API returned {response.status_code} (attempt {attempt + 1})")
+                last_error = response
+                continue
+
+            # Other client errors are our fault, not a sign Gemini is unhealthy
+            self.breaker.record_success()
+            raise GeminiUnavailable(f"Gemini API error: {response.status_code} - {response.text}")
+
+        self.breaker.record_failure()
+        if isinstance(last_error, requests.Response):
+            raise GeminiUnavailable(f"Gemini API error: {last_error.status_code} after {self.max_retries + 1} attempts")
+        raise GeminiUnavailable(f"Gemini request failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def stream_generate_content(self, model, api_key, payload, stats=None):
+        """POST a streamGenerateContent request and yield each decoded chunk.
+        
+        Streams are not retried: once text has reached the caller a retry
+        would duplicate it. A stats dict, if passed, gets payload_bytes.
+        """
+        if not self.breaker.allow_request():
+            raise GeminiUnavailable('Gemini circuit breaker is open')
+
+        try:
+            self.limiter.acquire()
+        except LimiterTimeout as e:
+            self.breaker.cancel()
+            raise GeminiUnavailable(str(e))
+        body = json.dumps(payload).encode('utf-8')
+        if stats is not None:
+            stats['payload_bytes'] = len(body)
+        try:
+            yield from self._stream(model, api_key, body)
+        finally:
+            # Streams hold their slot until the last chunk; their duration
+            # says nothing about overload, so latency is not reported
+            self.limiter.release(AdaptiveLimiter.IGNORE)
+
+    def _stream(self, model, api_key, body):
+        url = f"{self.api_base}/models/{model}:streamGenerateContent"
+        try:
+            response = self.session.post(
+                url,
+                params={'key': api_key, 'alt': 'sse'},
+                data=body,
+                timeout=self.timeout,
+                stream=True
+            )
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise GeminiUnavailable(f"Gemini stream request failed: {e}")
+
+        with response:
+            if response.status_code != 200:
+                if response.status_code in RETRYABLE_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise GeminiUnavailable(f"Gemini API error: {response.status_code} - {response.text}")
+
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:'):
+                        yield json.loads(line[5:])
+            except (requests.RequestException, ValueError) as e:
+                self.breaker.record_failure()
+                raise GeminiUnavailable(f"Gemini stream interrupted: {e}")
+            except GeneratorExit:
+                # The consumer went away; that says nothing about Gemini's health
+                self.breaker.record_success()
+                raise
+
+        self.breaker.record_success()
+
+    def _backoff_delay(self, attempt, last_error):
+        """Full-jitter exponential backoff, honouring Retry-After when present"""
+        if isinstance(last_error, requests.Response):
+            retry_after = last_error.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(int(retry_after), self.backoff_max)
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+def get_gemini_client(config):
+    """Get the process-wide Gemini client, creating it from app config"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient(
+                    connect_timeout=config.get('GEMINI_CONNECT_TIMEOUT', 5),
+                    read_timeout=config.get('GEMINI_READ_TIMEOUT', 60),
+                    max_retries=config.get('GEMINI_MAX_RETRIES', 2),
+                    backoff_base=config.get('GEMINI_BACKOFF_BASE', 0.5),
+                    backoff_max=config.get('GEMINI_BACKOFF_MAX', 8),
+                    pool_size=config.get('GEMINI_POOL_SIZE', 10),
+                    api_base=config.get('GEMINI_API_BASE') or GEMINI_API_BASE,
+                    breaker=CircuitBreaker(
+                        failure_threshold=config.get('GEMINI_BREAKER_THRESHOLD', 5),
+                        reset_timeout=config.get('GEMINI_BREAKER_RESET', 30)
+                    ),
+                    limiter=AdaptiveLimiter(
+                        initial_limit=config.get('GEMINI_CONCURRENCY_INITIAL', 4),
+                        min_limit=config.get('GEMINI_CONCURRENCY_MIN', 1),
+                        max_limit=config.get('GEMINI_CONCURRENCY_MAX', 10),
+                        queue_timeout=config.get('GEMINI_QUEUE_TIMEOUT', 10)
+                    )
+                )
+    return _client
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+# Shared pool for hedge and fallback attempts (the request thread only waits)
+_executor = None
+_executor_lock = threading.Lock()
+
+# Module-level latency window for primary-model calls
+_tracker = None
+
+class LatencyTracker:
+    """Rolling window of recent call latencies for percentile lookups"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """Return the p-th percentile in seconds, or None without enough data"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[index]
+
+def get_latency_tracker():
+    """Get the process-wide Gemini latency tracker"""
+    global _tracker
+    if _tracker is None:
+        with _executor_lock:
+            if _tracker is None:
+                _tracker = LatencyTracker()
+    return _tracker
+
+def _get_executor(max_workers):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemini-hedge')
+    return _executor
+
+def _start_thread(fn, cancel):
+    # A future run on its own thread, so the primary never queues behind hedges
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(fn(cancel))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='gemini-primary', daemon=True).start()
+    return future
+
+def run_hedged(attempts, max_workers=16):
+    """Run a schedule of interchangeable attempts and return the first success.
+
+    `attempts` is a list of (name, start_after_seconds, fn) tuples, where fn
+    takes a threading.Event that is set once the race is over. The first
+    attempt starts immediately on a thread of its own; later ones run on the
+    shared hedge pool once their delay has passed without any success (or as
+    soon as every running attempt has failed). Returns (result, name) for the
+    first attempt to succeed, or raises the last error if all of them fail.
+    Losing attempts see the event set and should stop retrying.
+    """
+    executor = _get_executor(max_workers)
+    cancel = threading.Event()
+    started = time.monotonic()
+    running = {}
+    last_error = None
+    pending = list(attempts)
+
+    try:
+        while pending or running:
+            # Launch every attempt whose start time has come, or the next one
+            # straight away if nothing is running any more
+            now = time.monotonic() - started
+            while pending and (pending[0][1] <= now or not running):
+                attempt = pending.pop(0)
+                name, _, fn = attempt
+                if attempt is attempts[0]:
+                    running[_start_thread(fn, cancel)] = name
+                else:
+                    running[executor.submit(fn, cancel)] = name
+
+            timeout = max(0, pending[0][1] - (time.monotonic() - started)) if pending else None
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                try:
+                    return future.result(), name
+                except Exception as e:
+                    last_error = e
+
+        raise last_error
+    finally:
+        # Hedges still queued for the pool never start; running ones stop
+        # at their next retry or while waiting for a limiter slot
+        cancel.set()
+        for future in running:
+            future.cancel()
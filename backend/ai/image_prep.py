@@ -0,0 +1,174 @@
+import base64
+import io
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# Shared pools for image preprocessing, one per size asked for (in the app
+# that is only IMAGE_PREP_WORKERS). Pillow releases the GIL while decoding,
+# resampling and encoding, so threads scale across cores.
+_executors = {}
+_executor_lock = threading.Lock()
+
+def _get_executor(max_workers):
+    executor = _executors.get(max_workers)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(max_workers)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-prep')
+                _executors[max_workers] = executor
+    return executor
+
+def prepare_image(image_path, max_size=512, quality=85):
+    """Downscale one image to fit max_size and encode it as JPEG.
+
+    JPEGs are decoded in draft mode, so the decoder scales by 1/2, 1/4 or
+    1/8 on the fly instead of materialising every pixel of a phone photo.
+    The aspect ratio is preserved. Returns the JPEG bytes with timings.
+    """
+    started = time.perf_counter()
+    with Image.open(image_path) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_size, max_size))
+        img.load()
+        decoded = time.perf_counter()
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        # reducing_gap lets Pillow use a cheap reduce() before the LANCZOS pass
+        img.thumbnail((max_size, max_size), Image.LANCZOS, reducing_gap=2.0)
+        resized = time.perf_counter()
+
+        buffered = io.BytesIO()
+        img.save(buffered, format="JPEG", quality=quality)
+        width, height = img.size
+    encoded = time.perf_counter()
+
+    return {
+        'path': image_path,
+        'data': buffered.getvalue(),
+        'width': width,
+        'height': height,
+        'timings': {
+            'decode_ms': round((decoded - started) * 1000, 2),
+            'resize_ms': round((resized - decoded) * 1000, 2),
+            'encode_ms': round((encoded - resized) * 1000, 2),
+            'total_ms': round((encoded - started) * 1000, 2)
+        }
+    }
+
+def load_prepared(image_path, jpeg_path):
+    """Use an already downscaled JPEG as-is, in prepare_image()'s format.
+
+    Only the header is parsed (for the dimensions); the bytes are passed
+    through without decoding or re-encoding.
+    """
+    started = time.perf_counter()
+    with open(jpeg_path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+    loaded = time.perf_counter()
+
+    return {
+        'path': image_path,
+        'data': data,
+        'width': width,
+        'height': height,
+        'timings': {
+            'load_ms': round((loaded - started) * 1000, 2),
+            'total_ms': round((loaded - started) * 1000, 2)
+        }
+    }
+
+def prepare_images(image_paths, max_size=512, quality=85, max_workers=None, source_for=None):
+    """Prepare several images in parallel, keeping their order.
+
+    `source_for(path)` may return the path of a JPEG already downscaled to
+    max_size (an upload derivative), which is then used without decoding.
+    Returns a list with one entry per path: the prepare_image() result, or
+    a dict with an 'error' key if that image could not be processed.
+    """
+    def run(image_path):
+        try:
+            derived_path = source_for(image_path) if source_for else None
+            if derived_path:
+                return load_prepared(image_path, derived_path)
+            return prepare_image(image_path, max_size, quality)
+        except Exception as e:
+            print(f"Error processing image {image_path}: {e}")
+            return {'path': image_path, 'error': str(e)}
+
+    if len(image_paths) <= 1:
+        return [run(image_path) for image_path in image_paths]
+
+    executor = _get_executor(max_workers or min(4, os.cpu_count() or 1))
+    return list(executor.map(run, image_paths))
+
+def collage_layout(count):
+    """Return (rows, columns) for a near-square grid holding count tiles"""
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    return rows, columns
+
+def build_collage(image_paths, total_size=1024, quality=85, max_workers=None):
+    """Tile several images into one JPEG grid no larger than total_size.
+
+    Each photo is downscaled to fit its cell (keeping its aspect ratio) and
+    centered on a white background. Returns a prepare_image()-style dict
+    with the collage bytes plus 'rows', 'columns' and 'tiles' (the paths
+    placed, in reading order), or None if no image could be processed.
+    """
+    started = time.perf_counter()
+    rows, columns = collage_layout(len(image_paths))
+    cell_size = total_size // max(rows, columns)
+    tiles = [
+        image for image in prepare_images(image_paths, cell_size, quality, max_workers)
+        if 'error' not in image
+    ]
+    if not tiles:
+        return None
+
+    # Recompute the grid in case some images failed to load
+    rows, columns = collage_layout(len(tiles))
+    composed = time.perf_counter()
+    canvas = Image.new('RGB', (columns * cell_size, rows * cell_size), 'white')
+    for index, tile in enumerate(tiles):
+        row, column = divmod(index, columns)
+        with Image.open(io.BytesIO(tile['data'])) as img:
+            offset_x = column * cell_size + (cell_size - img.width) // 2
+            offset_y = row * cell_size + (cell_size - img.height) // 2
+            canvas.paste(img, (offset_x, offset_y))
+
+    buffered = io.BytesIO()
+    canvas.save(buffered, format="JPEG", quality=quality)
+    encoded = time.perf_counter()
+
+    return {
+        'path': None,
+        'data': buffered.getvalue(),
+        'width': canvas.width,
+        'height': canvas.height,
+        'rows': rows,
+        'columns': columns,
+        'tiles': [tile['path'] for tile in tiles],
+        'timings': {
+            'tiles_ms': round((composed - started) * 1000, 2),
+            'compose_ms': round((encoded - composed) * 1000, 2),
+            'total_ms': round((encoded - started) * 1000, 2)
+        }
+    }
+
+def to_inline_part(prepared):
+    """Convert a prepared image into a Gemini inlineData part"""
+    return {
+        "inlineData": {
+            "mimeType": "image/jpeg",
+            "data": base64.b64encode(prepared['data']).decode('utf-8')
+        }
+    }
@@ -0,0 +1,174 @@
+import colorsys
+import numpy as np
+from PIL import Image, ImageOps
+
+# Hue relationships (in degrees) that are conventionally considered harmonious:
+# analogous, triadic, split-complementary and complementary
+HARMONIOUS_HUE_GAPS = [0, 30, 120, 150, 180]
+HUE_TOLERANCE = 15
+
+# Colors below this saturation or value read as neutrals (black, white, grey, beige)
+NEUTRAL_SATURATION = 0.2
+NEUTRAL_VALUE = 0.15
+
+class LocalAnalyzer:
+    """Class for analyzing outfit colors locally with NumPy, without any API call.
+
+    Only the color-related fields are measured (colorHarmony, dominant colors,
+    brightness and contrast). Fields that need a vision model are left
+    'Unknown' rather than invented, and results carry source='local'.
+    """
+
+    @staticmethod
+    def analyze_outfit(image_paths, clusters=5, sample_size=96):
+        """Analyze outfit colors for the given images"""
+        pixels = LocalAnalyzer._load_pixels(image_paths, sample_size)
+        if pixels is None:
+            return None
+
+        centers, weights = LocalAnalyzer._cluster_colors(pixels, clusters)
+        hsv = [colorsys.rgb_to_hsv(*(center / 255.0)) for center in centers]
+
+        # Rec. 601 luma as a perceptual brightness measure
+        luma = pixels @ np.array([0.299, 0.587, 0.114])
+        brightness = int(round(luma.mean() / 255 * 100))
+        contrast = int(round(min(luma.std() / 128, 1.0) * 100))
+
+        color_harmony = LocalAnalyzer._color_harmony(hsv, weights)
+        dominant_colors = [
+            {
+                'hex': '#{:02x}{:02x}{:02x}'.format(*(int(c) for c in center)),
+                'percentage': round(float(weight) * 100, 1),
+                'neutral': LocalAnalyzer._is_neutral(color)
+            }
+            for center, weight, color in sorted(zip(centers, weights, hsv), key=lambda x: -x[1])
+        ]
+
+        # The overall score is a color-only estimate, weighted towards harmony
+        contrast_score = 1 - abs(contrast - 45) / 55
+        overall_score = round(1 + 9 * (0.8 * color_harmony / 100 + 0.2 * max(contrast_score, 0)), 1)
+
+        return {
+            'overallScore': overall_score,
+            'style': 'Unknown',
+            'colorHarmony': color_harmony,
+            'fit': 'Unknown',
+            'occasion': [],
+            'bodyShape': 'Unknown',
+            'fabrics': [],
+            'brands': [],
+            'sustainability': 'Unknown',
+            'recommendations': LocalAnalyzer._recommendations(hsv, weights, brightness, contrast),
+            'dominantColors': dominant_colors,
+            'brightness': brightness,
+            'contrast': contrast,
+            'source': 'local'
+        }
+
+    @staticmethod
+    def stream_outfit_analysis(image_paths):
+        """Yield fields in the same shape as GeminiAnalyzer.stream_outfit_analysis"""
+        analysis_results = LocalAnalyzer.analyze_outfit(image_paths)
+        for field, value in (analysis_results or {}).items():
+            yield ('field', field, value)
+        yield ('result', analysis_results)
+
+    @staticmethod
+    def _load_pixels(image_paths, sample_size):
+        """Load all images as one small (N, 3) float array of RGB pixels"""
+        samples = []
+        for image_path in image_paths:
+            try:
+                with Image.open(image_path) as img:
+                    if img.format == 'JPEG':
+                        img.draft('RGB', (sample_size * 2, sample_size * 2))
+                    img = ImageOps.exif_transpose(img)
+                    img = img.convert('RGB')
+                    img.thumbnail((sample_size, sample_size), Image.BILINEAR)
+                    samples.append(np.asarray(img, dtype=np.float64).reshape(-1, 3))
+            except Exception as e:
+                print(f"Error processing image {image_path}: {e}")
+                continue
+        if not samples:
+            return None
+        return np.concatenate(samples)
+
+    @staticmethod
+    def _cluster_colors(pixels, clusters, iterations=8):
+        """Group pixels into dominant colors with a small k-means"""
+        clusters = min(clusters, len(pixels))
+        # Deterministic init: spread initial centers over the luma ordering
+        order = np.argsort(pixels @ np.array([0.299, 0.587, 0.114]))
+        centers = pixels[order[np.linspace(0, len(pixels) - 1, clusters).astype(int)]]
+
+        for _ in range(iterations):
+            distances = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+            for k in range(clusters):
+                members = pixels[labels == k]
+                if len(members):
+                    centers[k] = members.mean(axis=0)
+
+        counts = np.bincount(labels, minlength=clusters)
+        keep = counts > 0
+        return centers[keep], counts[keep] / counts.sum()
+
+    @staticmethod
+    def _is_neutral(hsv_color):
+        _, saturation, value = hsv_color
+        return bool(saturation < NEUTRAL_SATURATION or value < NEUTRAL_VALUE)
+
+    @staticmethod
+    def _color_harmony(hsv, weights):
+        """Score 1-100 for how well the chromatic colors' hues relate"""
+        chromatic = [
+            (color[0] * 360, weight)
+            for color, weight in zip(hsv, weights)
+            if not LocalAnalyzer._is_neutral(color)
+        ]
+
+        # Neutrals go with anything; a single accent color cannot clash
+        if len(chromatic) <= 1:
+            return 88
+
+        total = 0.0
+        pair_weight = 0.0
+        for i in range(len(chromatic)):
+            for j in range(i + 1, len(chromatic)):
+                gap = abs(chromatic[i][0] - chromatic[j][0]) % 360
+                gap = min(gap, 360 - gap)
+                closeness = min(abs(gap - target) for target in HARMONIOUS_HUE_GAPS)
+                pair_score = float(np.exp(-(closeness ** 2) / (2 * HUE_TOLERANCE ** 2)))
+                weight = chromatic[i][1] * chromatic[j][1]
+                total += pair_score * weight
+                pair_weight += weight
+
+        score = total / pair_weight if pair_weight else 1.0
+        # Many competing saturated colors read as busy even when related
+        busy_penalty = max(0, len(chromatic) - 3) * 5
+        return int(max(1, min(100, round(40 + 60 * score - busy_penalty))))
+
+    @staticmethod
+    def _recommendations(hsv, weights, brightness, contrast):
+        """Derive color recommendations from the measured palette"""
+        recommendations = []
+        neutral_share = sum(w for color, w in zip(hsv, weights) if LocalAnalyzer._is_neutral(color))
+
+        if neutral_share > 0.85:
+            recommendations.append("The palette is almost entirely neutral; a single accent color would add interest.")
+        elif neutral_share < 0.3:
+            recommendations.append("Several strong colors compete; grounding the look with a neutral piece would balance it.")
+        else:
+            recommendations.append("The balance between neutrals and accent colors works well.")
+
+        if contrast < 20:
+            recommendations.append("Contrast between pieces is low; varying light and dark tones would add definition.")
+        elif contrast > 75:
+            recommendations.append("Contrast is very high; a mid-tone layer could soften the transition between pieces.")
+
+        if brightness < 25:
+            recommendations.append("The outfit reads very dark; a lighter accessory would lift it.")
+        elif brightness > 80:
+            recommendations.append("The outfit reads very light; a darker accessory or shoe would anchor it.")
+
+        return recommendations
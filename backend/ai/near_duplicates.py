@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import OrderedDict
+from bson import ObjectId
+from PIL import Image, ImageOps
+from utils.db import get_db
+
+HASH_BITS = 64
+
+# Fallback results (LocalAnalyzer, mock data) are never offered for reuse,
+# or a Gemini outage would stick to every later upload of the same outfit
+DEGRADED_SOURCES = ['local', 'mock']
+
+# Module-level index shared by every request thread in this process
+_index = None
+_index_lock = threading.Lock()
+
+def dhash(image_path, hash_size=8):
+    """Compute a 64-bit difference hash of an image as a hex string.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale grid and
+    each bit records whether a pixel is brighter than its right neighbour.
+    The hash survives re-compression, resizing and small crops, so a photo
+    forwarded through a messaging app lands within a few bits of the
+    original.
+    """
+    with Image.open(image_path) as img:
+        if img.format == 'JPEG':
+            img.draft('L', (hash_size * 8, hash_size * 8))
+        img = ImageOps.exif_transpose(img).convert('L')
+        pixels = list(img.resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+
+    value = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+def is_reusable(results):
+    """Whether analysis results came from Gemini and may be served again"""
+    return isinstance(results, dict) and results.get('source') not in DEGRADED_SOURCES
+
+# int.bit_count() is much faster but needs Python 3.10
+_popcount = getattr(int, 'bit_count', None) or (lambda value: bin(value).count('1'))
+
+def hamming(a, b):
+    return _popcount(a ^ b)
+
+class HammingIndex:
+    """Multi-index hash table for Hamming-radius queries over 64-bit hashes.
+
+    Hashes are split into max_distance + 1 blocks. Two hashes within
+    max_distance bits must agree exactly on at least one block, so a query
+    only compares against entries sharing a block with it instead of
+    scanning every entry.
+    """
+
+    def __init__(self, max_distance=6, bits=HASH_BITS):
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        edges = [round(i * bits / blocks) for i in range(blocks + 1)]
+        self._blocks = [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+        self._tables = [{} for _ in self._blocks]
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, value, payload):
+        index = len(self._entries)
+        self._entries.append((value, payload))
+        for table, (shift, mask) in zip(self._tables, self._blocks):
+            table.setdefault((value >> shift) & mask, []).append(index)
+
+    def query(self, value, max_distance=None):
+        """Return (distance, payload) pairs within max_distance, closest first"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        seen = set()
+        matches = []
+        for table, (shift, mask) in zip(self._tables, self._blocks):
+            for index in table.get((value >> shift) & mask, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                candidate, payload = self._entries[index]
+                distance = hamming(value, candidate)
+                if distance <= max_distance:
+                    matches.append((distance, payload))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class _UserIndex:
+    """Hashes of one user's analyses and how far they have been loaded"""
+
+    def __init__(self, max_distance):
+        self.hashes = HammingIndex(max_distance)
+        self.image_counts = {}
+        self.loaded_until = None
+        self.refreshed_at = 0
+
+    def add(self, analysis_id, phashes):
+        if analysis_id in self.image_counts or not phashes:
+            return
+        self.image_counts[analysis_id] = len(phashes)
+        for phash in phashes:
+            self.hashes.add(int(phash, 16), analysis_id)
+
+class NearDuplicateIndex:
+    """Per-user perceptual hash index over past analyses.
+
+    Each user's hashes are loaded from the `phashes` field of their analyses
+    (fallback results excluded) on first use, then topped up with newer analyses every `refresh_seconds`
+    so uploads handled by other workers are picked up. Analyses created in
+    this process are added immediately. The least recently used users are
+    dropped once more than `max_users` are held.
+    """
+
+    def __init__(self, max_distance=6, refresh_seconds=30, max_users=1000):
+        self.max_distance = max_distance
+        self.refresh_seconds = refresh_seconds
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def find(self, user_id, phashes):
+        """Find the closest past analysis showing the same images.
+
+        Every uploaded image must be within max_distance of an image of
+        an analysis with the same number of images. Returns
+        (analysis_id, distance) with the worst per-image distance, or None.
+        """
+        if not phashes:
+            return None
+        user_index = self._user_index(str(user_id))
+
+        with self._lock:
+            best = None
+            for phash in phashes:
+                matched = {}
+                for distance, analysis_id in user_index.hashes.query(int(phash, 16)):
+                    matched.setdefault(analysis_id, distance)
+                if best is None:
+                    best = {
+                        analysis_id: distance for analysis_id, distance in matched.items()
+                        if user_index.image_counts.get(analysis_id) == len(phashes)
+                    }
+                else:
+                    # Analyses that missed this image can no longer match
+                    best = {
+                        analysis_id: max(best[analysis_id], distance)
+                        for analysis_id, distance in matched.items() if analysis_id in best
+                    }
+                if not best:
+                    return None
+
+        analysis_id = min(best, key=best.get)
+        return analysis_id, best[analysis_id]
+
+    def add(self, user_id, analysis_id, phashes):
+        """Index a newly created analysis if this user's index is loaded"""
+        with self._lock:
+            user_index = self._users.get(str(user_id))
+            if user_index:
+                user_index.add(str(analysis_id), phashes)
+
+    def _user_index(self, user_id):
+        with self._lock:
+            user_index = self._users.get(user_id)
+            if user_index:
+                self._users.move_to_end(user_id)
+                if time.monotonic() - user_index.refreshed_at < self.refresh_seconds:
+                    return user_index
+            else:
+                user_index = _UserIndex(self.max_distance)
+            loaded_until = user_index.loaded_until
+
+        # Load outside the lock; only analyses newer than the last load
+        query = {
+            'user_id': ObjectId(user_id),
+            'phashes': {'$exists': True},
+            'results.source': {'$nin': DEGRADED_SOURCES}
+        }
+        if loaded_until:
+            query['created_at'] = {'$gt': loaded_until}
+        documents = list(get_db().analyses.find(query, {'phashes': 1, 'created_at': 1}).sort('created_at', 1))
+
+        with self._lock:
+            for document in documents:
+                user_index.add(str(document['_id']), document['phashes'])
+                user_index.loaded_until = document['created_at']
+            user_index.refreshed_at = time.monotonic()
+            self._users[user_id] = user_index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return user_index
+
+def get_near_duplicate_index(config):
+    """Get the process-wide near-duplicate index, creating it from app config"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex(
+                    max_distance=config.get('ANALYSIS_DEDUPE_DISTANCE', 6),
+                    refresh_seconds=config.get('ANALYSIS_DEDUPE_REFRESH', 30),
+                    max_users=config.get('ANALYSIS_DEDUPE_MAX_USERS', 1000)
+                )
+    return _index
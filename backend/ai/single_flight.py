@@ -0,0 +1,128 @@
+import copy
+import datetime
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pymongo.errors import DuplicateKeyError
+from utils.db import get_db
+
+# Module-level instance shared by every request thread in this process
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers that arrive while
+    it is in flight wait on the same future and receive a copy of its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'leaders': 0,
+            'coalesced': 0,
+            'lease_waits': 0,
+            'lease_hits': 0
+        }
+
+    def do(self, key, fn):
+        """Run fn() once per key among concurrent callers and return its result"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._stats['leaders'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def record(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self):
+        """Return leader/coalesced counters and the number of calls in flight"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+class MongoLease:
+    """Cross-worker lease on a key, stored in the `analysis_leases` collection.
+
+    Only one worker process holds the lease for a fingerprint at a time;
+    others wait for its result to appear in the shared analysis cache.
+    Leases expire on their own so a crashed holder cannot block a key.
+    """
+
+    def __init__(self, key, ttl_seconds=90):
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.owner = uuid.uuid4().hex
+        self.held = False
+
+    def acquire(self):
+        """Try to take the lease, returning True on success"""
+        collection = get_db().analysis_leases
+        now = datetime.datetime.utcnow()
+        expires_at = now + datetime.timedelta(seconds=self.ttl_seconds)
+        try:
+            collection.insert_one({'_id': self.key, 'owner': self.owner, 'expires_at': expires_at})
+            self.held = True
+            return True
+        except DuplicateKeyError:
+            # Take over a lease whose holder has exceeded its TTL
+            taken = collection.find_one_and_update(
+                {'_id': self.key, 'expires_at': {'$lt': now}},
+                {'$set': {'owner': self.owner, 'expires_at': expires_at}}
+            )
+            self.held = taken is not None
+            return self.held
+
+    def release(self):
+        if not self.held:
+            return
+        self.held = False
+        try:
+            get_db().analysis_leases.delete_one({'_id': self.key, 'owner': self.owner})
+        except Exception as e:
+            print(f"Failed to release analysis lease: {e}")
+
+    def wait(self, check, timeout, interval=0.25):
+        """Poll check() until it returns a value, the lease frees up, or timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            result = check()
+            if result is not None:
+                return result
+            if self.acquire():
+                return None
+            time.sleep(interval)
+        return None
+
+def get_single_flight():
+    """Get the process-wide single-flight group"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,80 @@
+import json
+
+class IncrementalFieldParser:
+    """Pull completed top-level fields out of a JSON object as it streams in.
+
+    Gemini streams its answer as text fragments. Feeding each fragment to
+    this parser returns the (field, value) pairs that became complete, so
+    the score can be shown long before the recommendations have arrived.
+    Anything before the first '{' (such as a markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_value = False
+        self._key = None
+        self._token_start = None
+
+    def feed(self, text):
+        """Add a fragment and return the list of newly completed fields"""
+        self.buffer += text
+        fields = []
+        buffer = self.buffer
+
+        while self._pos < len(buffer) and not self.done:
+            ch = buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and not self._expect_value:
+                        self._key = json.loads(buffer[self._token_start:self._pos + 1])
+                        self._token_start = None
+            elif self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._token_start is None:
+                    self._token_start = self._pos
+            elif ch in '{[':
+                if self._depth == 1 and self._token_start is None:
+                    self._token_start = self._pos
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_value(fields)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ':':
+                    self._expect_value = True
+                elif ch == ',':
+                    self._finish_value(fields)
+                elif not ch.isspace() and self._token_start is None and self._expect_value:
+                    self._token_start = self._pos
+
+            self._pos += 1
+
+        return fields
+
+    def _finish_value(self, fields):
+        if self._key is not None and self._token_start is not None:
+            raw_value = self.buffer[self._token_start:self._pos].strip()
+            try:
+                fields.append((self._key, json.loads(raw_value)))
+            except json.JSONDecodeError:
+                # Leave malformed values to the full parse at the end
+                pass
+        self._key = None
+        self._token_start = None
+        self._expect_value = False
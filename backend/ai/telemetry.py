@@ -0,0 +1,105 @@
+import datetime
+import threading
+import time
+from collections import Counter, deque
+from utils.db import get_db
+from utils.stats import percentile
+
+# Fields kept for every analysis call, in storage order
+NUMERIC_FIELDS = [
+    'total_ms', 'preprocess_ms', 'network_ms', 'parse_ms', 'payload_bytes',
+    'image_count', 'prompt_tokens', 'candidate_tokens', 'total_tokens', 'retries'
+]
+LABEL_FIELDS = ['outcome', 'path', 'model']
+# Fields holding one value per image (or one for the whole collage)
+LIST_FIELDS = ['preprocess_ms_per_image']
+FIELDS = NUMERIC_FIELDS + LABEL_FIELDS + LIST_FIELDS
+
+# Module-level store shared by every request thread in this process
+_store = None
+_store_lock = threading.Lock()
+
+class TelemetryStore:
+    """Rolling window of per-call Gemini telemetry.
+
+    Each record is kept as a flat tuple to keep the window compact. When
+    mongo is enabled, records are also written to the capped `gemini_calls`
+    collection so that all worker processes can be summarised together.
+    """
+
+    def __init__(self, window=2000, use_mongo=False):
+        self.use_mongo = use_mongo
+        self._records = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, telemetry):
+        """Add one call's telemetry dict to the window"""
+        row = (time.time(),) + tuple(telemetry.get(field) for field in NUMERIC_FIELDS + LABEL_FIELDS)
+        row += tuple(tuple(telemetry.get(field) or ()) for field in LIST_FIELDS)
+        with self._lock:
+            self._records.append(row)
+
+        if self.use_mongo:
+            try:
+                doc = {field: telemetry.get(field) for field in FIELDS}
+                doc['created_at'] = datetime.datetime.utcnow()
+                get_db().gemini_calls.insert_one(doc)
+            except Exception as e:
+                print(f"Failed to store Gemini telemetry: {e}")
+
+    def summary(self, since_seconds=None):
+        """Summarise recorded calls with counts and p50/p90/p99 per metric"""
+        with self._lock:
+            rows = list(self._records)
+        if since_seconds:
+            cutoff = time.time() - since_seconds
+            rows = [row for row in rows if row[0] >= cutoff]
+        records = [dict(zip(FIELDS, row[1:])) for row in rows]
+        return summarise(records)
+
+    def mongo_summary(self, since_seconds=3600):
+        """Summarise calls from every worker using the capped collection"""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=since_seconds)
+        projection = {field: 1 for field in FIELDS}
+        projection['_id'] = 0
+        records = list(get_db().gemini_calls.find({'created_at': {'$gte': cutoff}}, projection))
+        return summarise(records)
+
+def summarise(records):
+    """Build counts and percentiles from a list of telemetry dicts"""
+    summary = {
+        'calls': len(records),
+        'outcomes': dict(Counter(record.get('outcome') for record in records)),
+        'paths': dict(Counter(record.get('path') for record in records)),
+        'models': dict(Counter(record.get('model') for record in records if record.get('model'))),
+        'metrics': {}
+    }
+    for field in NUMERIC_FIELDS + LIST_FIELDS:
+        if field in LIST_FIELDS:
+            # Pool the per-image values of every call
+            values = sorted(value for record in records for value in record.get(field) or ())
+        else:
+            values = sorted(record[field] for record in records if record.get(field) is not None)
+        if not values:
+            continue
+        summary['metrics'][field] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': values[-1],
+            'sum': round(sum(values), 2)
+        }
+    return summary
+
+def get_telemetry_store(config):
+    """Get the process-wide telemetry store, creating it from app config"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TelemetryStore(
+                    window=config.get('GEMINI_TELEMETRY_WINDOW', 2000),
+                    use_mongo=config.get('GEMINI_TELEMETRY_MONGO', False)
+                )
+    return _store
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, make_response, send_from_directory, request
+from flask import Flask, jsonify, make_response, request, redirect
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
@@ -11,12 +11,22 @@ from routes.recommendations import recommendations_bp
 from routes.user import user_bp
 from routes.dashboard import dashboard_bp
 from utils.db import initialize_db
+from utils.jobs import init_job_queue
+from utils.uploads import init_upload_store, get_upload_store, send_upload
+from utils.upload_gc import init_upload_gc
+from utils.user_cache import get_user_cache
+from utils.revocation import get_revocation_store
+from utils.token_epochs import CLAIM as TOKEN_EPOCH, get_token_epochs
+from utils.passwords import init_password_hasher, get_password_hasher
+from utils.json_provider import OrjsonProvider
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
+# Encode JSON responses with orjson (ObjectId/datetime/bytes aware)
+app.json = OrjsonProvider(app)
 
 # Define allowed frontend origins
 ALLOWED_ORIGINS = [
@@ -46,7 +56,7 @@ CORS(app,
         "https://fashionlens-frontend-80hxu1e2n-xstatic72s-projects.vercel.app"
      ]}}, 
      supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin"],
+     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin", "Idempotency-Key"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
      expose_headers=["Content-Type", "Authorization"])
 
@@ -55,7 +65,124 @@ CORS(app,
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
 app.config['MONGO_URI'] = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/fashion_analysis')
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
+
+# Upload limits: whole request body (Flask answers 413 before reading it),
+# each image, and decoded pixels per image (checked from the header, before
+# any decode). Werkzeug spools file parts above 500 KB to disk, so request
+# memory stays flat however large the body is.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+app.config['UPLOAD_MAX_IMAGE_BYTES'] = int(os.environ.get('UPLOAD_MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+app.config['UPLOAD_MAX_PIXELS'] = int(os.environ.get('UPLOAD_MAX_PIXELS', 40000000))
+
+# Where uploaded blobs live: 'local' (UPLOAD_FOLDER) or 's3' (any S3-compatible
+# endpoint, requires boto3). Remote blobs are cached in UPLOAD_CACHE_FOLDER
+# for analysis and served through presigned redirects.
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+app.config['S3_REGION'] = os.environ.get('S3_REGION')
+app.config['S3_ACCESS_KEY_ID'] = os.environ.get('S3_ACCESS_KEY_ID')
+app.config['S3_SECRET_ACCESS_KEY'] = os.environ.get('S3_SECRET_ACCESS_KEY')
+app.config['S3_PRESIGN_EXPIRES'] = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+app.config['UPLOAD_CACHE_FOLDER'] = os.environ.get('UPLOAD_CACHE_FOLDER')
+
+# Let the front-end server stream local uploads: '' (Flask sends the bytes),
+# 'x-accel' (nginx internal location at UPLOAD_ACCEL_PREFIX) or 'x-sendfile'
+app.config['UPLOAD_SENDFILE_MODE'] = os.environ.get('UPLOAD_SENDFILE_MODE', '')
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+
+# Longest sides of the WebP/JPEG copies made of each new upload, served for
+# /uploads/...?size=N and reused by the analyzer at ANALYSIS_IMAGE_SIZE
+app.config['UPLOAD_DERIVATIVE_SIZES'] = [
+    int(size) for size in os.environ.get('UPLOAD_DERIVATIVE_SIZES', '200,512,1024').split(',') if size.strip()
+]
+app.config['UPLOAD_DERIVATIVE_WORKERS'] = int(os.environ.get('UPLOAD_DERIVATIVE_WORKERS', 2))
+
+# Orphaned upload collection (see utils/upload_gc.py): files no document
+# refers to are deleted once older than UPLOAD_GC_GRACE seconds, examining
+# at most UPLOAD_GC_RATE files per second. UPLOAD_GC_INTERVAL > 0 sweeps
+# UPLOAD_GC_BATCH files in the background every that many seconds.
+app.config['UPLOAD_GC_INTERVAL'] = int(os.environ.get('UPLOAD_GC_INTERVAL', 0))
+app.config['UPLOAD_GC_GRACE'] = int(os.environ.get('UPLOAD_GC_GRACE', 24 * 3600))
+app.config['UPLOAD_GC_RATE'] = float(os.environ.get('UPLOAD_GC_RATE', 100))
+app.config['UPLOAD_GC_BATCH'] = int(os.environ.get('UPLOAD_GC_BATCH', 10000))
 app.config['GEMINI_API_KEY'] = os.environ.get('GEMINI_API_KEY')
+app.config['GEMINI_MODEL'] = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+# Override to point at a local stand-in (see ai/fake_gemini_server.py)
+app.config['GEMINI_API_BASE'] = os.environ.get('GEMINI_API_BASE')
+
+# Analyzer backend ('gemini' or 'local') and what to use when Gemini is
+# unavailable ('local' color analysis or 'mock' data)
+app.config['ANALYZER_BACKEND'] = os.environ.get('ANALYZER_BACKEND', 'gemini')
+app.config['ANALYSIS_FALLBACK'] = os.environ.get('ANALYSIS_FALLBACK', 'local')
+app.config['ANALYSIS_LOCAL_PREVIEW'] = os.environ.get('ANALYSIS_LOCAL_PREVIEW', 'true').lower() in ('true', '1', 'yes')
+
+# Image preprocessing before Gemini (longest side in px, JPEG quality, pool size)
+app.config['ANALYSIS_IMAGE_SIZE'] = int(os.environ.get('ANALYSIS_IMAGE_SIZE', 512))
+app.config['ANALYSIS_IMAGE_QUALITY'] = int(os.environ.get('ANALYSIS_IMAGE_QUALITY', 85))
+app.config['IMAGE_PREP_WORKERS'] = int(os.environ.get('IMAGE_PREP_WORKERS', min(4, os.cpu_count() or 1)))
+# Tile multi-image uploads into one grid image of at most this many px a side
+app.config['ANALYSIS_COLLAGE_MODE'] = os.environ.get('ANALYSIS_COLLAGE_MODE', 'false').lower() in ('true', '1', 'yes')
+app.config['ANALYSIS_COLLAGE_SIZE'] = int(os.environ.get('ANALYSIS_COLLAGE_SIZE', 1024))
+
+# Gemini HTTP client (timeouts in seconds, shared keep-alive pool per process)
+app.config['GEMINI_CONNECT_TIMEOUT'] = float(os.environ.get('GEMINI_CONNECT_TIMEOUT', 5))
+app.config['GEMINI_READ_TIMEOUT'] = float(os.environ.get('GEMINI_READ_TIMEOUT', 60))
+app.config['GEMINI_MAX_RETRIES'] = int(os.environ.get('GEMINI_MAX_RETRIES', 2))
+app.config['GEMINI_BACKOFF_BASE'] = float(os.environ.get('GEMINI_BACKOFF_BASE', 0.5))
+app.config['GEMINI_BACKOFF_MAX'] = float(os.environ.get('GEMINI_BACKOFF_MAX', 8))
+app.config['GEMINI_POOL_SIZE'] = int(os.environ.get('GEMINI_POOL_SIZE', 10))
+app.config['GEMINI_BREAKER_THRESHOLD'] = int(os.environ.get('GEMINI_BREAKER_THRESHOLD', 5))
+app.config['GEMINI_BREAKER_RESET'] = float(os.environ.get('GEMINI_BREAKER_RESET', 30))
+
+# Adaptive (AIMD) limit on concurrent Gemini calls per process
+app.config['GEMINI_CONCURRENCY_INITIAL'] = int(os.environ.get('GEMINI_CONCURRENCY_INITIAL', 4))
+app.config['GEMINI_CONCURRENCY_MIN'] = int(os.environ.get('GEMINI_CONCURRENCY_MIN', 1))
+app.config['GEMINI_CONCURRENCY_MAX'] = int(os.environ.get('GEMINI_CONCURRENCY_MAX', 10))
+app.config['GEMINI_QUEUE_TIMEOUT'] = float(os.environ.get('GEMINI_QUEUE_TIMEOUT', 10))
+
+# Hedged requests and a cheaper model tier for slow Gemini calls
+app.config['GEMINI_HEDGING_ENABLED'] = os.environ.get('GEMINI_HEDGING_ENABLED', 'false').lower() in ('true', '1', 'yes')
+app.config['GEMINI_HEDGE_PERCENTILE'] = float(os.environ.get('GEMINI_HEDGE_PERCENTILE', 95))
+app.config['GEMINI_HEDGE_DELAY'] = float(os.environ.get('GEMINI_HEDGE_DELAY', 8))
+app.config['GEMINI_FALLBACK_MODEL'] = os.environ.get('GEMINI_FALLBACK_MODEL')
+app.config['GEMINI_FALLBACK_AFTER'] = float(os.environ.get('GEMINI_FALLBACK_AFTER') or 0) or None
+
+# Gemini result cache (in-process LRU backed by a Mongo TTL collection)
+app.config['ANALYSIS_CACHE_ENABLED'] = os.environ.get('ANALYSIS_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+app.config['ANALYSIS_CACHE_TTL'] = int(os.environ.get('ANALYSIS_CACHE_TTL', 7 * 24 * 3600))
+app.config['ANALYSIS_CACHE_MAX_ENTRIES'] = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 512))
+app.config['ANALYSIS_CACHE_MONGO'] = os.environ.get('ANALYSIS_CACHE_MONGO', 'true').lower() in ('true', '1', 'yes')
+
+# Cross-worker deduplication of identical in-flight analyses via Mongo leases
+app.config['ANALYSIS_LEASES_ENABLED'] = os.environ.get('ANALYSIS_LEASES_ENABLED', 'false').lower() in ('true', '1', 'yes')
+app.config['ANALYSIS_LEASE_TTL'] = int(os.environ.get('ANALYSIS_LEASE_TTL', 90))
+
+# Reuse a past analysis when the same outfit photos are uploaded again
+# (perceptual hash within ANALYSIS_DEDUPE_DISTANCE of 64 bits)
+app.config['ANALYSIS_DEDUPE_ENABLED'] = os.environ.get('ANALYSIS_DEDUPE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+app.config['ANALYSIS_DEDUPE_DISTANCE'] = int(os.environ.get('ANALYSIS_DEDUPE_DISTANCE', 6))
+app.config['ANALYSIS_DEDUPE_REFRESH'] = int(os.environ.get('ANALYSIS_DEDUPE_REFRESH', 30))
+app.config['ANALYSIS_DEDUPE_MAX_USERS'] = int(os.environ.get('ANALYSIS_DEDUPE_MAX_USERS', 1000))
+
+# Gemini call telemetry (rolling in-process window, optionally mirrored to Mongo)
+app.config['GEMINI_TELEMETRY_WINDOW'] = int(os.environ.get('GEMINI_TELEMETRY_WINDOW', 2000))
+app.config['GEMINI_TELEMETRY_MONGO'] = os.environ.get('GEMINI_TELEMETRY_MONGO', 'false').lower() in ('true', '1', 'yes')
+
+# Asynchronous analysis jobs ('mongo' survives restarts, 'memory' is for tests)
+app.config['ANALYSIS_JOB_BACKEND'] = os.environ.get('ANALYSIS_JOB_BACKEND', 'mongo')
+app.config['ANALYSIS_JOB_WORKERS'] = int(os.environ.get('ANALYSIS_JOB_WORKERS', 4))
+app.config['ANALYSIS_JOB_MAX_PENDING'] = int(os.environ.get('ANALYSIS_JOB_MAX_PENDING', 100))
+# Running jobs hold a lease refreshed every ANALYSIS_JOB_HEARTBEAT seconds;
+# jobs whose lease runs out (their worker died) are queued again
+app.config['ANALYSIS_JOB_LEASE'] = int(os.environ.get('ANALYSIS_JOB_LEASE', 60))
+app.config['ANALYSIS_JOB_HEARTBEAT'] = int(os.environ.get('ANALYSIS_JOB_HEARTBEAT', 15))
+
+# Idempotency-Key handling for retried uploads (see utils/idempotency.py)
+app.config['IDEMPOTENCY_TTL'] = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+app.config['IDEMPOTENCY_LOCK_TIMEOUT'] = int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 120))
+app.config['IDEMPOTENCY_WAIT_TIMEOUT'] = int(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', 30))
 
 # JWT Configuration for persistent sessions
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-string')
@@ -64,6 +191,28 @@ app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 app.config['JWT_BLACKLIST_ENABLED'] = True
 app.config['JWT_BLACKLIST_TOKEN_CHECKS'] = ['access', 'refresh']
 
+# Logouts are shared through the revoked_tokens collection. Each worker
+# picks up the others' revocations within REVOCATION_REFRESH seconds.
+app.config['REVOCATION_REFRESH'] = float(os.environ.get('REVOCATION_REFRESH', 2))
+app.config['REVOCATION_REBUILD'] = int(os.environ.get('REVOCATION_REBUILD', 3600))
+app.config['REVOCATION_BLOOM_CAPACITY'] = int(os.environ.get('REVOCATION_BLOOM_CAPACITY', 100000))
+app.config['REVOCATION_BLOOM_ERROR_RATE'] = float(os.environ.get('REVOCATION_BLOOM_ERROR_RATE', 0.001))
+# Logout-all and password changes reach other workers within this many seconds
+app.config['TOKEN_EPOCH_CACHE_TTL'] = float(os.environ.get('TOKEN_EPOCH_CACHE_TTL', 5))
+
+# Password hashing runs on a small low-priority pool so login bursts cannot
+# starve other requests; hashes below BCRYPT_ROUNDS are upgraded on login
+app.config['BCRYPT_ROUNDS'] = int(os.environ.get('BCRYPT_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+app.config['PASSWORD_HASH_NICE'] = int(os.environ.get('PASSWORD_HASH_NICE', 5))
+
+# The current user behind a JWT is cached per process for this many seconds
+# (profile and preference updates invalidate it locally)
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+app.config['USER_CACHE_MAX_SIZE'] = int(os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+
 # Production-ready CORS preflight handler
 @app.before_request
 def handle_preflight():
@@ -83,7 +232,7 @@ def handle_preflight():
             response.headers['Access-Control-Allow-Origin'] = origin
                 
             response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,X-Requested-With,Accept,Origin'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,X-Requested-With,Accept,Origin,Idempotency-Key'
             response.headers['Access-Control-Allow-Credentials'] = 'true'
             response.headers['Access-Control-Max-Age'] = '3600'
             
@@ -109,18 +258,38 @@ def after_request(response):
             
         response.headers['Access-Control-Allow-Credentials'] = 'true'
         response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,X-Requested-With,Accept,Origin'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,X-Requested-With,Accept,Origin,Idempotency-Key'
         
     return response
 
 
 # Initialize JWT
 jwt = JWTManager(app)
-blacklist = set()
 
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload):
-    return jwt_payload['jti'] in blacklist
+    # Tokens from before the user's last logout-all / password change
+    if get_token_epochs(app.config).is_stale(jwt_payload):
+        return True
+    # Revoked tokens live in Mongo; a local Bloom filter answers most checks
+    return get_revocation_store(app.config).is_revoked(jwt_payload['jti'])
+
+@jwt.additional_claims_loader
+def add_token_epoch(identity):
+    # Read uncached so a token issued right after a bump is not born stale
+    return {TOKEN_EPOCH: get_token_epochs(app.config).current(identity, fresh=True)}
+
+# Routes read the user behind their token with get_current_user(). It is
+# loaded here from a short-lived per-process cache (one users query, password
+# excluded, per USER_CACHE_TTL), and a token whose user is gone gets a 404
+# before the route runs.
+@jwt.user_lookup_loader
+def load_current_user(jwt_header, jwt_payload):
+    return get_user_cache(app.config).get(jwt_payload['sub'])
+
+@jwt.user_lookup_error_loader
+def user_lookup_error_callback(jwt_header, jwt_payload):
+    return jsonify({'error': 'User not found'}), 404
 
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_payload):
@@ -140,6 +309,18 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Initialize DB
 initialize_db(app)
 
+# Content-addressed upload store (local disk or S3)
+init_upload_store(app)
+
+# Low-priority bcrypt pool used by the auth routes
+init_password_hasher(app)
+
+# Start the analysis job workers (resumes jobs left queued by a restart)
+init_job_queue(app)
+
+# Background sweeps for orphaned uploads, if UPLOAD_GC_INTERVAL is set
+init_upload_gc(app)
+
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(analysis_bp, url_prefix='/api/analysis')
@@ -151,7 +332,30 @@ app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
 # Static uploads
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    store = get_upload_store()
+    local_file = os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    if not local_file and not filename.startswith('blobs/'):
+        # Legacy per-user paths that were migrated into the blob store
+        filename = store.resolve(filename) or filename
+
+    # ?size=N picks a resized derivative, as WebP for clients that accept it
+    size = request.args.get('size', type=int)
+    negotiated = bool(size) and filename.startswith('blobs/')
+    if negotiated:
+        filename = store.pick_derivative(filename, size, request.accept_mimetypes)
+        local_file = os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    
+    # Remote storage hands out a presigned URL instead of proxying the bytes;
+    # the redirect itself may be cached for part of the URL's lifetime
+    redirect_url = None if local_file else store.storage.url_for(filename)
+    if redirect_url:
+        response = redirect(redirect_url)
+        response.headers['Cache-Control'] = f"private, max-age={app.config['S3_PRESIGN_EXPIRES'] // 2}"
+    else:
+        response = send_upload(filename)
+    if negotiated:
+        response.vary.add('Accept')
+    return response
 
 # API root
 @app.route('/')
@@ -173,6 +377,40 @@ def health_cors():
         'method': request.method
     })
 
+@app.route('/api/health/gemini')
+def health_gemini():
+    from ai.gemini_client import get_gemini_client
+    from ai.analysis_cache import get_analysis_cache
+    from ai.single_flight import get_single_flight
+    client = get_gemini_client(app.config)
+    return jsonify({
+        'circuit': client.breaker.state,
+        'concurrency': client.limiter.stats(),
+        'cache': get_analysis_cache(app.config).stats(),
+        'singleFlight': get_single_flight().stats()
+    })
+
+@app.route('/api/health/gemini/telemetry')
+def health_gemini_telemetry():
+    """Per-call Gemini telemetry with percentiles.
+
+    ?since=SECONDS limits the window; ?scope=all summarises every worker
+    from Mongo (requires GEMINI_TELEMETRY_MONGO).
+    """
+    from ai.telemetry import get_telemetry_store
+    store = get_telemetry_store(app.config)
+    since = request.args.get('since', type=int)
+    if request.args.get('scope') == 'all':
+        if not store.use_mongo:
+            return jsonify({'error': 'GEMINI_TELEMETRY_MONGO is not enabled'}), 400
+        return jsonify(store.mongo_summary(since or 3600))
+    return jsonify(store.summary(since))
+
+@app.route('/api/health/passwords')
+def health_passwords():
+    """Password hashing pool: pending calls, rejections and queue/hash times"""
+    return jsonify(get_password_hasher().stats())
+
 @app.route('/api/health/db')
 def health_db():
     try:
@@ -188,6 +426,10 @@ def health_db():
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'error': f"Upload is larger than {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB"}), 413
+
 @app.errorhandler(500)
 def server_error(error):
     return jsonify({'error': 'Server error'}), 500
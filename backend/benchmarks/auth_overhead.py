@@ -0,0 +1,131 @@
+"""Benchmark: per-request JWT auth overhead, cached vs a DB lookup each time.
+
+Every authenticated request runs three checks on its token: is it revoked,
+is it older than the user's token epoch, and who is the user. This times
+each check for a batch of valid tokens:
+
+- db: one query per check per request (revoked_tokens by jti, the user's
+  epoch, the user document);
+- cached: what app.py does now, RevocationStore.is_revoked (Bloom filter),
+  TokenEpochs.is_stale and UserCache.get.
+
+--revoked revocations are written first so the filter holds a realistic
+number of entries, and the share of valid tokens the filter could not
+clear on its own (false positives, each costing a query) is reported.
+The gap depends on the round-trip time to MongoDB, so point --mongo-uri at
+a deployment like production's. Documents written are removed afterwards.
+Run from backend/ with `python -m benchmarks.auth_overhead`.
+"""
+import argparse
+import datetime
+import os
+import statistics
+import time
+import uuid
+from bson import ObjectId
+from flask import Flask
+from utils.db import get_db, initialize_db
+from utils.revocation import RevocationStore
+from utils.token_epochs import CLAIM, TokenEpochs
+from utils.user_cache import USER_PROJECTION, UserCache
+
+def median_ms(function, runs):
+    function()
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def seed(users, revoked):
+    """Insert test users and revoked jtis, returning their ids"""
+    db = get_db()
+    now = datetime.datetime.utcnow()
+    user_ids = db.users.insert_many([
+        {'name': 'Auth Bench', 'email': f"auth-bench-{uuid.uuid4().hex}@example.com", 'password': 'x', CLAIM: 0}
+        for _ in range(users)
+    ]).inserted_ids
+    jtis = [str(uuid.uuid4()) for _ in range(revoked)]
+    if jtis:
+        db.revoked_tokens.insert_many([
+            {'_id': jti, 'expires_at': now + datetime.timedelta(hours=1), 'revoked_at': now}
+            for jti in jtis
+        ])
+    return user_ids, jtis
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-request auth overhead with and without caching')
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGODB_URI', 'mongodb://localhost:27017'))
+    parser.add_argument('--db', default='fashion_analysis_bench', help='database to write the test data to')
+    parser.add_argument('--users', type=int, default=50, help='distinct users sending requests')
+    parser.add_argument('--tokens', type=int, default=500, help='valid tokens checked per run')
+    parser.add_argument('--revoked', type=int, default=10000, help='revoked tokens in the store')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per case (the median is reported)')
+    args = parser.parse_args()
+
+    os.environ['MONGO_DB_NAME'] = args.db
+    app = Flask(__name__)
+    app.config['MONGO_URI'] = args.mongo_uri
+    initialize_db(app)
+    db = get_db()
+
+    user_ids, revoked_jtis = seed(args.users, args.revoked)
+    try:
+        payloads = [
+            {'jti': str(uuid.uuid4()), 'sub': str(user_ids[i % len(user_ids)]), CLAIM: 0}
+            for i in range(args.tokens)
+        ]
+        revocations = RevocationStore()
+        epochs = TokenEpochs()
+        users = UserCache()
+
+        def revoked_db():
+            for payload in payloads:
+                db.revoked_tokens.find_one({'_id': payload['jti']}, {'_id': 1})
+
+        def revoked_cached():
+            for payload in payloads:
+                revocations.is_revoked(payload['jti'])
+
+        def epoch_db():
+            for payload in payloads:
+                db.users.find_one({'_id': ObjectId(payload['sub'])}, {CLAIM: 1})
+
+        def epoch_cached():
+            for payload in payloads:
+                epochs.is_stale(payload)
+
+        def user_db():
+            for payload in payloads:
+                db.users.find_one({'_id': ObjectId(payload['sub'])}, USER_PROJECTION)
+
+        def user_cached():
+            for payload in payloads:
+                users.get(payload['sub'])
+
+        cases = [
+            ('revocation', revoked_db, revoked_cached),
+            ('token epoch', epoch_db, epoch_cached),
+            ('current user', user_db, user_cached)
+        ]
+        print(f"{args.tokens} tokens from {args.users} users, {args.revoked} revoked, "
+              f"median of {args.runs} runs, per request")
+        total_db = total_cached = 0
+        for name, uncached, cached in cases:
+            db_us = median_ms(uncached, args.runs) * 1000 / args.tokens
+            cached_us = median_ms(cached, args.runs) * 1000 / args.tokens
+            total_db += db_us
+            total_cached += cached_us
+            print(f"  {name:<14} db {db_us:8.1f} us   cached {cached_us:7.1f} us   {db_us / cached_us:6.1f}x")
+        print(f"  {'total':<14} db {total_db:8.1f} us   cached {total_cached:7.1f} us   {total_db / total_cached:6.1f}x")
+
+        false_positives = sum(payload['jti'] in revocations._filter for payload in payloads)
+        print(f"  Bloom filter: {revocations._filter.size // 8 // 1024} KB, "
+              f"{false_positives} of {args.tokens} valid tokens needed a query")
+    finally:
+        db.users.delete_many({'_id': {'$in': user_ids}})
+        db.revoked_tokens.delete_many({'_id': {'$in': revoked_jtis}})
+
+if __name__ == '__main__':
+    main()
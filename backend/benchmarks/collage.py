@@ -0,0 +1,90 @@
+"""Benchmark: per-image parts vs a single collage for multi-image analyses.
+
+Writes synthetic photos to a temporary folder and runs
+GeminiAnalyzer.analyze_outfit against ai/fake_gemini_server.py for
+uploads of 1, 3 and 6 images (--counts), once with one inlineData part
+per image and once with ANALYSIS_COLLAGE_MODE. For each case it reports
+the request payload size, the prompt tokens the fake server charged, and
+the median preprocessing and end-to-end latency.
+
+The fake server sleeps --latency plus --latency-per-kb for every KB of
+request body, standing in for upload time and per-image token cost; the
+defaults are rough, so compare the modes rather than the absolute times.
+No database is needed. Run from backend/ with `python -m benchmarks.collage`.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+from flask import Flask
+from ai.fake_gemini_server import FakeGeminiServer
+from ai.gemini_analyzer import GeminiAnalyzer
+from benchmarks.image_prep import write_photos
+from utils.uploads import init_upload_store
+
+def run_analyses(app, paths, collage, runs):
+    """Analyze paths runs times (after one warm-up), returning the telemetry dicts"""
+    app.config['ANALYSIS_COLLAGE_MODE'] = collage
+    calls = []
+    # The analyzer logs every call; keep the report readable
+    with app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(runs + 1):
+            telemetry = {}
+            GeminiAnalyzer.analyze_outfit(paths, telemetry=telemetry)
+            if telemetry.get('outcome') != 'success':
+                raise SystemExit(f"Analysis did not reach the fake server: {telemetry}")
+            calls.append(telemetry)
+    return calls[1:]
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-image and collage analysis payloads')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 3, 6], help='images per upload')
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--size', type=int, default=512, help='ANALYSIS_IMAGE_SIZE')
+    parser.add_argument('--collage-size', type=int, default=1024, help='ANALYSIS_COLLAGE_SIZE')
+    parser.add_argument('--quality', type=int, default=85, help='ANALYSIS_IMAGE_QUALITY')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='IMAGE_PREP_WORKERS')
+    parser.add_argument('--latency', default='fixed:0.3', help='fake server latency spec')
+    parser.add_argument('--latency-per-kb', type=float, default=0.002, help='fake server seconds per request KB')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per case (the median is reported)')
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(latency=args.latency, latency_per_kb=args.latency_per_kb).start()
+    with tempfile.TemporaryDirectory() as folder:
+        app = Flask(__name__)
+        app.config.update(
+            UPLOAD_FOLDER=folder,
+            GEMINI_API_KEY='fake',
+            GEMINI_API_BASE=server.api_base,
+            ANALYSIS_CACHE_ENABLED=False,
+            ANALYSIS_IMAGE_SIZE=args.size,
+            ANALYSIS_COLLAGE_SIZE=args.collage_size,
+            ANALYSIS_IMAGE_QUALITY=args.quality,
+            IMAGE_PREP_WORKERS=args.workers
+        )
+        init_upload_store(app)
+        paths = write_photos(folder, max(args.counts), args.width, args.height)
+
+        megapixels = args.width * args.height / 1000000
+        print(f"{megapixels:.0f} MP JPEGs, fake latency {args.latency} + {args.latency_per_kb * 1000:g} ms/KB, "
+              f"median of {args.runs} runs")
+        print(f"  {'images':>6}  {'mode':<9} {'payload':>10} {'tokens':>7} {'preprocess':>11} {'total':>10}")
+        for count in args.counts:
+            for collage in (False, True):
+                if collage and count == 1:
+                    # A single image is always sent as-is
+                    continue
+                calls = run_analyses(app, paths[:count], collage, args.runs)
+                payload_kb = statistics.median(call['payload_bytes'] for call in calls) / 1024
+                tokens = statistics.median(call.get('prompt_tokens') or 0 for call in calls)
+                preprocess_ms = statistics.median(call['preprocess_ms'] for call in calls)
+                total_ms = statistics.median(call['total_ms'] for call in calls)
+                print(f"  {count:>6}  {'collage' if collage else 'per-image':<9} {payload_kb:7.1f} KB "
+                      f"{tokens:>7.0f} {preprocess_ms:8.1f} ms {total_ms:7.1f} ms")
+    server.stop()
+
+if __name__ == '__main__':
+    main()
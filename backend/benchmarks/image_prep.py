@@ -0,0 +1,86 @@
+"""Microbenchmark: preparing a multi-image upload for Gemini.
+
+Writes synthetic photos (12 MP JPEGs by default) to a temporary folder
+and times turning them into inlineData parts:
+
+- old: each image decoded at full size, squashed to 512x512 with LANCZOS
+  and encoded, one after the other (the original GeminiAnalyzer loop);
+- new: ai.image_prep.prepare_images (draft-mode decode, aspect-preserving
+  thumbnail, thread pool) followed by to_inline_part.
+
+Run from backend/ with `python -m benchmarks.image_prep`.
+"""
+import argparse
+import base64
+import io
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+from PIL import Image, ImageFilter
+from ai.image_prep import prepare_images, to_inline_part
+
+def old_encode_images(image_paths):
+    """The sequential loop the analyzer used before ai/image_prep.py"""
+    image_parts = []
+    for image_path in image_paths:
+        with Image.open(image_path) as img:
+            img = img.resize((512, 512), Image.LANCZOS)
+            buffered = io.BytesIO()
+            img.save(buffered, format="JPEG", quality=85)
+            image_parts.append({
+                "inlineData": {
+                    "mimeType": "image/jpeg",
+                    "data": base64.b64encode(buffered.getvalue()).decode('utf-8')
+                }
+            })
+    return image_parts
+
+def new_encode_images(image_paths, max_size, quality, workers):
+    return [to_inline_part(prepared) for prepared in prepare_images(image_paths, max_size, quality, workers)]
+
+def write_photos(folder, count, width, height):
+    paths = []
+    for index in range(count):
+        # Blurred noise: compresses like a photo rather than a flat colour
+        pixels = np.random.default_rng(index).integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize((width, height)).filter(ImageFilter.GaussianBlur(2))
+        path = os.path.join(folder, f"photo{index}.jpg")
+        image.save(path, 'JPEG', quality=90)
+        paths.append(path)
+    return paths
+
+def median_ms(function, runs):
+    function()
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the old and new analysis image preparation')
+    parser.add_argument('--images', type=int, default=5, help='images per upload')
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--size', type=int, default=512, help='ANALYSIS_IMAGE_SIZE')
+    parser.add_argument('--quality', type=int, default=85, help='ANALYSIS_IMAGE_QUALITY')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='IMAGE_PREP_WORKERS')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per path (the median is reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_photos(folder, args.images, args.width, args.height)
+        old_ms = median_ms(lambda: old_encode_images(paths), args.runs)
+        new_ms = median_ms(lambda: new_encode_images(paths, args.size, args.quality, args.workers), args.runs)
+
+    megapixels = args.width * args.height / 1000000
+    print(f"{args.images} x {megapixels:.0f} MP JPEGs, {args.workers} workers, {os.cpu_count()} CPUs, "
+          f"median of {args.runs} runs")
+    print(f"  old (sequential, 512x512)   {old_ms:8.1f} ms")
+    print(f"  new (prepare_images)        {new_ms:8.1f} ms   {old_ms / new_ms:4.1f}x")
+
+if __name__ == '__main__':
+    main()
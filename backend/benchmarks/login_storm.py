@@ -0,0 +1,95 @@
+"""Load test: /api/health/ping latency while clients hammer the login route.
+
+Against a running server (e.g. `python run.py`, or the threaded dev server
+on a single CPU to see the effect most clearly):
+
+1. ping is polled every --interval seconds for a few idle seconds;
+2. --clients threads then log in back-to-back for --duration seconds
+   while ping keeps being polled;
+3. ping p50/p99 idle and under the storm, login outcomes and latency, and
+   the server's /api/health/passwords stats are printed.
+
+The test user is registered on first use. Run from backend/ with
+`python -m benchmarks.login_storm --url http://127.0.0.1:5000`.
+"""
+import argparse
+import threading
+import time
+import requests
+from utils.stats import percentile
+
+def poll_ping(url, seconds, interval):
+    session = requests.Session()
+    latencies = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        started = time.perf_counter()
+        session.get(f"{url}/api/health/ping", timeout=30)
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(interval)
+    return sorted(latencies)
+
+def ensure_user(url, email, password):
+    response = requests.post(f"{url}/api/auth/login", json={'email': email, 'password': password}, timeout=60)
+    if response.status_code == 401:
+        response = requests.post(
+            f"{url}/api/auth/register",
+            json={'name': 'Load Test', 'email': email, 'password': password},
+            timeout=60
+        )
+    response.raise_for_status()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure ping latency during a login storm')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='base URL of a running server')
+    parser.add_argument('--email', default='loadtest@example.com')
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent login loops')
+    parser.add_argument('--duration', type=float, default=12, help='seconds of login storm')
+    parser.add_argument('--idle', type=float, default=3, help='seconds of idle pings first')
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between pings')
+    args = parser.parse_args()
+    url = args.url.rstrip('/')
+
+    ensure_user(url, args.email, args.password)
+    idle = poll_ping(url, args.idle, args.interval)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    logins = []
+    statuses = {}
+
+    def storm():
+        session = requests.Session()
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = session.post(
+                f"{url}/api/auth/login",
+                json={'email': args.email, 'password': args.password},
+                timeout=120
+            )
+            with lock:
+                logins.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=storm, daemon=True) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    # Let the login queue fill before measuring
+    time.sleep(1)
+    busy = poll_ping(url, args.duration, args.interval)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    logins.sort()
+    print(f"ping idle:  p50 {percentile(idle, 50):6.1f} ms  p99 {percentile(idle, 99):6.1f} ms  ({len(idle)} requests)")
+    print(f"ping storm: p50 {percentile(busy, 50):6.1f} ms  p99 {percentile(busy, 99):6.1f} ms  ({len(busy)} requests)")
+    print(f"logins: {sum(statuses.values())} {dict(sorted(statuses.items()))}, "
+          f"p50 {percentile(logins, 50):.0f} ms  p99 {percentile(logins, 99):.0f} ms")
+    health = requests.get(f"{url}/api/health/passwords", timeout=30)
+    if health.ok:
+        print(f"hasher: {health.json()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark: the old serialize_doc JSON round-trip vs. the current path.
+
+Builds a wardrobe of synthetic documents shaped like wardrobe_items
+(ObjectIds, datetimes, lists, a nested analysis dict) and times:
+
+- serialize_doc alone: JSONEncoder encode + json.loads (old) vs the
+  single-pass converter (new);
+- serialize_doc + jsonify: the old conversion with Flask's default JSON
+  provider vs the new one with OrjsonProvider;
+- raw documents straight to OrjsonProvider.
+
+Both paths are checked to produce the same JSON first. No database is
+needed. Run from backend/ with `python -m benchmarks.serialize_doc`.
+"""
+import argparse
+import datetime
+import json
+import statistics
+import time
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from utils.db import JSONEncoder, serialize_doc
+from utils.json_provider import OrjsonProvider
+
+def old_serialize_doc(doc):
+    """serialize_doc as it was: encode to a string and parse it back"""
+    if doc is None:
+        return None
+    return json.loads(JSONEncoder().encode(doc))
+
+def make_wardrobe(count):
+    user_id = ObjectId()
+    now = datetime.datetime.utcnow()
+    return [{
+        '_id': ObjectId(),
+        'user_id': user_id,
+        'name': f"Item {i}",
+        'category': 'tops',
+        'color': 'navy',
+        'season': ['spring', 'summer'],
+        'tags': ['casual', 'work', 'cotton'],
+        'image': f"/uploads/blobs/ab/{i:064x}.jpg",
+        'notes': 'Soft cotton shirt — fits well',
+        'times_worn': i % 17,
+        'favorite': i % 3 == 0,
+        'price': 19.99 + i,
+        'created_at': now,
+        'updated_at': now,
+        'analysis': {'style': 'casual', 'score': 0.87, 'colors': [{'name': 'navy', 'hex': '#000080', 'share': 0.7}]}
+    } for i in range(count)]
+
+def median_ms(function, runs):
+    function()
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the old and new document serialization paths')
+    parser.add_argument('--items', type=int, default=1000, help='documents in the wardrobe')
+    parser.add_argument('--runs', type=int, default=50, help='timed runs per case (the median is reported)')
+    args = parser.parse_args()
+
+    wardrobe = make_wardrobe(args.items)
+    app = Flask(__name__)
+    default_json = DefaultJSONProvider(app)
+    orjson_json = OrjsonProvider(app)
+
+    with app.test_request_context():
+        old_body = default_json.response(old_serialize_doc(wardrobe)).get_data()
+        new_body = orjson_json.response(serialize_doc(wardrobe)).get_data()
+        if json.loads(old_body) != json.loads(new_body):
+            raise SystemExit('The old and new paths produce different JSON')
+
+        cases = [
+            ('serialize_doc', lambda: old_serialize_doc(wardrobe), lambda: serialize_doc(wardrobe)),
+            ('serialize_doc + jsonify',
+             lambda: default_json.response(old_serialize_doc(wardrobe)),
+             lambda: orjson_json.response(serialize_doc(wardrobe))),
+        ]
+        print(f"{args.items} documents, median of {args.runs} runs")
+        for name, old, new in cases:
+            old_ms = median_ms(old, args.runs)
+            new_ms = median_ms(new, args.runs)
+            print(f"  {name:<26} old {old_ms:7.2f} ms   new {new_ms:7.2f} ms   {old_ms / new_ms:4.1f}x")
+        raw_ms = median_ms(lambda: orjson_json.response(wardrobe), args.runs)
+        print(f"  {'raw documents + orjson':<26} {raw_ms:7.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark: requests/sec for serving uploads, before and after send_upload.
+
+Stores a synthetic photo as a content-addressed blob in a temporary upload
+folder and serves it from a threaded local HTTP server in two ways:
+
+- before: send_from_directory with its default headers (the original
+  /uploads route);
+- after: utils.uploads.send_upload (strong SHA-256 ETag, immutable
+  Cache-Control, Range, optional X-Accel-Redirect offload).
+
+--clients threads then fetch the image back-to-back for --duration seconds
+per case: a full GET, a revalidation with the response's ETag, a 1 KB
+Range request and, for the new path, the x-accel mode (which only measures
+Flask's side, as there is no nginx in front). Keep in mind that immutable
+responses are not revalidated by browsers at all, so repeat views of a
+wardrobe make no requests after the change. No database is needed. Run
+from backend/ with `python -m benchmarks.upload_serving`.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import requests
+from flask import Flask, send_from_directory
+from werkzeug.serving import make_server
+from benchmarks.image_prep import write_photos
+from utils.uploads import UploadStore, send_upload
+
+def make_app(folder):
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = folder
+
+    @app.route('/before/<path:filename>')
+    def before(filename):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+    @app.route('/after/<path:filename>')
+    def after(filename):
+        return send_upload(filename)
+
+    return app
+
+def requests_per_second(url, headers, clients, duration):
+    """Fetch url from several threads for duration seconds, returning (req/s, statuses)"""
+    stop = threading.Event()
+    lock = threading.Lock()
+    statuses = {}
+
+    def fetch():
+        session = requests.Session()
+        while not stop.is_set():
+            response = session.get(url, headers=headers, timeout=30)
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=fetch, daemon=True) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(statuses.values()) / (time.perf_counter() - started), statuses
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare upload serving throughput before and after send_upload')
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--height', type=int, default=900)
+    parser.add_argument('--clients', type=int, default=4, help='concurrent fetch loops')
+    parser.add_argument('--duration', type=float, default=3, help='seconds per case')
+    args = parser.parse_args()
+
+    # Keep the per-request access log out of the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as folder:
+        photo = write_photos(folder, 1, args.width, args.height)[0]
+        with open(photo, 'rb') as f:
+            data = f.read()
+        name = UploadStore.blob_name(hashlib.sha256(data).hexdigest(), 'jpg')
+        os.makedirs(os.path.dirname(os.path.join(folder, name)))
+        os.replace(photo, os.path.join(folder, name))
+
+        app = make_app(folder)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        etags = {route: requests.get(f"{base}/{route}/{name}", timeout=30).headers['ETag'] for route in ('before', 'after')}
+
+        # (case, UPLOAD_SENDFILE_MODE, headers; None revalidates with the route's own ETag)
+        cases = [
+            ('full GET (200)', '', {}),
+            ('revalidation (304)', '', None),
+            ('Range 0-1023 (206)', '', {'Range': 'bytes=0-1023'}),
+            ('x-accel offload', 'x-accel', {})
+        ]
+        print(f"{len(data) / 1024:.0f} KB JPEG, {args.clients} clients, {args.duration:g} s per case, "
+              f"{os.cpu_count()} CPUs")
+        for case, mode, headers in cases:
+            app.config['UPLOAD_SENDFILE_MODE'] = mode
+            rates = {}
+            for route in ('before', 'after'):
+                if mode and route == 'before':
+                    # send_from_directory has no offload mode
+                    continue
+                route_headers = {'If-None-Match': etags[route]} if headers is None else headers
+                rates[route], statuses = requests_per_second(
+                    f"{base}/{route}/{name}", route_headers, args.clients, args.duration
+                )
+                if len(statuses) > 1:
+                    raise SystemExit(f"Mixed responses for {case} ({route}): {statuses}")
+            if 'before' in rates:
+                print(f"  {case:<20} before {rates['before']:6.0f} req/s   after {rates['after']:6.0f} req/s   "
+                      f"{rates['after'] / rates['before']:4.2f}x")
+            else:
+                print(f"  {case:<20} {'':<18}   after {rates['after']:6.0f} req/s")
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
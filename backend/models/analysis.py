@@ -22,6 +22,12 @@ class Analysis:
             'created_at': datetime.datetime.utcnow()
         }
         
+        # Perceptual hashes let later uploads of the same outfit reuse this result
+        if analysis_data.get('phashes'):
+            analysis['phashes'] = analysis_data['phashes']
+        if analysis_data.get('reused_from'):
+            analysis['reused_from'] = ObjectId(analysis_data['reused_from'])
+        
         # Insert analysis into database
         result = db.analyses.insert_one(analysis)
         analysis['_id'] = result.inserted_id
@@ -1,6 +1,8 @@
-import bcrypt
 from bson.objectid import ObjectId
 from utils.db import get_db, serialize_doc
+from utils.user_cache import invalidate_user
+from utils.token_epochs import CLAIM as TOKEN_EPOCH, invalidate_token_epoch
+from utils.passwords import get_password_hasher
 import datetime
 
 class User:
@@ -15,8 +17,8 @@ class User:
         if db.users.find_one({'email': email}):
             return None
             
-        # Hash password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # Hash password (on the bcrypt pool, may raise PasswordHasherBusy)
+        hashed_password = get_password_hasher().hash(password)
         
         # Create user document
         user = {
@@ -63,7 +65,15 @@ class User:
             return None # Or handle differently, e.g., return an error specific to OAuth users
         
         # Check password
-        if bcrypt.checkpw(password.encode('utf-8'), user['password']):
+        hasher = get_password_hasher()
+        if hasher.check(password, user['password']):
+            # Upgrade hashes made at an older BCRYPT_ROUNDS while we have the password
+            if hasher.needs_rehash(user['password']):
+                db.users.update_one(
+                    {'_id': user['_id'], 'password': user['password']},
+                    {'$set': {'password': hasher.hash(password)}}
+                )
+                hasher.record_rehash()
             return serialize_doc(user)
             
         return None
@@ -98,6 +108,7 @@ class User:
             {'_id': user_id},
             {'$set': update_data}
         )
+        invalidate_user(user_id)
         
         return result.modified_count > 0
     
@@ -115,6 +126,7 @@ class User:
             {'_id': user_id},
             {'$set': {'preferences': preferences}}
         )
+        invalidate_user(user_id)
         
         return result.modified_count > 0
     
@@ -138,16 +150,18 @@ class User:
             return False, "OAuth users cannot update password"
         
         # Verify current password
-        if not bcrypt.checkpw(current_password.encode('utf-8'), user['password']):
+        hasher = get_password_hasher()
+        if not hasher.check(current_password, user['password']):
             return False, "Current password is incorrect"
             
         # Hash new password
-        hashed_new_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        hashed_new_password = hasher.hash(new_password)
         
-        # Update password
+        # Update password and sign out every existing session in the same write
         result = db.users.update_one(
             {'_id': user_id},
-            {'$set': {'password': hashed_new_password}}
+            {'$set': {'password': hashed_new_password}, '$inc': {TOKEN_EPOCH: 1}}
         )
+        invalidate_token_epoch(user_id)
         
         return result.modified_count > 0, "Password updated successfully" if result.modified_count > 0 else "Failed to update password"
@@ -1,5 +1,6 @@
 from bson.objectid import ObjectId
 from utils.db import get_db, serialize_doc
+from utils.uploads import get_upload_store
 import datetime
 
 class WardrobeItem:
@@ -72,11 +73,12 @@ class WardrobeItem:
             {'$set': update_data}
         )
         
-        return result.modified_count > 0
+        # Setting the values it already has still counts as a successful update
+        return result.matched_count > 0
     
     @staticmethod
     def delete(item_id):
-        """Delete wardrobe item"""
+        """Delete wardrobe item and release its uploaded image"""
         db = get_db()
         
         # Convert string ID to ObjectId if necessary
@@ -84,6 +86,11 @@ class WardrobeItem:
             item_id = ObjectId(item_id)
             
         # Delete item document
-        result = db.wardrobe_items.delete_one({'_id': item_id})
+        item = db.wardrobe_items.find_one_and_delete({'_id': item_id})
+        if not item:
+            return False
         
-        return result.deleted_count > 0
+        # Reclaim the image once no other item or analysis uses it
+        get_upload_store().release(item.get('image'))
+        
+        return True
@@ -1,33 +1,103 @@
-from flask import Blueprint, request, jsonify, current_app
-import os
-import uuid
-from werkzeug.utils import secure_filename
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+import json
+import time
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_current_user
+from utils.idempotency import idempotent
+from utils.image_validation import InvalidImage
+from utils.uploads import get_upload_store
 from models.analysis import Analysis
-from models.user import User
-from ai.gemini_analyzer import GeminiAnalyzer
+from ai.analyzers import get_analyzer
+from ai.local_analyzer import LocalAnalyzer
+from ai.near_duplicates import dhash, get_near_duplicate_index, is_reusable
+from utils.jobs import QueueFull, TERMINAL_STATES, get_job_queue
 
 analysis_bp = Blueprint('analysis', __name__)
 
-# Helper function to check allowed file extensions
-def allowed_file(filename):
-    """Check if file has allowed extension"""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def wants_async():
+    """Check if the client opted in to asynchronous analysis"""
+    if request.args.get('async', '').lower() in ('true', '1', 'yes'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+def save_images(files, user_id):
+    """Save uploaded images for a user, returning file paths and public URLs.
+
+    Raises InvalidImage if any file fails validation, after releasing the
+    ones already saved.
+    """
+    store = get_upload_store()
+    saved_paths = []
+    public_urls = []
+    for file in files:
+        if file and file.filename:
+            # Identical images are stored once in the content-addressable store
+            try:
+                file_path, public_url = store.save(file, kind='analysis')
+            except InvalidImage as e:
+                for saved_url in public_urls:
+                    store.release(saved_url)
+                raise InvalidImage(f"{file.filename}: {e}", e.status)
+            saved_paths.append(file_path)
+            public_urls.append(public_url)
+    
+    return saved_paths, public_urls
+
+def perceptual_hashes(image_paths):
+    """Perceptual hashes of saved images, or None if near-duplicate reuse is off"""
+    if not current_app.config.get('ANALYSIS_DEDUPE_ENABLED', True):
+        return None
+    try:
+        return [dhash(image_path) for image_path in image_paths]
+    except Exception as e:
+        print(f"Error hashing uploaded images: {e}")
+        return None
+
+def find_reusable_analysis(user_id, phashes):
+    """Find a past analysis of visually identical images, unless ?fresh=true"""
+    if not phashes or request.args.get('fresh', '').lower() in ('true', '1', 'yes'):
+        return None
+    match = get_near_duplicate_index(current_app.config).find(user_id, phashes)
+    if not match:
+        return None
+    analysis = Analysis.get_by_id(match[0])
+    if not analysis or not is_reusable(analysis.get('results')):
+        return None
+    analysis['distance'] = match[1]
+    return analysis
+
+def save_analysis(user_id, public_urls, analysis_results, phashes, reused_from=None):
+    """Persist an analysis; Gemini results become available for near-duplicate reuse"""
+    analysis = Analysis.create(user_id, {
+        'images': public_urls,
+        'results': analysis_results,
+        'phashes': phashes,
+        'reused_from': reused_from
+    })
+    if is_reusable(analysis_results):
+        get_near_duplicate_index(current_app.config).add(user_id, analysis['_id'], phashes)
+    return analysis
+
+def sse_event(event, data):
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def job_response(job):
+    """Build the client-facing view of an analysis job"""
+    return {
+        'jobId': job['_id'],
+        'status': job['status'],
+        'id': job.get('analysis_id'),
+        'images': job.get('images', []),
+        'results': job.get('results'),
+        'error': job.get('error')
+    }
 
 @analysis_bp.route('/upload', methods=['POST'])
 @jwt_required()
+@idempotent
 def upload_images():
     """Upload images for analysis"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     # Check if request has files
     if 'images' not in request.files:
@@ -39,44 +109,48 @@ def upload_images():
     if not files or files[0].filename == '':
         return jsonify({'error': 'No images selected'}), 400
         
-    # Create upload directory for user if it doesn't exist
-    user_upload_dir = os.path.join(
-        current_app.config['UPLOAD_FOLDER'],
-        str(current_user['_id'])
-    )
-    os.makedirs(user_upload_dir, exist_ok=True)
-    
-    # Save files
-    saved_paths = []
-    public_urls = []
-    for file in files:
-        if file and allowed_file(file.filename):
-            # Generate unique filename
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(user_upload_dir, unique_filename)
-            
-            # Save file
-            file.save(file_path)
-            saved_paths.append(file_path)
-            
-            # Generate public URL
-            public_url = f"/uploads/{current_user['_id']}/{unique_filename}"
-            public_urls.append(public_url)
+    try:
+        saved_paths, public_urls = save_images(files, current_user['_id'])
+    except InvalidImage as e:
+        return jsonify({'error': str(e)}), e.status
     
     if not saved_paths:
         return jsonify({'error': 'No valid images uploaded'}), 400
+    
+    # The same outfit photographed again gets the earlier results
+    phashes = perceptual_hashes(saved_paths)
+    previous = find_reusable_analysis(current_user['_id'], phashes)
+    if previous:
+        analysis = save_analysis(current_user['_id'], public_urls, previous['results'], phashes, previous['_id'])
+        return jsonify({
+            'id': analysis['_id'],
+            'images': public_urls,
+            'results': previous['results'],
+            'reusedFrom': previous['_id'],
+            'distance': previous['distance']
+        }), 201
+    
+    # In async mode the analysis runs on the job queue and the client polls
+    if wants_async():
+        try:
+            job = get_job_queue().submit(current_user['_id'], saved_paths, public_urls, phashes)
+        except QueueFull:
+            response = jsonify({'error': 'Analysis queue is full, please try again shortly'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        response = jsonify(job_response(job))
+        response.headers['Location'] = f"/api/analysis/jobs/{job['_id']}"
+        return response, 202
         
-    # Analyze outfit using Gemini
-    analysis_results = GeminiAnalyzer.analyze_outfit(saved_paths)
+    # Analyze outfit using the configured analyzer backend
+    analysis_results = get_analyzer(current_app.config).analyze_outfit(saved_paths)
     
-    # Save analysis to database
-    analysis_data = {
-        'images': public_urls,
-        'results': analysis_results
-    }
+    if analysis_results is None:
+        return jsonify({'error': 'Could not read the uploaded images'}), 422
     
-    analysis = Analysis.create(current_user['_id'], analysis_data)
+    # Save analysis to database
+    analysis = save_analysis(current_user['_id'], public_urls, analysis_results, phashes)
     
     # Return analysis results
     return jsonify({
@@ -85,19 +159,150 @@ def upload_images():
         'results': analysis_results
     }), 201
 
+@analysis_bp.route('/upload/stream', methods=['POST'])
+@jwt_required()
+def upload_images_stream():
+    """Upload images and stream analysis fields as server-sent events"""
+    current_user = get_current_user()
+    
+    # Check if request has files
+    if 'images' not in request.files:
+        return jsonify({'error': 'No images provided'}), 400
+        
+    files = request.files.getlist('images')
+    
+    # Check if files are empty
+    if not files or files[0].filename == '':
+        return jsonify({'error': 'No images selected'}), 400
+        
+    try:
+        saved_paths, public_urls = save_images(files, current_user['_id'])
+    except InvalidImage as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    if not saved_paths:
+        return jsonify({'error': 'No valid images uploaded'}), 400
+    
+    user_id = current_user['_id']
+    phashes = perceptual_hashes(saved_paths)
+    previous = find_reusable_analysis(user_id, phashes)
+    analyzer = get_analyzer(current_app.config)
+    local_preview = (
+        current_app.config.get('ANALYSIS_LOCAL_PREVIEW', True)
+        and analyzer is not LocalAnalyzer
+        and current_app.config.get('GEMINI_API_KEY')
+    )
+    
+    def generate():
+        yield sse_event('images', {'images': public_urls})
+        
+        if previous:
+            for field, value in previous['results'].items():
+                yield sse_event('field', {'field': field, 'value': value})
+            analysis = save_analysis(user_id, public_urls, previous['results'], phashes, previous['_id'])
+            yield sse_event('complete', {
+                'id': analysis['_id'],
+                'images': public_urls,
+                'results': previous['results'],
+                'reusedFrom': previous['_id'],
+                'distance': previous['distance']
+            })
+            return
+        
+        # A local color analysis gives the client something to show instantly
+        if local_preview:
+            preview = LocalAnalyzer.analyze_outfit(saved_paths)
+            if preview is not None:
+                yield sse_event('preview', preview)
+        
+        # Partial fields arrive next (score, style, ... recommendations)
+        analysis_results = None
+        try:
+            for event in analyzer.stream_outfit_analysis(saved_paths):
+                if event[0] == 'field':
+                    yield sse_event('field', {'field': event[1], 'value': event[2]})
+                else:
+                    analysis_results = event[1]
+        except Exception as e:
+            print(f"Error streaming analysis: {e}")
+            yield sse_event('error', {'error': 'Analysis failed'})
+            return
+        
+        if analysis_results is None:
+            yield sse_event('error', {'error': 'Could not read the uploaded images'})
+            return
+        
+        # The assembled result is persisted exactly like a regular upload
+        analysis = save_analysis(user_id, public_urls, analysis_results, phashes)
+        yield sse_event('complete', {
+            'id': analysis['_id'],
+            'images': public_urls,
+            'results': analysis_results
+        })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@analysis_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    """Get the status of an asynchronous analysis job"""
+    current_user_id = get_jwt_identity()
+    job = get_job_queue().get(job_id)
+    
+    # Jobs belonging to other users are reported as missing
+    if not job or job['user_id'] != current_user_id:
+        return jsonify({'error': 'Job not found'}), 404
+        
+    return jsonify(job_response(job)), 200
+
+@analysis_bp.route('/jobs/<job_id>/events', methods=['GET'])
+@jwt_required()
+def stream_job(job_id):
+    """Stream job status changes as server-sent events"""
+    current_user_id = get_jwt_identity()
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    
+    if not job or job['user_id'] != current_user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    poll_interval = current_app.config.get('ANALYSIS_JOB_POLL_INTERVAL', 0.5)
+    timeout = current_app.config.get('ANALYSIS_JOB_STREAM_TIMEOUT', 300)
+    
+    def generate():
+        last_status = None
+        last_sent = time.monotonic()
+        deadline = last_sent + timeout
+        current_job = job
+        while True:
+            if current_job['status'] != last_status:
+                last_status = current_job['status']
+                last_sent = time.monotonic()
+                yield sse_event('status', job_response(current_job))
+            if last_status in TERMINAL_STATES or time.monotonic() > deadline:
+                return
+            # Comment lines keep proxies from closing an idle stream
+            if time.monotonic() - last_sent > 15:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(poll_interval)
+            current_job = queue.get(job_id) or current_job
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @analysis_bp.route('/<analysis_id>', methods=['GET'])
 @jwt_required()
 def get_analysis(analysis_id):
     """Get analysis by ID"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     analysis = Analysis.get_by_id(analysis_id)
     
@@ -105,7 +310,7 @@ def get_analysis(analysis_id):
         return jsonify({'error': 'Analysis not found'}), 404
         
     # Check if analysis belongs to current user
-    if analysis['user_id'] != current_user['_id']:
+    if analysis['user_id'] != str(current_user['_id']):
         return jsonify({'error': 'Unauthorized'}), 403
         
     return jsonify(analysis), 200
@@ -114,15 +319,7 @@ def get_analysis(analysis_id):
 @jwt_required()
 def get_history():
     """Get analysis history for current user"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     limit = request.args.get('limit', 10, type=int)
     analyses = Analysis.get_by_user(current_user['_id'], limit)
@@ -1,9 +1,11 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_jwt
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_jwt, get_current_user
 import datetime
 import bcrypt
 from models.user import User
-from utils.auth import generate_token, token_required
+from utils.revocation import get_revocation_store, token_expiry
+from utils.token_epochs import get_token_epochs
+from utils.passwords import PasswordHasherBusy
 import uuid # Import uuid for generating random passwords for OAuth users
 
 auth_bp = Blueprint('auth', __name__)
@@ -20,6 +22,24 @@ def login_options():
     """Handle preflight request for login"""
     return '', 200
 
+def identity_claims(user):
+    """Profile fields carried in every token, so /me needs no lookup"""
+    return {'name': user['name'], 'email': user['email']}
+
+def issue_tokens(user):
+    """Access/refresh pair for a user, as returned by every login route"""
+    claims = identity_claims(user)
+    return {
+        'access_token': create_access_token(identity=str(user['_id']), additional_claims=claims),
+        'refresh_token': create_refresh_token(identity=str(user['_id']), additional_claims=claims)
+    }
+
+def hasher_busy_response(error):
+    """503 for when the password hashing pool is saturated"""
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
 @auth_bp.route('/refresh', methods=['OPTIONS'])
 def refresh_options():
     """Handle preflight request for refresh"""
@@ -39,19 +59,18 @@ def register():
     if not data or not data.get('name') or not data.get('email') or not data.get('password'):
         return jsonify({'error': 'Missing required fields'}), 400
           # Create user
-    user = User.create(
-        name=data['name'],
-        email=data['email'],
-        password=data['password']
-    )
+    try:
+        user = User.create(
+            name=data['name'],
+            email=data['email'],
+            password=data['password']
+        )
+    except PasswordHasherBusy as e:
+        return hasher_busy_response(e)
     
     if not user:
         return jsonify({'error': 'User already exists'}), 409
         
-    # Generate JWT tokens
-    access_token = create_access_token(identity=str(user['_id']))
-    refresh_token = create_refresh_token(identity=str(user['_id']))
-    
     # Return user data and tokens
     return jsonify({
         'user': {
@@ -59,8 +78,7 @@ def register():
             'name': user['name'],
             'email': user['email']
         },
-        'access_token': access_token,
-        'refresh_token': refresh_token
+        **issue_tokens(user)
     }), 201
 
 @auth_bp.route('/login', methods=['POST'])
@@ -73,26 +91,24 @@ def login():
         return jsonify({'error': 'Missing email or password'}), 400
         
     # Authenticate user
-    user = User.authenticate(
-        email=data['email'],
-        password=data['password']
-    )
+    try:
+        user = User.authenticate(
+            email=data['email'],
+            password=data['password']
+        )
+    except PasswordHasherBusy as e:
+        return hasher_busy_response(e)
     if not user:
         return jsonify({'error': 'Invalid credentials'}), 401
         
-    # Generate JWT tokens for persistent session
-    access_token = create_access_token(identity=str(user['_id']))
-    refresh_token = create_refresh_token(identity=str(user['_id']))
-    
-    # Return user data and tokens
+    # Return user data and JWT tokens for a persistent session
     return jsonify({
         'user': {
             'id': str(user['_id']),
             'name': user['name'],
             'email': user['email']
         },
-        'access_token': access_token,
-        'refresh_token': refresh_token
+        **issue_tokens(user)
     }), 200
 
 @auth_bp.route('/oauth-login', methods=['POST'])
@@ -116,14 +132,17 @@ def oauth_login():
         # For OAuth users, we might not have a password, or we can generate a random one
         # as they won't use it for direct login.
         random_password = str(uuid.uuid4()) # Generate a random password
-        user_data = User.create(
-            name=name,
-            email=email,
-            password=random_password, # Store a random, unusable password
-            is_oauth_user=True, # Add a flag to indicate OAuth user
-            oauth_provider=data.get('provider'),
-            oauth_provider_account_id=data.get('providerAccountId')
-        )
+        try:
+            user_data = User.create(
+                name=name,
+                email=email,
+                password=random_password, # Store a random, unusable password
+                is_oauth_user=True, # Add a flag to indicate OAuth user
+                oauth_provider=data.get('provider'),
+                oauth_provider_account_id=data.get('providerAccountId')
+            )
+        except PasswordHasherBusy as e:
+            return hasher_busy_response(e)
         if not user_data:
             # This case should ideally not happen if find_by_email was correct
             return jsonify({'error': 'User creation failed during OAuth process'}), 500
@@ -136,31 +155,38 @@ def oauth_login():
         pass # User found, proceed to token generation
 
     # At this point, 'user' dictionary contains the user details (either existing or newly created)
-    token = generate_token(user['_id'])
+    tokens = issue_tokens(user)
 
     return jsonify({
         'user': {
-            'id': user['_id'],
+            'id': str(user['_id']),
             'name': user['name'],
             'email': user['email']
             # Add other relevant user fields if needed
         },
-        'token': token
+        **tokens,
+        # Older clients read the access token from 'token'
+        'token': tokens['access_token']
     }), 200
 
 
-@auth_bp.route('/me', methods=['GET'])
+def token_user():
+    """The current user's id, name and email, from the token's claims.
+
+    Tokens issued before the claims existed fall back to the (cached)
+    current user.
+    """
+    claims = get_jwt()
+    if 'name' in claims and 'email' in claims:
+        return {'id': claims['sub'], 'name': claims['name'], 'email': claims['email']}
+    user = get_current_user()
+    return {'id': str(user['_id']), 'name': user['name'], 'email': user['email']}
 
-@token_required
-def me(current_user):
+@auth_bp.route('/me', methods=['GET'])
+@jwt_required()
+def me():
     """Get current user"""
-    return jsonify({
-        'user': {
-            'id': current_user['_id'],
-            'name': current_user['name'],
-            'email': current_user['email']
-        }
-    }), 200
+    return jsonify({'user': token_user()}), 200
 
 @auth_bp.route('/refresh', methods=['POST'])
 
@@ -169,10 +195,13 @@ def refresh():
     """Refresh access token using refresh token"""
     
     try:
-        current_user_id = get_jwt_identity()
+        current_user = get_current_user()
         
-        # Create new access token
-        new_access_token = create_access_token(identity=current_user_id)
+        # Create new access token, with the user's current name and email
+        new_access_token = create_access_token(
+            identity=str(current_user['_id']),
+            additional_claims=identity_claims(current_user)
+        )
         
         return jsonify({
             'access_token': new_access_token
@@ -187,12 +216,9 @@ def logout():
     """Logout user and revoke tokens"""
     
     try:
-        # Get the JWT token identifier
-        jti = get_jwt()['jti']
-        
-        # Add token to blacklist (we'll need to import blacklist from app.py)
-        from app import blacklist
-        blacklist.add(jti)
+        # Revoke this token in every worker until it would have expired
+        token = get_jwt()
+        get_revocation_store(current_app.config).revoke(token['jti'], token_expiry(token))
         
         return jsonify({'message': 'Successfully logged out'}), 200
         
@@ -205,13 +231,8 @@ def logout_all():
     """Logout user from all devices by revoking all tokens"""
     
     try:
-        # In a real application, you would store user sessions in database
-        # and mark all sessions for this user as invalid
-        # For now, we'll just revoke the current token
-        jti = get_jwt()['jti']
-        
-        from app import blacklist
-        blacklist.add(jti)
+        # Bumping the user's token epoch invalidates every token issued so far
+        get_token_epochs(current_app.config).bump(get_jwt_identity())
         
         return jsonify({'message': 'Successfully logged out from all devices'}), 200
         
@@ -224,20 +245,10 @@ def session_check():
     """Check if current session is valid"""
     
     try:
-        current_user_id = get_jwt_identity()
-        
-        # Get user details
-        user = User.get_by_id(current_user_id)
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
+        # Answered from the token; the user loader already confirmed the user exists
         return jsonify({
             'valid': True,
-            'user': {
-                'id': str(user['_id']),
-                'name': user['name'],
-                'email': user['email']
-            }
+            'user': token_user()
         }), 200
         
     except Exception as e:
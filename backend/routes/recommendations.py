@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_current_user
 from models.recommendation import Recommendation
 from ai.recommender import OutfitRecommender
 
@@ -9,15 +9,7 @@ recommendations_bp = Blueprint('recommendations', __name__)
 @jwt_required()
 def get_outfit_recommendations():
     """Get outfit recommendations for current user"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     count = request.args.get('count', 3, type=int)
     
@@ -45,15 +37,7 @@ def get_outfit_recommendations():
 @jwt_required()
 def get_seasonal_recommendations():
     """Get seasonal recommendations for current user"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     season = request.args.get('season', 'fall')
     
@@ -69,16 +53,6 @@ def get_seasonal_recommendations():
 @jwt_required()
 def get_shopping_recommendations():
     """Get shopping recommendations for current user"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
-    
     # This is a placeholder for future implementation
     return jsonify({
         'message': 'Shopping recommendations coming soon'
@@ -88,16 +62,6 @@ def get_shopping_recommendations():
 @jwt_required()
 def submit_feedback():
     """Submit feedback for a recommendation"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
-    
     data = request.get_json()
     
     # Validate input
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_current_user
 from models.user import User
+from utils.passwords import PasswordHasherBusy
 
 user_bp = Blueprint('user', __name__)
 
@@ -8,18 +9,10 @@ user_bp = Blueprint('user', __name__)
 @jwt_required()
 def get_profile():
     """Get user profile"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     return jsonify({
-        'id': current_user['_id'],
+        'id': str(current_user['_id']),
         'name': current_user['name'],
         'email': current_user['email'],
         'preferences': current_user.get('preferences', {})
@@ -29,15 +22,7 @@ def get_profile():
 @jwt_required()
 def update_profile():
     """Update user profile"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     data = request.get_json()
     
@@ -65,15 +50,7 @@ def update_profile():
 @jwt_required()
 def update_preferences():
     """Update user style preferences"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     data = request.get_json()
     
@@ -98,15 +75,7 @@ def update_preferences():
 @jwt_required()
 def update_password():
     """Update user password"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     data = request.get_json()
     
@@ -120,11 +89,16 @@ def update_password():
         return jsonify({'error': 'New password must be at least 8 characters long'}), 400
         
     # Update password
-    success, message = User.update_password(
-        current_user['_id'], 
-        data['currentPassword'], 
-        new_password
-    )
+    try:
+        success, message = User.update_password(
+            current_user['_id'], 
+            data['currentPassword'], 
+            new_password
+        )
+    except PasswordHasherBusy as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '2'
+        return response, 503
     
     if not success:
         if "incorrect" in message:
@@ -1,31 +1,17 @@
-from flask import Blueprint, request, jsonify, current_app
-import os
-import uuid
-from werkzeug.utils import secure_filename
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_current_user
+from utils.idempotency import idempotent
+from utils.image_validation import InvalidImage
+from utils.uploads import get_upload_store
 from models.wardrobe import WardrobeItem
 
 wardrobe_bp = Blueprint('wardrobe', __name__)
 
-# Helper function to check allowed file extensions
-def allowed_file(filename):
-    """Check if file has allowed extension"""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 @wardrobe_bp.route('', methods=['GET'])
 @jwt_required()
 def get_wardrobe():
     """Get all wardrobe items for current user"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     items = WardrobeItem.get_by_user(current_user['_id'])
     
@@ -33,17 +19,10 @@ def get_wardrobe():
 
 @wardrobe_bp.route('', methods=['POST'])
 @jwt_required()
+@idempotent
 def add_item():
     """Add a new wardrobe item"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     # Check if request has form data
     if not request.form:
@@ -64,25 +43,12 @@ def add_item():
     if 'image' in request.files:
         file = request.files['image']
         
-        if file and allowed_file(file.filename):
-            # Create upload directory for user if it doesn't exist
-            user_upload_dir = os.path.join(
-                current_app.config['UPLOAD_FOLDER'],
-                str(current_user['_id']),
-                'wardrobe'
-            )
-            os.makedirs(user_upload_dir, exist_ok=True)
-            
-            # Generate unique filename
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(user_upload_dir, unique_filename)
-            
-            # Save file
-            file.save(file_path)
-            
-            # Generate public URL
-            image_path = f"/uploads/{current_user['_id']}/wardrobe/{unique_filename}"
+        if file and file.filename:
+            # Identical images are stored once in the content-addressable store
+            try:
+                _, image_path = get_upload_store().save(file, kind='wardrobe')
+            except InvalidImage as e:
+                return jsonify({'error': str(e)}), e.status
     
     # Create item data
     item_data = {
@@ -102,15 +68,7 @@ def add_item():
 @jwt_required()
 def get_item(item_id):
     """Get wardrobe item by ID"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     item = WardrobeItem.get_by_id(item_id)
     
@@ -118,7 +76,7 @@ def get_item(item_id):
         return jsonify({'error': 'Item not found'}), 404
         
     # Check if item belongs to current user
-    if item['user_id'] != current_user['_id']:
+    if item['user_id'] != str(current_user['_id']):
         return jsonify({'error': 'Unauthorized'}), 403
         
     return jsonify(item), 200
@@ -127,15 +85,7 @@ def get_item(item_id):
 @jwt_required()
 def update_item(item_id):
     """Update wardrobe item"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     # Get item
     item = WardrobeItem.get_by_id(item_id)
@@ -144,7 +94,7 @@ def update_item(item_id):
         return jsonify({'error': 'Item not found'}), 404
         
     # Check if item belongs to current user
-    if item['user_id'] != current_user['_id']:
+    if item['user_id'] != str(current_user['_id']):
         return jsonify({'error': 'Unauthorized'}), 403
         
     # Get form data
@@ -168,31 +118,31 @@ def update_item(item_id):
     if 'image' in request.files:
         file = request.files['image']
         
-        if file and allowed_file(file.filename):
-            # Create upload directory for user if it doesn't exist
-            user_upload_dir = os.path.join(
-                current_app.config['UPLOAD_FOLDER'],
-                str(current_user['_id']),
-                'wardrobe'
-            )
-            os.makedirs(user_upload_dir, exist_ok=True)
-            
-            # Generate unique filename
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(user_upload_dir, unique_filename)
-            
-            # Save file
-            file.save(file_path)
+        if file and file.filename:
+            try:
+                _, update_data['image'] = get_upload_store().save(file, kind='wardrobe')
+            except InvalidImage as e:
+                return jsonify({'error': str(e)}), e.status
             
-            # Generate public URL
-            update_data['image'] = f"/uploads/{current_user['_id']}/wardrobe/{unique_filename}"
+            # Uploads are content-addressed: the same image comes back with
+            # the same URL, and only the extra reference needs dropping
+            if update_data['image'] == item.get('image'):
+                get_upload_store().release(update_data.pop('image'))
+    
+    if not update_data:
+        return jsonify(item), 200
     
     # Update item
     success = WardrobeItem.update(item_id, update_data)
     
     if not success:
+        if 'image' in update_data:
+            get_upload_store().release(update_data['image'])
         return jsonify({'error': 'Failed to update item'}), 500
+    
+    # The replaced image loses a reference (and is deleted with its last one)
+    if 'image' in update_data:
+        get_upload_store().release(item.get('image'))
         
     # Get updated item
     updated_item = WardrobeItem.get_by_id(item_id)
@@ -203,15 +153,7 @@ def update_item(item_id):
 @jwt_required()
 def delete_item(item_id):
     """Delete wardrobe item"""
-    # Get current user from JWT
-    current_user_id = get_jwt_identity()
-    from utils.db import get_db
-    from bson import ObjectId
-    db = get_db()
-    current_user = db.users.find_one({'_id': ObjectId(current_user_id)})
-    
-    if not current_user:
-        return jsonify({'error': 'User not found'}), 404
+    current_user = get_current_user()
     
     # Get item
     item = WardrobeItem.get_by_id(item_id)
@@ -220,7 +162,7 @@ def delete_item(item_id):
         return jsonify({'error': 'Item not found'}), 404
         
     # Check if item belongs to current user
-    if item['user_id'] != current_user['_id']:
+    if item['user_id'] != str(current_user['_id']):
         return jsonify({'error': 'Unauthorized'}), 403
         
     # Delete item
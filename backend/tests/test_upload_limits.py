@@ -0,0 +1,140 @@
+"""Rejected uploads must be cheap: nothing is decoded or held in memory.
+
+Peak memory is measured two ways around each request: tracemalloc covers
+the Python heap (e.g. a body read into a bytes object), and the process's
+peak RSS covers Pillow, whose pixel buffers tracemalloc does not see. The
+RSS peak is reset through /proc/self/clear_refs, so that check only runs
+on Linux.
+"""
+import io
+import os
+import tracemalloc
+import uuid
+import pytest
+from PIL import Image
+
+MB = 1024 * 1024
+MAX_TRACED_BYTES = 8 * MB
+MAX_RSS_GROWTH = 32 * MB
+
+def _peak_rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return _peak_rss()
+    except OSError:
+        return None
+
+def _multipart(field, filename, payload, form=None):
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        for name, value in (form or {}).items()
+    ]
+    parts.append((
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode('utf-8') + payload + f"\r\n--{boundary}--\r\n".encode('utf-8'))
+    return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+def _post_measured(client, path, headers, body, content_type):
+    """POST a prepared body, returning (response, traced peak, RSS growth or None)"""
+    stream = io.BytesIO(body)
+    rss_before = _reset_peak_rss()
+    tracemalloc.start()
+    try:
+        response = client.post(
+            path,
+            input_stream=stream,
+            content_type=content_type,
+            content_length=len(body),
+            headers=headers
+        )
+        traced_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    rss_growth = _peak_rss() - rss_before if rss_before is not None else None
+    return response, traced_peak, rss_growth
+
+def _pixel_bomb():
+    # 10000x10000 (100 MP, 300 MB as RGB) in a PNG of a few KB
+    buffer = io.BytesIO()
+    Image.new('1', (10000, 10000)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def _jpeg(size=(800, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'navy').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+@pytest.fixture(scope='module', autouse=True)
+def warm_up(app, auth_headers):
+    # Lazy imports and first-request setup should not count as upload cost
+    body, content_type = _multipart('images', 'warm.jpg', _jpeg())
+    app.test_client().post(
+        '/api/analysis/upload',
+        input_stream=io.BytesIO(body),
+        content_type=content_type,
+        content_length=len(body),
+        headers=auth_headers
+    )
+
+@pytest.mark.parametrize('path, field, form', [
+    ('/api/analysis/upload', 'images', None),
+    ('/api/wardrobe', 'image', {'name': 'Shirt', 'category': 'tops'})
+])
+def test_pixel_bomb_is_rejected_without_decoding(client, auth_headers, path, field, form):
+    body, content_type = _multipart(field, 'bomb.png', _pixel_bomb(), form)
+    assert len(body) < MB
+
+    response, traced_peak, rss_growth = _post_measured(client, path, auth_headers, body, content_type)
+
+    assert response.status_code == 413
+    assert traced_peak < MAX_TRACED_BYTES
+    if rss_growth is not None:
+        assert rss_growth < MAX_RSS_GROWTH
+
+def test_body_over_max_content_length_is_rejected(app, client, auth_headers):
+    payload = b'\xff\xd8\xff' + os.urandom(app.config['MAX_CONTENT_LENGTH'])
+    body, content_type = _multipart('images', 'huge.jpg', payload)
+
+    response, traced_peak, rss_growth = _post_measured(client, '/api/analysis/upload', auth_headers, body, content_type)
+
+    assert response.status_code == 413
+    assert traced_peak < MAX_TRACED_BYTES
+    if rss_growth is not None:
+        assert rss_growth < MAX_RSS_GROWTH
+
+def test_image_over_max_image_bytes_is_rejected_while_streaming(app, client, auth_headers):
+    assert app.config['UPLOAD_MAX_IMAGE_BYTES'] < app.config['MAX_CONTENT_LENGTH'] - MB
+    payload = b'\xff\xd8\xff' + os.urandom(app.config['UPLOAD_MAX_IMAGE_BYTES'] + MB)
+    body, content_type = _multipart('images', 'big.jpg', payload)
+
+    response, traced_peak, rss_growth = _post_measured(client, '/api/analysis/upload', auth_headers, body, content_type)
+
+    assert response.status_code == 413
+    assert traced_peak < MAX_TRACED_BYTES
+    if rss_growth is not None:
+        assert rss_growth < MAX_RSS_GROWTH
+
+def test_non_image_is_rejected(client, auth_headers):
+    body, content_type = _multipart('images', 'photo.jpg', b'<html>not an image</html>')
+
+    response, _, _ = _post_measured(client, '/api/analysis/upload', auth_headers, body, content_type)
+
+    assert response.status_code == 400
+
+def test_normal_image_is_accepted(client, auth_headers):
+    body, content_type = _multipart('images', 'outfit.jpg', _jpeg())
+
+    response, _, _ = _post_measured(client, '/api/analysis/upload', auth_headers, body, content_type)
+
+    assert response.status_code in (200, 201, 202)
@@ -47,6 +47,23 @@ def initialize_db(app):
         db.users.create_index('email', unique=True)
         db.wardrobe_items.create_index('user_id')
         db.analyses.create_index('user_id')
+        db.analyses.create_index([('user_id', 1), ('created_at', 1)])
+        # Expire cached Gemini results once their TTL has passed
+        db.analysis_cache.create_index('expires_at', expireAfterSeconds=0)
+        db.analysis_leases.create_index('expires_at', expireAfterSeconds=0)
+        db.analysis_jobs.create_index([('status', 1), ('created_at', 1)])
+        db.analysis_jobs.create_index('updated_at', expireAfterSeconds=7 * 24 * 3600)
+        # Idempotency-Key records expire once their TTL has passed
+        db.idempotency_keys.create_index('expires_at', expireAfterSeconds=0)
+        # Revoked JWTs are forgotten once the token itself has expired
+        db.revoked_tokens.create_index('expires_at', expireAfterSeconds=0)
+        db.revoked_tokens.create_index('revoked_at')
+        # The upload collector drops the aliases of blobs it deletes
+        db.upload_aliases.create_index('blob')
+        # Gemini call telemetry rolls over inside a fixed-size capped collection
+        if app.config.get('GEMINI_TELEMETRY_MONGO') and 'gemini_calls' not in db.list_collection_names():
+            db.create_collection('gemini_calls', capped=True, size=8 * 1024 * 1024, max=50000)
+            db.gemini_calls.create_index('created_at')
         
         print(f"Connected to MongoDB Atlas: {db_name}")
         return db
@@ -61,8 +78,37 @@ def get_db():
         raise Exception("Database not initialized")
     return db
 
+# Values JSON takes as they are; exact types, so the common case is one set lookup
+JSON_SCALARS = frozenset([str, int, float, bool, type(None)])
+
+def _to_json(value):
+    # One pass over the document, producing what JSONEncoder would have
+    # encoded and json.loads read back, without the string in between
+    kind = type(value)
+    if kind is dict:
+        return {
+            key if type(key) is str else str(key): item if type(item) in JSON_SCALARS else _to_json(item)
+            for key, item in value.items()
+        }
+    if kind is list or kind is tuple:
+        return [item if type(item) in JSON_SCALARS else _to_json(item) for item in value]
+    if kind is ObjectId:
+        return str(value)
+    if kind is datetime:
+        return value.isoformat()
+    if kind is bytes:
+        return value.decode('utf-8')
+    # Subclasses (SON, named tuples, ...) take the slow path
+    if isinstance(value, dict):
+        return _to_json(dict(value))
+    if isinstance(value, (list, tuple)):
+        return _to_json(list(value))
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
 def serialize_doc(doc):
-    """Serialize MongoDB document to JSON"""
+    """Convert a MongoDB document (or list of them) to JSON-ready Python values"""
     if doc is None:
         return None
-    return json.loads(JSONEncoder().encode(doc))
+    return _to_json(doc)
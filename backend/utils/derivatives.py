@@ -0,0 +1,91 @@
+"""Fixed-size WebP and JPEG derivatives of uploaded images.
+
+When a new blob is stored, a background pool decodes it once and writes a
+downscaled copy per size and format as
+derived/<h[0:2]>/<h[2:4]>/<hash>/<size>.<webp|jpg>. /uploads/...?size=N
+serves the best match for the client's Accept header, and the analyzer
+reads the JPEG at ANALYSIS_IMAGE_SIZE instead of decoding the original.
+"""
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from utils.db import get_db
+
+DERIVED_PREFIX = 'derived'
+
+# Extension -> (Pillow format, mimetype, save options)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True})
+}
+
+BLOB_FILENAME = re.compile(r'^([0-9a-f]{64})(?:\.(\w+))?$')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def derivative_name(blob_name, size, ext):
+    """Storage name of one derivative of a blob"""
+    digest = blob_name.rsplit('/', 1)[1].split('.', 1)[0]
+    return '/'.join([DERIVED_PREFIX, digest[:2], digest[2:4], digest, f"{size}.{ext}"])
+
+def blob_name_from_path(path):
+    """Recover a blob's storage name from its local path, or None"""
+    match = BLOB_FILENAME.match(os.path.basename(path))
+    if not match:
+        return None
+    digest, ext = match.groups()
+    filename = f"{digest}.{ext}" if ext else digest
+    return '/'.join(['blobs', digest[:2], digest[2:4], filename])
+
+def generate_derivatives(storage, blob_name, sizes):
+    """Decode a blob once and store every size in every format.
+
+    Sizes are produced largest first, each downscaled from the previous
+    one, so the full-resolution image is only resampled once.
+    """
+    with Image.open(storage.local_path(blob_name)) as img:
+        if img.format == 'JPEG':
+            img.draft('RGB', (max(sizes), max(sizes)))
+        img.load()
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        for size in sorted(sizes, reverse=True):
+            img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+            for ext, (image_format, _, options) in DERIVATIVE_FORMATS.items():
+                fd, tmp_path = tempfile.mkstemp(dir=storage.tmp_dir)
+                try:
+                    with os.fdopen(fd, 'wb') as tmp:
+                        img.save(tmp, format=image_format, **options)
+                    storage.save_file(derivative_name(blob_name, size, ext), tmp_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+    get_db().upload_blobs.update_one({'_id': blob_name}, {'$set': {'derivatives': sorted(sizes)}})
+
+def delete_derivatives(storage, blob_name, sizes):
+    for size in sizes:
+        for ext in DERIVATIVE_FORMATS:
+            storage.delete(derivative_name(blob_name, size, ext))
+
+def schedule_derivatives(storage, blob_name, sizes, max_workers=2):
+    """Generate derivatives on the shared background pool"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivatives')
+
+    def run():
+        try:
+            generate_derivatives(storage, blob_name, sizes)
+        except Exception as e:
+            print(f"Error generating derivatives for {blob_name}: {e}")
+
+    return _executor.submit(run)
@@ -0,0 +1,119 @@
+import datetime
+import hashlib
+import time
+from functools import wraps
+from flask import request, jsonify, current_app, make_response
+from flask_jwt_extended import get_jwt_identity
+from pymongo.errors import DuplicateKeyError
+from utils.db import get_db
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+# Response headers worth replaying along with the body
+REPLAYED_HEADERS = ['Location', 'Retry-After']
+
+def _request_fingerprint():
+    """Hash what the client sent, so a reused key with a different request is caught"""
+    digest = hashlib.sha256()
+    digest.update(request.query_string)
+    for name, value in sorted(request.form.items(multi=True)):
+        digest.update(f"{name}={value}\0".encode('utf-8'))
+    for name, file in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+        digest.update(f"{name}:{file.filename}\0".encode('utf-8'))
+    if request.is_json:
+        digest.update(request.get_data())
+    return digest.hexdigest()
+
+def _replay(record):
+    stored = record['response']
+    response = current_app.response_class(stored['body'], status=stored['status'], mimetype=stored['mimetype'])
+    for name, value in stored.get('headers', {}).items():
+        response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(f):
+    """Decorator that makes a mutating route safe to retry.
+
+    Requests carrying an Idempotency-Key header are recorded in the
+    `idempotency_keys` collection (scoped to the user, method and path).
+    A retry with the same key gets the stored response back, or waits for
+    the original request if it is still running. Server errors are not
+    stored, so they can be retried. Must be applied below @jwt_required().
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key must be at most 255 characters'}), 400
+
+        config = current_app.config
+        collection = get_db().idempotency_keys
+        record_id = hashlib.sha256(
+            f"{get_jwt_identity()}:{request.method}:{request.path}:{key}".encode('utf-8')
+        ).hexdigest()
+        fingerprint = _request_fingerprint()
+        lock_timeout = config.get('IDEMPOTENCY_LOCK_TIMEOUT', 120)
+
+        now = datetime.datetime.utcnow()
+        try:
+            collection.insert_one({
+                '_id': record_id,
+                'status': IN_PROGRESS,
+                'fingerprint': fingerprint,
+                'created_at': now,
+                'locked_until': now + datetime.timedelta(seconds=lock_timeout),
+                'expires_at': now + datetime.timedelta(seconds=config.get('IDEMPOTENCY_TTL', 24 * 3600))
+            })
+        except DuplicateKeyError:
+            deadline = time.monotonic() + config.get('IDEMPOTENCY_WAIT_TIMEOUT', 30)
+            while True:
+                record = collection.find_one({'_id': record_id})
+                if record is None:
+                    # The original request failed and released the key; run again
+                    return decorated(*args, **kwargs)
+                if record['fingerprint'] != fingerprint:
+                    return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+                if record['status'] == COMPLETED:
+                    return _replay(record)
+
+                # Take over keys whose original request died without finishing
+                now = datetime.datetime.utcnow()
+                claimed = collection.find_one_and_update(
+                    {'_id': record_id, 'status': IN_PROGRESS, 'locked_until': {'$lt': now}},
+                    {'$set': {'locked_until': now + datetime.timedelta(seconds=lock_timeout)}}
+                )
+                if claimed:
+                    break
+
+                if time.monotonic() > deadline:
+                    response = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+                    response.headers['Retry-After'] = '5'
+                    return response, 409
+                time.sleep(config.get('IDEMPOTENCY_POLL_INTERVAL', 0.25))
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            collection.delete_one({'_id': record_id})
+            raise
+
+        if response.status_code >= 500 or response.is_streamed:
+            collection.delete_one({'_id': record_id})
+            return response
+
+        collection.update_one({'_id': record_id}, {'$set': {
+            'status': COMPLETED,
+            'response': {
+                'status': response.status_code,
+                'mimetype': response.mimetype,
+                'body': response.get_data(as_text=True),
+                'headers': {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+            }
+        }})
+        return response
+
+    return decorated
@@ -0,0 +1,81 @@
+"""Limits on uploaded images, checked before anything decodes them.
+
+Uploads are validated while they stream into the blob store: the byte
+count is enforced chunk by chunk, the format is taken from the file's
+magic bytes rather than its name, and the dimensions are read from the
+header so a decompression bomb (a small file declaring a huge canvas) is
+rejected without allocating its pixels. Image.MAX_IMAGE_PIXELS is set to
+the same limit so nothing downstream can decode a larger image either.
+"""
+from PIL import Image
+
+# Magic bytes -> (Pillow format, blob extension)
+SIGNATURES = [
+    (b'\xff\xd8\xff', ('JPEG', 'jpg')),
+    (b'\x89PNG\r\n\x1a\n', ('PNG', 'png')),
+    (b'GIF87a', ('GIF', 'gif')),
+    (b'GIF89a', ('GIF', 'gif'))
+]
+SNIFF_BYTES = 8
+
+class InvalidImage(Exception):
+    """Raised when an upload is not an acceptable image; status is the HTTP code"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def sniff_format(head):
+    """Identify an image from its first bytes, returning (format, ext) or None"""
+    for signature, image_format in SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+class ImageValidator:
+    """Byte, format and pixel limits for one uploaded image"""
+
+    def __init__(self, max_bytes=10 * 1024 * 1024, max_pixels=40000000):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+
+    def check_size(self, size):
+        """Called as bytes arrive, so oversized uploads stop early"""
+        if self.max_bytes and size > self.max_bytes:
+            raise InvalidImage(f"Image is larger than {self.max_bytes // (1024 * 1024)} MB", 413)
+
+    def check_format(self, head):
+        image_format = sniff_format(head)
+        if image_format is None:
+            raise InvalidImage('Unsupported image format (JPEG, PNG or GIF expected)')
+        return image_format
+
+    def check_image(self, path, image_format):
+        """Read the header of a fully received upload and check its dimensions"""
+        try:
+            # Image.open only parses the header; pixels are never decoded here
+            with Image.open(path) as img:
+                width, height = img.size
+                detected = img.format
+        except Image.DecompressionBombError:
+            raise InvalidImage('Image dimensions are too large', 413)
+        except Exception:
+            raise InvalidImage('Image file is corrupt or truncated')
+
+        if detected != image_format[0]:
+            raise InvalidImage('Image content does not match its format')
+        if self.max_pixels and width * height > self.max_pixels:
+            raise InvalidImage(
+                f"Image is {width}x{height}; at most {self.max_pixels // 1000000} megapixels are allowed", 413
+            )
+        return width, height
+
+def create_image_validator(config):
+    """Build the upload validator from app config and cap Pillow globally"""
+    validator = ImageValidator(
+        max_bytes=config.get('UPLOAD_MAX_IMAGE_BYTES', 10 * 1024 * 1024),
+        max_pixels=config.get('UPLOAD_MAX_PIXELS', 40000000)
+    )
+    if validator.max_pixels:
+        Image.MAX_IMAGE_PIXELS = validator.max_pixels
+    return validator
@@ -0,0 +1,312 @@
+import copy
+import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument
+from utils.db import get_db
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+TERMINAL_STATES = (COMPLETED, FAILED)
+
+# Identifies this process as the owner of the jobs it runs (see current_owner)
+_owner = None
+
+# Module-level queue instance (set up by init_job_queue)
+_queue = None
+
+class QueueFull(Exception):
+    """Raised when the analysis queue cannot accept more work"""
+
+def current_owner():
+    """This process's owner record, made afresh after a fork"""
+    global _owner
+    if _owner is None or _owner['pid'] != os.getpid():
+        _owner = {'instance': uuid.uuid4().hex, 'host': socket.gethostname(), 'pid': os.getpid()}
+    return _owner
+
+def owner_is_dead(owner):
+    """Whether a job owner is known to be gone without waiting for its lease.
+
+    Only owners on this host can be checked: a different process now
+    holding the same pid (e.g. pid 1 after a container restart) or no
+    process with that pid at all means the owner has exited.
+    """
+    me = current_owner()
+    if not owner or owner.get('instance') == me['instance'] or owner.get('host') != me['host']:
+        return False
+    if owner.get('pid') == me['pid']:
+        return True
+    if os.name != 'posix':
+        return False
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, TypeError, KeyError):
+        return False
+    return False
+
+class MemoryJobStore:
+    """In-process job store, used for tests and single-process development"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['_id']] = copy.deepcopy(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def update(self, job_id, fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(copy.deepcopy(fields))
+
+    def claim(self, job_id):
+        """Atomically move a queued job to running, returning it if claimed"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] != QUEUED:
+                return None
+            job['status'] = RUNNING
+            job['owner'] = dict(current_owner())
+            job['updated_at'] = datetime.datetime.utcnow()
+            return copy.deepcopy(job)
+
+    def touch(self, job_ids):
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._jobs:
+                    self._jobs[job_id]['updated_at'] = now
+
+    def requeue_stale(self, stale_before):
+        # Jobs live and die with this process
+        return []
+
+    def pending_ids(self):
+        return []
+
+class MongoJobStore:
+    """Job store backed by the `analysis_jobs` collection so jobs survive restarts"""
+
+    def _collection(self):
+        return get_db().analysis_jobs
+
+    def create(self, job):
+        self._collection().insert_one(job)
+
+    def get(self, job_id):
+        return self._collection().find_one({'_id': job_id})
+
+    def update(self, job_id, fields):
+        self._collection().update_one({'_id': job_id}, {'$set': fields})
+
+    def claim(self, job_id):
+        return self._collection().find_one_and_update(
+            {'_id': job_id, 'status': QUEUED},
+            {'$set': {'status': RUNNING, 'owner': current_owner(), 'updated_at': datetime.datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def touch(self, job_ids):
+        """Heartbeat: extend the lease on jobs this process is still running"""
+        if job_ids:
+            self._collection().update_many(
+                {'_id': {'$in': list(job_ids)}, 'status': RUNNING, 'owner.instance': current_owner()['instance']},
+                {'$set': {'updated_at': datetime.datetime.utcnow()}}
+            )
+
+    def requeue_stale(self, stale_before):
+        """Put jobs whose worker died mid-run back in the queue, returning their ids.
+
+        A job is requeued once its lease has run out (no heartbeat since
+        stale_before), or straight away if its owner is known to be dead.
+        """
+        requeued = []
+        for job in self._collection().find({'status': RUNNING}, {'owner': 1, 'updated_at': 1}):
+            if job['updated_at'] >= stale_before and not owner_is_dead(job.get('owner')):
+                continue
+            # Conditional on the heartbeat we saw, so a live owner keeps its job
+            if self._collection().find_one_and_update(
+                {'_id': job['_id'], 'status': RUNNING, 'updated_at': job['updated_at']},
+                {'$set': {'status': QUEUED, 'owner': None}}
+            ):
+                requeued.append(job['_id'])
+        return requeued
+
+    def pending_ids(self):
+        return [
+            job['_id'] for job in
+            self._collection().find({'status': QUEUED}, {'_id': 1}).sort('created_at', 1)
+        ]
+
+class JobQueue:
+    """Bounded worker pool that runs outfit analyses off the request thread"""
+
+    def __init__(self, app, store, max_workers=4, max_pending=100, lease_seconds=60, heartbeat_seconds=15):
+        self.app = app
+        self.store = store
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+        self._pending = 0
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, image_paths, public_urls, phashes=None):
+        """Queue an analysis and return the new job document"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull('Analysis queue is full')
+            self._pending += 1
+
+        now = datetime.datetime.utcnow()
+        job = {
+            '_id': uuid.uuid4().hex,
+            'user_id': str(user_id),
+            'status': QUEUED,
+            'image_paths': image_paths,
+            'images': public_urls,
+            'phashes': phashes,
+            'analysis_id': None,
+            'results': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        try:
+            self.store.create(job)
+            self._executor.submit(self._run, job['_id'])
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def resume_pending(self):
+        """Re-submit queued jobs left behind by a previous process"""
+        requeued = self._requeue_stale()
+        job_ids = self.store.pending_ids()
+        for job_id in job_ids:
+            self._resubmit(job_id)
+        if job_ids:
+            print(f"Resumed {len(job_ids)} analysis jobs ({len(requeued)} stale)")
+
+    def start_heartbeat(self):
+        """Keep leases on running jobs fresh and pick up jobs whose worker died"""
+        def loop():
+            while True:
+                time.sleep(self.heartbeat_seconds)
+                try:
+                    with self.app.app_context():
+                        with self._lock:
+                            running = list(self._running)
+                        self.store.touch(running)
+                        requeued = self._requeue_stale()
+                        for job_id in requeued:
+                            self._resubmit(job_id)
+                        if requeued:
+                            print(f"Requeued {len(requeued)} analysis jobs from dead workers")
+                except Exception as e:
+                    print(f"Analysis job heartbeat failed: {e}")
+
+        thread = threading.Thread(target=loop, name='analysis-job-heartbeat', daemon=True)
+        thread.start()
+        return thread
+
+    def _requeue_stale(self):
+        stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease_seconds)
+        return self.store.requeue_stale(stale_before)
+
+    def _resubmit(self, job_id):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        # Imported here to avoid a circular import through the analyzer
+        from ai.analyzers import get_analyzer
+        from models.analysis import Analysis
+        from ai.near_duplicates import get_near_duplicate_index, is_reusable
+
+        try:
+            with self.app.app_context():
+                # Another worker process may already have picked this job up
+                job = self.store.claim(job_id)
+                if not job:
+                    return
+
+                # The heartbeat refreshes the lease while this job runs
+                with self._lock:
+                    self._running.add(job_id)
+                try:
+                    analysis_results = get_analyzer(self.app.config).analyze_outfit(job['image_paths'])
+                    if analysis_results is None:
+                        raise ValueError('Could not read the uploaded images')
+                    analysis = Analysis.create(job['user_id'], {
+                        'images': job['images'],
+                        'results': analysis_results,
+                        'phashes': job.get('phashes')
+                    })
+                    if is_reusable(analysis_results):
+                        get_near_duplicate_index(self.app.config).add(job['user_id'], analysis['_id'], job.get('phashes'))
+                    self.store.update(job_id, {
+                        'status': COMPLETED,
+                        'analysis_id': analysis['_id'],
+                        'results': analysis_results,
+                        'updated_at': datetime.datetime.utcnow()
+                    })
+                except Exception as e:
+                    print(f"Analysis job {job_id} failed: {e}")
+                    self.store.update(job_id, {
+                        'status': FAILED,
+                        'error': 'Analysis failed',
+                        'updated_at': datetime.datetime.utcnow()
+                    })
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+                self._pending -= 1
+
+def init_job_queue(app):
+    """Create the analysis job queue from app config"""
+    global _queue
+    if app.config.get('ANALYSIS_JOB_BACKEND', 'mongo') == 'memory':
+        store = MemoryJobStore()
+    else:
+        store = MongoJobStore()
+    _queue = JobQueue(
+        app,
+        store,
+        max_workers=app.config.get('ANALYSIS_JOB_WORKERS', 4),
+        max_pending=app.config.get('ANALYSIS_JOB_MAX_PENDING', 100),
+        lease_seconds=app.config.get('ANALYSIS_JOB_LEASE', 60),
+        heartbeat_seconds=app.config.get('ANALYSIS_JOB_HEARTBEAT', 15)
+    )
+    _queue.resume_pending()
+    _queue.start_heartbeat()
+    return _queue
+
+def get_job_queue():
+    """Get the analysis job queue"""
+    if _queue is None:
+        raise Exception("Job queue not initialized")
+    return _queue
@@ -0,0 +1,54 @@
+"""orjson-backed JSON for Flask responses.
+
+Flask's default provider runs the stdlib encoder in Python, which is most
+of the time spent answering large wardrobe and history lists. This provider
+encodes with orjson and writes the response bytes directly. It knows the
+BSON types our documents carry: ObjectId becomes its hex string, datetimes
+ISO 8601 (orjson's native format, matching serialize_doc) and bytes are
+decoded as UTF-8, so a raw document can also be passed to jsonify. Output
+keys stay sorted like the default provider, and debug mode still indents.
+"""
+import decimal
+import orjson
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+
+def _default(o):
+    # Only called for types orjson does not handle natively
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, bytes):
+        return o.decode('utf-8')
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Callers asking for json.dumps options (cls, indent, ...) get the stdlib encoder
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = OPTIONS | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=option),
+            mimetype=self.mimetype
+        )
@@ -0,0 +1,171 @@
+"""Password hashing off the request threads.
+
+bcrypt at a sensible cost takes a few hundred milliseconds of CPU per
+call. Run inline, a burst of logins occupies every core and every request
+thread, and cheap endpoints queue behind it. Hashes and checks are instead
+sent to a small pool (PASSWORD_HASH_WORKERS) of threads running at lower
+CPU priority (Linux niceness is per thread). bcrypt releases the GIL while
+hashing, so these threads use other cores without a process pool, which
+would have to re-import the app or fork it with live threads. Request
+threads just wait for the result. At most PASSWORD_HASH_QUEUE calls may
+wait for a worker; beyond that, or after PASSWORD_HASH_TIMEOUT seconds,
+PasswordHasherBusy is raised and the route answers 503. A call that timed
+out keeps its place until bcrypt is done with it. Queue and hash
+times are kept for /api/health/passwords.
+
+BCRYPT_ROUNDS sets the cost of new hashes. needs_rehash() tells whether a
+stored hash was made at a different cost, so User.authenticate can
+upgrade it after a successful login.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+import bcrypt
+from utils.stats import percentile
+
+# $2b$<cost>$<salt+hash>
+HASH_COST = re.compile(rb'^\$2[abxy]?\$(\d{2})\$')
+
+_hasher = None
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 503"""
+
+def _lower_priority(niceness):
+    """Renice the calling pool thread only"""
+    if niceness and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        except OSError:
+            pass
+
+# Pool-side functions; they return start and end times so the caller can
+# split queueing from hashing
+def _hash(password, rounds):
+    started = time.perf_counter()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    return hashed, started, time.perf_counter()
+
+def _check(password, hashed):
+    started = time.perf_counter()
+    matches = bcrypt.checkpw(password, hashed)
+    return matches, started, time.perf_counter()
+
+class PasswordHasher:
+    """Bounded, low-priority thread pool for bcrypt with queue-time metrics"""
+
+    def __init__(self, rounds=12, max_workers=2, max_queue=32, timeout=10, niceness=5, window=1000):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._max_workers = max_workers
+        self._niceness = niceness
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Calls running or waiting for a worker
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._samples = deque(maxlen=window)
+        self._stats = {'completed': 0, 'rejected': 0, 'timed_out': 0, 'rehashed': 0}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        """bcrypt hash of a str password at the configured cost"""
+        return self._run(_hash, password.encode('utf-8'), self.rounds)
+
+    def check(self, password, hashed):
+        """Whether a str password matches a stored bcrypt hash"""
+        return self._run(_check, password.encode('utf-8'), hashed)
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash was made at a different cost than BCRYPT_ROUNDS"""
+        match = HASH_COST.match(hashed)
+        return match is None or int(match.group(1)) != self.rounds
+
+    def record_rehash(self):
+        with self._lock:
+            self._stats['rehashed'] += 1
+
+    def stats(self):
+        """Return counters, pending calls and queue/hash time percentiles"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+            samples = list(self._samples)
+        stats['workers'] = self._max_workers
+        stats['rounds'] = self.rounds
+        for index, name in enumerate(['queue_ms', 'hash_ms']):
+            values = sorted(sample[index] for sample in samples)
+            stats[name] = {f"p{p}": percentile(values, p) for p in (50, 95, 99)}
+        return stats
+
+    def _run(self, function, *args):
+        # Over the queue limit the caller is turned away at once
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PasswordHasherBusy('Password hashing is busy, please try again shortly')
+        submitted = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(function, *args)
+        except Exception:
+            self._release()
+            raise
+        # The slot is freed when the call finishes, not when the caller gives
+        # up: a bcrypt call that already started cannot be cancelled
+        future.add_done_callback(self._release)
+        try:
+            result, started, finished = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self._stats['timed_out'] += 1
+            raise PasswordHasherBusy('Password hashing timed out, please try again shortly')
+
+        with self._lock:
+            self._stats['completed'] += 1
+            self._samples.append((
+                round(max(0.0, started - submitted) * 1000, 2),
+                round((finished - started) * 1000, 2)
+            ))
+        return result
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers,
+                        thread_name_prefix='bcrypt',
+                        initializer=_lower_priority,
+                        initargs=(self._niceness,)
+                    )
+        return self._executor
+
+def init_password_hasher(app):
+    """Create the password hasher from app config"""
+    global _hasher
+    _hasher = PasswordHasher(
+        rounds=app.config.get('BCRYPT_ROUNDS', 12),
+        max_workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        max_queue=app.config.get('PASSWORD_HASH_QUEUE', 32),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10),
+        niceness=app.config.get('PASSWORD_HASH_NICE', 5)
+    )
+    return _hasher
+
+def get_password_hasher():
+    """Get the password hasher"""
+    if _hasher is None:
+        raise Exception("Password hasher not initialized")
+    return _hasher
@@ -0,0 +1,132 @@
+"""Revoked JWTs, shared by every worker and forgotten once they expire.
+
+Logouts write the token's jti to the `revoked_tokens` collection with the
+token's own expiry, and a TTL index deletes it after that (an expired
+token is rejected anyway). Each process mirrors the collection in a Bloom
+filter. Most tokens were never revoked, so the filter says "no" and the
+check needs no database round-trip. A "maybe" is confirmed with a lookup.
+The filter picks up other workers' revocations every REVOCATION_REFRESH
+seconds and is rebuilt from scratch every REVOCATION_REBUILD seconds so
+expired entries drop out.
+"""
+import datetime
+import hashlib
+import math
+import threading
+import time
+from utils.db import get_db
+
+# Allowance for clock differences between the workers writing revoked_at
+CLOCK_SKEW = datetime.timedelta(seconds=5)
+
+# Module-level store shared by every request thread in this process
+_store = None
+_store_lock = threading.Lock()
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives)"""
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationStore:
+    """Mongo-backed set of revoked jtis with an in-process Bloom filter"""
+
+    def __init__(self, refresh_seconds=2, rebuild_seconds=3600, capacity=100000, error_rate=0.001):
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = None
+        self._loaded_until = None
+        self._refreshed_at = 0
+        self._rebuilt_at = 0
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, expires_at):
+        """Revoke a token until expires_at (a naive UTC datetime)"""
+        now = datetime.datetime.utcnow()
+        get_db().revoked_tokens.update_one(
+            {'_id': jti},
+            {'$set': {'expires_at': expires_at, 'revoked_at': now}},
+            upsert=True
+        )
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def is_revoked(self, jti):
+        self._refresh()
+        if jti not in self._filter:
+            return False
+        # Possibly a false positive; the collection has the final say
+        return get_db().revoked_tokens.find_one({'_id': jti}, {'_id': 1}) is not None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._refreshed_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if now - self._refreshed_at < self.refresh_seconds:
+                return
+            if self._filter is None or now - self._rebuilt_at >= self.rebuild_seconds \
+                    or self._filter.count >= self._filter.capacity:
+                self._rebuild()
+            else:
+                # Only revocations made since the last refresh, by any worker
+                query = {'revoked_at': {'$gte': self._loaded_until - CLOCK_SKEW}}
+                for document in get_db().revoked_tokens.find(query, {'revoked_at': 1}):
+                    self._filter.add(document['_id'])
+                    self._loaded_until = max(self._loaded_until, document['revoked_at'])
+            self._refreshed_at = now
+
+    def _rebuild(self):
+        loaded_until = datetime.datetime.utcnow()
+        query = {'expires_at': {'$gt': loaded_until}}
+        documents = list(get_db().revoked_tokens.find(query, {'revoked_at': 1}))
+        # Leave room to grow before the next rebuild
+        bloom = BloomFilter(max(self.capacity, len(documents) * 2), self.error_rate)
+        for document in documents:
+            bloom.add(document['_id'])
+            loaded_until = max(loaded_until, document['revoked_at'])
+        self._filter = bloom
+        self._loaded_until = loaded_until
+        self._rebuilt_at = time.monotonic()
+
+def token_expiry(jwt_payload):
+    """Naive UTC expiry of a decoded JWT"""
+    return datetime.datetime.utcfromtimestamp(jwt_payload['exp'])
+
+def get_revocation_store(config):
+    """Get the process-wide revocation store, creating it from app config"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RevocationStore(
+                    refresh_seconds=config.get('REVOCATION_REFRESH', 2),
+                    rebuild_seconds=config.get('REVOCATION_REBUILD', 3600),
+                    capacity=config.get('REVOCATION_BLOOM_CAPACITY', 100000),
+                    error_rate=config.get('REVOCATION_BLOOM_ERROR_RATE', 0.001)
+                )
+    return _store
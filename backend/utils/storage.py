@@ -0,0 +1,223 @@
+"""Storage drivers for uploaded files.
+
+LocalStorage keeps files under UPLOAD_FOLDER, which only works while a
+single node serves every request. S3Storage keeps them in an S3-compatible
+bucket (AWS S3, MinIO, a moto server, ...) so any instance behind a load
+balancer can store and serve any image. Both expose the same small set of
+operations on slash-separated names such as 'blobs/ab/cd/<hash>.jpg'.
+"""
+import datetime
+import os
+import tempfile
+
+class LocalStorage:
+    """Files on the local filesystem under `root`"""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'blobs', '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def save_file(self, name, local_path):
+        """Take ownership of a finished local file and store it as name"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(local_path, path)
+
+    def local_path(self, name):
+        """Path of a readable local copy of the file"""
+        return self.path(name)
+
+    def move(self, name, new_name):
+        """Rename a file, returning False if it did not exist"""
+        new_path = self.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            os.replace(self.path(name), new_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def url_for(self, name):
+        """Direct download URL, or None when the app serves the file itself"""
+        return None
+
+    def list(self, start_after=None):
+        """Yield (name, size, modified) for every file, in name order.
+
+        Order compares names segment by segment, so a listing can resume
+        after the last name seen. Hidden entries (temp files, tombstones)
+        are skipped.
+        """
+        after = tuple(start_after.split('/')) if start_after else ()
+        yield from self._list_dir(self.root, (), after)
+
+    def _list_dir(self, path, parts, after):
+        try:
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            entry_parts = parts + (entry.name,)
+            if entry.is_dir(follow_symlinks=False):
+                # Skip directories that sort entirely before the checkpoint
+                if entry_parts < after[:len(entry_parts)]:
+                    continue
+                yield from self._list_dir(entry.path, entry_parts, after)
+            elif entry.is_file(follow_symlinks=False) and entry_parts > after:
+                stat = entry.stat()
+                modified = datetime.datetime.utcfromtimestamp(stat.st_mtime)
+                yield '/'.join(entry_parts), stat.st_size, modified
+
+class S3Storage:
+    """Files in an S3-compatible bucket.
+
+    Uploads use boto3's managed transfer, which switches to a streaming
+    multipart upload above `multipart_threshold`. Local copies needed for
+    analysis are kept in `cache_dir`, which can be cleared at any time.
+    GETs are answered with a redirect to a presigned URL.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, presign_expires=3600, cache_dir=None,
+                 multipart_threshold=8 * 1024 * 1024):
+        # boto3 is only needed when this driver is configured
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.presign_expires = presign_expires
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'fashionlens-uploads')
+        self.tmp_dir = os.path.join(self.cache_dir, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold
+        )
+
+    def key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def exists(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def save_file(self, name, local_path):
+        """Upload a finished local file and keep it as the local cached copy"""
+        self.client.upload_file(local_path, self.bucket, self.key(name), Config=self.transfer_config)
+        cache_path = self._cache_path(name)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        os.replace(local_path, cache_path)
+
+    def local_path(self, name):
+        """Path of a local copy, downloading the object if it is not cached"""
+        cache_path = self._cache_path(name)
+        if not os.path.isfile(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+            os.close(fd)
+            try:
+                self.client.download_file(self.bucket, self.key(name), tmp_path, Config=self.transfer_config)
+                os.replace(tmp_path, cache_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return cache_path
+
+    def move(self, name, new_name):
+        """Copy then delete (S3 has no rename), returning False if missing"""
+        from botocore.exceptions import ClientError
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=self.key(new_name),
+                CopySource={'Bucket': self.bucket, 'Key': self.key(name)}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        cache_path = self._cache_path(name)
+        if os.path.isfile(cache_path):
+            new_cache_path = self._cache_path(new_name)
+            os.makedirs(os.path.dirname(new_cache_path), exist_ok=True)
+            os.replace(cache_path, new_cache_path)
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        try:
+            os.remove(self._cache_path(name))
+        except FileNotFoundError:
+            pass
+
+    def url_for(self, name):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(name)},
+            ExpiresIn=self.presign_expires
+        )
+
+    def list(self, start_after=None):
+        """Yield (name, size, modified) for every object, in key order"""
+        prefix = f"{self.prefix}/" if self.prefix else ''
+        params = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = self.key(start_after)
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(prefix):]
+                if any(part.startswith('.') for part in name.split('/')):
+                    continue
+                modified = item['LastModified'].astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                yield name, item['Size'], modified
+
+    def _cache_path(self, name):
+        return os.path.join(self.cache_dir, *name.split('/'))
+
+def create_storage(config):
+    """Build the storage driver selected by STORAGE_BACKEND"""
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL') or None,
+            region=config.get('S3_REGION') or None,
+            access_key_id=config.get('S3_ACCESS_KEY_ID') or None,
+            secret_access_key=config.get('S3_SECRET_ACCESS_KEY') or None,
+            presign_expires=config.get('S3_PRESIGN_EXPIRES', 3600),
+            cache_dir=config.get('UPLOAD_CACHE_FOLDER') or None
+        )
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,95 @@
+"""Per-user token epochs: revoke every token of a user with one write.
+
+Each user document carries a `token_epoch` counter, copied into every JWT
+as the `token_epoch` claim when it is issued. Logging out everywhere or
+changing the password increments the counter, and tokens carrying an
+older epoch are rejected, however many there are. Epochs are cached per
+process for TOKEN_EPOCH_CACHE_TTL seconds, so checking them costs a query
+per user every few seconds rather than one per request. Bumps invalidate
+the entry in this process; other workers notice within the TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from utils.db import get_db
+
+CLAIM = 'token_epoch'
+
+# Module-level cache shared by every request thread in this process
+_epochs = None
+_epochs_lock = threading.Lock()
+
+class TokenEpochs:
+    """Short-TTL cache of users' current token epochs"""
+
+    def __init__(self, ttl_seconds=5, max_size=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def current(self, user_id, fresh=False):
+        """The user's epoch; fresh=True skips the cache (use when issuing tokens)"""
+        user_id = str(user_id)
+        now = time.monotonic()
+        if not fresh:
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    return entry[1]
+
+        try:
+            user = get_db().users.find_one({'_id': ObjectId(user_id)}, {CLAIM: 1})
+        except InvalidId:
+            return 0
+        epoch = (user or {}).get(CLAIM, 0)
+        self._remember(user_id, epoch, now)
+        return epoch
+
+    def bump(self, user_id):
+        """Invalidate every token issued to the user so far"""
+        user = get_db().users.find_one_and_update(
+            {'_id': ObjectId(user_id) if isinstance(user_id, str) else user_id},
+            {'$inc': {CLAIM: 1}},
+            projection={CLAIM: 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user:
+            self._remember(str(user_id), user[CLAIM], time.monotonic())
+        return user is not None
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def is_stale(self, jwt_payload):
+        """Whether a decoded token predates its user's current epoch"""
+        return jwt_payload.get(CLAIM, 0) < self.current(jwt_payload['sub'])
+
+    def _remember(self, user_id, epoch, now):
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl_seconds, epoch)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+def get_token_epochs(config):
+    """Get the process-wide token epoch cache, creating it from app config"""
+    global _epochs
+    if _epochs is None:
+        with _epochs_lock:
+            if _epochs is None:
+                _epochs = TokenEpochs(
+                    ttl_seconds=config.get('TOKEN_EPOCH_CACHE_TTL', 5),
+                    max_size=config.get('USER_CACHE_MAX_SIZE', 10000)
+                )
+    return _epochs
+
+def invalidate_token_epoch(user_id):
+    """Forget a cached epoch after the user document's epoch was changed directly"""
+    if _epochs is not None:
+        _epochs.invalidate(user_id)
@@ -0,0 +1,242 @@
+"""Mark-and-sweep collector for uploads that nothing refers to any more.
+
+Reference counts in `upload_blobs` only cover what goes through
+UploadStore.release(). Analyses removed from the database, items deleted
+before the blob store existed, or a crash between the two writes leave
+files behind. This collector works from the documents instead:
+
+- mark: stream every upload URL from wardrobe items, analyses,
+  recommendations and analysis jobs (legacy URLs through upload_aliases);
+- sweep: walk the storage listing in name order, deleting unreferenced
+  files last modified before the grace period, at a bounded rate.
+
+The sweep position is checkpointed in the `upload_gc` collection, so a run
+stopped after --batch files (or killed) resumes where it left off. Run it
+with `python -m utils.upload_gc [--dry-run]`, or set UPLOAD_GC_INTERVAL to
+sweep in the background (one worker at a time, via a lease).
+"""
+import argparse
+import datetime
+import re
+import threading
+import time
+import uuid
+from ai.single_flight import MongoLease
+from utils.db import get_db
+from utils.uploads import BLOB_NAME, BLOB_PREFIX, DERIVED_NAME, get_upload_store
+
+STATE_ID = 'sweep'
+CHECKPOINT_EVERY = 500
+
+# (collection, field) pairs holding upload URLs; fields may be lists
+REFERENCE_FIELDS = [
+    ('wardrobe_items', 'image'),
+    ('analyses', 'images'),
+    ('recommendations', 'image'),
+    ('analysis_jobs', 'images')
+]
+
+class RateLimiter:
+    """Spaces out operations to at most per_second (0 for no limit)"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(self.next_at, now) + self.interval
+
+def referenced_names(store, batch_size=1000):
+    """Mark phase: storage names of every upload referenced from the database"""
+    db = get_db()
+    names = set()
+    for collection, field in REFERENCE_FIELDS:
+        cursor = db[collection].find({field: {'$exists': True}}, {field: 1}).batch_size(batch_size)
+        for document in cursor:
+            urls = document.get(field)
+            for url in urls if isinstance(urls, list) else [urls]:
+                name = store.name_from_url(url) if isinstance(url, str) else None
+                if name:
+                    names.add(name)
+
+    # Legacy URLs keep the blob they were migrated to alive
+    legacy = [name for name in names if not name.startswith(BLOB_PREFIX + '/')]
+    for start in range(0, len(legacy), batch_size):
+        aliases = db.upload_aliases.find({'_id': {'$in': legacy[start:start + batch_size]}}, {'blob': 1})
+        names.update(alias['blob'] for alias in aliases)
+    return names
+
+class UploadCollector:
+    """Deletes unreferenced uploads older than grace_seconds"""
+
+    def __init__(self, store, grace_seconds=24 * 3600, max_ops_per_second=100, dry_run=False):
+        self.store = store
+        self.grace_seconds = grace_seconds
+        self.limiter = RateLimiter(max_ops_per_second)
+        self.dry_run = dry_run
+
+    def run(self, batch_size=None, restart=False):
+        """Sweep from the last checkpoint, stopping after batch_size files.
+
+        Returns a report with the files scanned and deleted, the bytes
+        reclaimed and whether the sweep reached the end of the listing.
+        """
+        db = get_db()
+        state = db.upload_gc.find_one({'_id': STATE_ID}) or {}
+        start_after = None if restart else state.get('after')
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.grace_seconds)
+
+        referenced = referenced_names(self.store)
+        referenced_digests = {match.group(1) for match in map(BLOB_NAME.match, referenced) if match}
+
+        report = {
+            'resumed_after': start_after,
+            'referenced': len(referenced),
+            'scanned': 0,
+            'deleted': 0,
+            'reclaimed_bytes': 0,
+            'complete': False,
+            'dry_run': self.dry_run
+        }
+        last = start_after
+        for name, size, modified in self.store.storage.list(start_after):
+            self.limiter.wait()
+            report['scanned'] += 1
+            last = name
+
+            if modified < cutoff and not self._is_referenced(name, referenced, referenced_digests):
+                if self.dry_run or self._collect(name, cutoff):
+                    report['deleted'] += 1
+                    report['reclaimed_bytes'] += size
+
+            if report['scanned'] % CHECKPOINT_EVERY == 0:
+                self._checkpoint(last)
+            if batch_size and report['scanned'] >= batch_size:
+                break
+        else:
+            report['complete'] = True
+
+        if not self.dry_run:
+            if report['complete']:
+                db.upload_gc.update_one(
+                    {'_id': STATE_ID},
+                    {'$set': {'after': None, 'completed_at': datetime.datetime.utcnow()}},
+                    upsert=True
+                )
+            else:
+                self._checkpoint(last)
+            db.upload_gc.update_one(
+                {'_id': STATE_ID},
+                {'$inc': {'reclaimed_bytes': report['reclaimed_bytes'], 'deleted': report['deleted']}},
+                upsert=True
+            )
+        return report
+
+    def _is_referenced(self, name, referenced, referenced_digests):
+        match = DERIVED_NAME.match(name)
+        if match:
+            digest = match.group(1)
+            if digest in referenced_digests:
+                return True
+            # A blob recently saved (but not referenced yet) keeps its derivatives
+            recent = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.grace_seconds)
+            return get_db().upload_blobs.find_one({
+                '_id': {'$regex': f"^{re.escape(self.store.blob_name(digest, ''))}"},
+                'updated_at': {'$gte': recent}
+            }) is not None
+        return name in referenced
+
+    def _collect(self, name, cutoff):
+        """Delete one orphan, returning False if it came back to life"""
+        if not BLOB_NAME.match(name):
+            # Legacy files and derivatives have no record to race with
+            self.store.storage.delete(name)
+            return True
+
+        # Same dance as UploadStore._reclaim: move aside, drop the record
+        # unless a save touched it after the cutoff, then decide
+        db = get_db()
+        tombstone = f"{BLOB_PREFIX}/.deleted/{uuid.uuid4().hex}"
+        if not self.store.storage.move(name, tombstone):
+            return False
+        db.upload_blobs.delete_one({'_id': name, 'updated_at': {'$lt': cutoff}})
+        if db.upload_blobs.find_one({'_id': name}):
+            self.store.storage.move(tombstone, name)
+            return False
+        self.store.storage.delete(tombstone)
+        db.upload_aliases.delete_many({'blob': name})
+        return True
+
+    def _checkpoint(self, name):
+        if self.dry_run:
+            return
+        get_db().upload_gc.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'after': name, 'updated_at': datetime.datetime.utcnow()}},
+            upsert=True
+        )
+
+def create_collector(config, dry_run=False):
+    """Build a collector for the upload store from app config"""
+    return UploadCollector(
+        get_upload_store(),
+        grace_seconds=config.get('UPLOAD_GC_GRACE', 24 * 3600),
+        max_ops_per_second=config.get('UPLOAD_GC_RATE', 100),
+        dry_run=dry_run
+    )
+
+def init_upload_gc(app):
+    """Sweep in a background thread every UPLOAD_GC_INTERVAL seconds (0 disables)"""
+    interval = app.config.get('UPLOAD_GC_INTERVAL', 0)
+    if not interval:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                # Only one worker process sweeps at a time
+                lease = MongoLease('upload-gc', ttl_seconds=interval)
+                try:
+                    if lease.acquire():
+                        report = create_collector(app.config).run(batch_size=app.config.get('UPLOAD_GC_BATCH', 10000))
+                        print(f"Upload GC: {report}")
+                except Exception as e:
+                    print(f"Upload GC failed: {e}")
+                finally:
+                    lease.release()
+
+    thread = threading.Thread(target=loop, name='upload-gc', daemon=True)
+    thread.start()
+    return thread
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete uploads no document refers to')
+    parser.add_argument('--dry-run', action='store_true', help='report orphans without deleting them')
+    parser.add_argument('--batch', type=int, help='stop after this many files (resume on the next run)')
+    parser.add_argument('--grace', type=int, help='only delete files older than this many seconds')
+    parser.add_argument('--rate', type=float, help='maximum files examined per second (0 for no limit)')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the beginning')
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        collector = create_collector(app.config, dry_run=args.dry_run)
+        if args.grace is not None:
+            collector.grace_seconds = args.grace
+        if args.rate is not None:
+            collector.limiter = RateLimiter(args.rate)
+        report = collector.run(batch_size=args.batch, restart=args.restart)
+
+    action = 'Would reclaim' if args.dry_run else 'Reclaimed'
+    print(f"Scanned {report['scanned']} files ({report['referenced']} referenced uploads): "
+          f"{action} {report['deleted']} files, {report['reclaimed_bytes'] / (1024 * 1024):.1f} MB"
+          f"{'' if report['complete'] else ' (partial, run again to continue)'}")
+
+if __name__ == '__main__':
+    main()
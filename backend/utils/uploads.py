@@ -0,0 +1,342 @@
+"""Content-addressable store for uploaded images.
+
+Each upload is hashed (SHA-256) while it streams to a temporary file and
+kept once as blobs/<h[0:2]>/<h[2:4]>/<hash>.<ext> in the configured
+storage driver (see utils/storage.py), however many users or items refer
+to it. The `upload_blobs` collection holds a reference count per blob;
+releasing the last reference deletes the file.
+
+Files uploaded before the store existed (UPLOAD_FOLDER/<user_id>/...) keep
+their URLs. `python -m utils.uploads migrate` moves them into the store and
+records each old path in `upload_aliases`, which uploaded_file() uses to
+resolve legacy URLs.
+"""
+import argparse
+import datetime
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import uuid
+from flask import abort, current_app, request
+from pymongo import ReturnDocument
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename, send_file
+from utils.db import get_db
+from utils.storage import LocalStorage, create_storage
+from utils.image_validation import create_image_validator
+from utils.derivatives import (
+    blob_name_from_path, delete_derivatives, derivative_name, schedule_derivatives
+)
+
+BLOB_PREFIX = 'blobs'
+CHUNK_SIZE = 1024 * 1024
+BLOB_NAME = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.\w+)?$')
+DERIVED_NAME = re.compile(r'^derived/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})/(\d+)\.(\w+)$')
+
+# Upload URLs never change content (blobs are named by hash, legacy files
+# by uuid), so browsers may cache them for good
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_store = None
+
+class UploadStore:
+    """Deduplicating, hash-sharded blob store on top of a storage driver.
+
+    `root` is the local upload folder, where legacy uploads live. New blobs
+    get resized copies at each of `derivative_sizes` (see utils/derivatives.py).
+    With a `validator` (utils/image_validation.py), save() only accepts
+    images within its limits.
+    """
+
+    def __init__(self, root, storage=None, derivative_sizes=(), derivative_workers=2, validator=None):
+        self.root = root
+        self.storage = storage or LocalStorage(root)
+        self.validator = validator
+        self.derivative_sizes = sorted(derivative_sizes)
+        self.derivative_workers = derivative_workers
+
+    @staticmethod
+    def blob_name(digest, ext):
+        """Storage name of the blob with this digest"""
+        return '/'.join([BLOB_PREFIX, digest[:2], digest[2:4], f"{digest}.{ext}" if ext else digest])
+
+    def local_path(self, name):
+        """Path of a readable local copy of a blob (downloaded if remote)"""
+        return self.storage.local_path(name)
+
+    def pick_derivative(self, name, size, accept_mimetypes):
+        """Choose the derivative to serve for ?size=, falling back to the blob.
+
+        Picks the smallest configured size at least as large as requested
+        (or the largest one), as WebP when the client accepts it.
+        """
+        if not self.derivative_sizes or not BLOB_NAME.match(name):
+            return name
+        fitting = [candidate for candidate in self.derivative_sizes if candidate >= size]
+        chosen_size = fitting[0] if fitting else self.derivative_sizes[-1]
+        ext = 'webp' if accept_mimetypes['image/webp'] else 'jpg'
+        derived = derivative_name(name, chosen_size, ext)
+        # Derivatives are generated in the background and may not exist yet
+        return derived if self.storage.exists(derived) else name
+
+    def derivative_path(self, local_path, size):
+        """Local path of a blob's JPEG derivative at exactly size, or None"""
+        name = blob_name_from_path(local_path)
+        if not name or size not in self.derivative_sizes:
+            return None
+        derived = derivative_name(name, size, 'jpg')
+        if not self.storage.exists(derived):
+            return None
+        return self.storage.local_path(derived)
+
+    def save(self, file, kind='upload'):
+        """Store an uploaded file, returning its local path and public URL.
+
+        The stream is hashed as it is copied, so identical bytes are only
+        kept once and just gain a reference. Raises InvalidImage if the
+        validator rejects the upload; nothing is stored in that case.
+        """
+        filename = secure_filename(file.filename or '')
+        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+        digest = hashlib.sha256()
+        size = 0
+        image_format = None
+        fd, tmp_path = tempfile.mkstemp(dir=self.storage.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if self.validator:
+                        if image_format is None:
+                            # The blob is named after what the bytes are, not the filename
+                            image_format = self.validator.check_format(chunk)
+                            ext = image_format[1]
+                        self.validator.check_size(size + len(chunk))
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+
+            if self.validator:
+                if image_format is None:
+                    image_format = self.validator.check_format(b'')
+                self.validator.check_image(tmp_path, image_format)
+
+            name = self.blob_name(digest.hexdigest(), ext)
+            self._add_ref(name, size, kind)
+
+            # The blob may have been released (and its file removed) between
+            # the two calls, so write it whenever it is missing
+            if not self.storage.exists(name):
+                self.storage.save_file(name, tmp_path)
+                if self.derivative_sizes:
+                    schedule_derivatives(self.storage, name, self.derivative_sizes, self.derivative_workers)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return self.storage.local_path(name), f"/uploads/{name}"
+
+    def release(self, url):
+        """Drop one reference to an uploaded file, deleting it with the last one"""
+        name = self.name_from_url(url)
+        if not name:
+            return False
+
+        db = get_db()
+        if not name.startswith(BLOB_PREFIX + '/'):
+            # Legacy URL: release the blob it was migrated to, if any
+            alias = db.upload_aliases.find_one_and_delete({'_id': name})
+            if not alias:
+                return False
+            name = alias['blob']
+
+        blob = db.upload_blobs.find_one_and_update(
+            {'_id': name},
+            {'$inc': {'refcount': -1}, '$set': {'updated_at': datetime.datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob and blob['refcount'] <= 0:
+            self._reclaim(name)
+        return True
+
+    def resolve(self, name):
+        """Map a legacy upload path to the blob it was migrated to"""
+        alias = get_db().upload_aliases.find_one({'_id': name})
+        return alias['blob'] if alias else None
+
+    @staticmethod
+    def name_from_url(url):
+        if not url or not url.startswith('/uploads/'):
+            return None
+        return url[len('/uploads/'):]
+
+    def _add_ref(self, name, size, kind, count=1):
+        now = datetime.datetime.utcnow()
+        get_db().upload_blobs.update_one(
+            {'_id': name},
+            {
+                '$inc': {'refcount': count},
+                '$set': {'updated_at': now},
+                '$setOnInsert': {'size': size, 'kind': kind, 'created_at': now}
+            },
+            upsert=True
+        )
+
+    def _reclaim(self, name):
+        """Delete an unreferenced blob without racing a concurrent save.
+
+        The file is first moved aside, then the record is deleted only if it
+        is still unreferenced. If a save revived it meanwhile, the file is
+        moved back (a concurrent save rewrites it if it looked missing).
+        """
+        tombstone = f"{BLOB_PREFIX}/.deleted/{uuid.uuid4().hex}"
+        moved = self.storage.move(name, tombstone)
+
+        result = get_db().upload_blobs.delete_one({'_id': name, 'refcount': {'$lte': 0}})
+        if not moved:
+            return
+        if result.deleted_count:
+            self.storage.delete(tombstone)
+            delete_derivatives(self.storage, name, self.derivative_sizes)
+        else:
+            self.storage.move(tombstone, name)
+
+    def migrate_legacy(self, dry_run=False):
+        """Move pre-store uploads into the blob store, keeping their URLs.
+
+        Returns (files migrated, bytes reclaimed by deduplication).
+        """
+        db = get_db()
+        migrated = 0
+        reclaimed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            relative_dir = os.path.relpath(dirpath, self.root)
+            if relative_dir.split(os.sep)[0] == BLOB_PREFIX:
+                dirnames[:] = []
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                legacy_name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if db.upload_aliases.find_one({'_id': legacy_name}):
+                    continue
+
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+                name = self.blob_name(digest.hexdigest(), ext)
+                size = os.path.getsize(path)
+                exists = self.storage.exists(name)
+
+                if dry_run:
+                    migrated += 1
+                    reclaimed += size if exists else 0
+                    continue
+
+                self._add_ref(name, size, 'legacy')
+                if exists:
+                    os.remove(path)
+                    reclaimed += size
+                else:
+                    self.storage.save_file(name, path)
+                db.upload_aliases.insert_one({'_id': legacy_name, 'blob': name})
+                migrated += 1
+        return migrated, reclaimed
+
+def content_etag(name):
+    """Strong ETag for content-addressed names (blobs and their derivatives)"""
+    match = BLOB_NAME.match(name)
+    if match:
+        return match.group(1)
+    match = DERIVED_NAME.match(name)
+    if match:
+        return '-'.join(match.groups())
+    return None
+
+def send_upload(name):
+    """Serve a file under UPLOAD_FOLDER with long-lived caching headers.
+
+    Blobs and derivatives get their SHA-256 as a strong ETag, so revalidations are answered
+    with 304 without touching the disk. Range requests get 206. With
+    UPLOAD_SENDFILE_MODE set, the front-end server sends the bytes instead:
+
+    - 'x-accel' (nginx) returns an empty response with X-Accel-Redirect
+      pointing at UPLOAD_ACCEL_PREFIX + name, for a location such as
+      `location /protected-uploads/ { internal; alias /app/uploads/; }`.
+    - 'x-sendfile' (Apache mod_xsendfile, lighttpd) returns X-Sendfile.
+    """
+    config = current_app.config
+    etag = content_etag(name)
+
+    if etag and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    path = safe_join(config['UPLOAD_FOLDER'], name)
+    if path is None:
+        abort(404)
+
+    mode = config.get('UPLOAD_SENDFILE_MODE')
+    if mode == 'x-accel':
+        if not os.path.isfile(path):
+            abort(404)
+        response = current_app.response_class(mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{config.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/').rstrip('/')}/{name}"
+        if etag:
+            response.set_etag(etag)
+    else:
+        # send_file answers If-None-Match with 304 and Range with 206
+        try:
+            response = send_file(
+                path,
+                request.environ,
+                etag=etag or True,
+                use_x_sendfile=mode == 'x-sendfile',
+                response_class=current_app.response_class
+            )
+        except (FileNotFoundError, IsADirectoryError):
+            abort(404)
+        response.headers['Accept-Ranges'] = 'bytes'
+
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+def init_upload_store(app):
+    """Create the upload store from app config"""
+    global _store
+    _store = UploadStore(
+        app.config['UPLOAD_FOLDER'],
+        create_storage(app.config),
+        derivative_sizes=app.config.get('UPLOAD_DERIVATIVE_SIZES', []),
+        derivative_workers=app.config.get('UPLOAD_DERIVATIVE_WORKERS', 2),
+        validator=create_image_validator(app.config)
+    )
+    return _store
+
+def get_upload_store():
+    """Get the upload store"""
+    if _store is None:
+        raise Exception("Upload store not initialized")
+    return _store
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the content-addressable upload store')
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        migrated, reclaimed = get_upload_store().migrate_legacy(dry_run=args.dry_run)
+    print(f"Migrated {migrated} legacy uploads, {reclaimed / (1024 * 1024):.1f} MB saved by deduplication")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Short-lived, in-process cache of the users behind JWTs.
+
+Every @jwt_required() route needs the current user. The JWT user loader in
+app.py reads it from here, so a burst of requests from one client costs a
+single users query per USER_CACHE_TTL seconds instead of one per request.
+The password hash is never loaded. User.update_profile/update_preferences
+invalidate the entry in this process; other workers see changes once
+their entry expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+from bson import ObjectId
+from bson.errors import InvalidId
+from utils.db import get_db
+
+USER_PROJECTION = {'password': 0}
+
+# Module-level cache shared by every request thread in this process
+_cache = None
+_cache_lock = threading.Lock()
+
+class UserCache:
+    """TTL + LRU cache of user documents keyed by id string"""
+
+    def __init__(self, ttl_seconds=30, max_size=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the user document (without password), or None if there is none"""
+        user_id = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return dict(entry[1])
+
+        try:
+            user = get_db().users.find_one({'_id': ObjectId(user_id)}, USER_PROJECTION)
+        except InvalidId:
+            return None
+        if not user:
+            return None
+
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl_seconds, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return dict(user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+def get_user_cache(config):
+    """Get the process-wide user cache, creating it from app config"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserCache(
+                    ttl_seconds=config.get('USER_CACHE_TTL', 30),
+                    max_size=config.get('USER_CACHE_MAX_SIZE', 10000)
+                )
+    return _cache
+
+def invalidate_user(user_id):
+    """Drop a user from the cache after their document changed"""
+    if _cache is not None:
+        _cache.invalidate(user_id)